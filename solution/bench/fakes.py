@@ -0,0 +1,220 @@
+from contextlib import contextmanager
+from typing import Any, Dict, Generator, List, Optional
+
+from lib.kafka_connect import JsonSerializer, KafkaMessage, json_serializer
+
+
+class FakeConsumer:
+    # Заранее сериализованные сообщения одной партиции; разбор идёт тем же сериализатором, что и в сервисе
+    def __init__(self, values: List[bytes], serializer: Optional[JsonSerializer] = None, topic: str = 'bench',
+                 headers: Optional[List[Dict[str, bytes]]] = None) -> None:
+        self.topic = topic
+        self.serializer = serializer or json_serializer()
+        self._values = values
+        self._headers = headers or [{} for _ in values]
+        self._position = 0
+        self._committed = 0
+        self.commits = 0
+
+    def consume_batch(self, max_messages: int, timeout: float = 3.0) -> List[KafkaMessage]:
+        batch = []
+        for offset in range(self._position, min(self._position + max_messages, len(self._values))):
+            try:
+                value, error = self.serializer.loads_message(self._values[offset], self._headers[offset]), None
+            except (TypeError, ValueError) as e:
+                value, error = None, str(e)
+            batch.append(KafkaMessage(
+                self.topic, 0, offset, None, value, error, self._values[offset], self._headers[offset]))
+        self._position += len(batch)
+        return batch
+
+    def add_rebalance_listener(self, listener) -> None:
+        # Одна партиция, назначенная навсегда — ребалансировок не бывает
+        pass
+
+    def commit(self) -> None:
+        if self._position != self._committed:
+            self._committed = self._position
+            self.commits += 1
+
+    def rewind(self) -> None:
+        self._position = self._committed
+
+    def lag(self) -> Dict[int, int]:
+        return {0: len(self._values) - self._position}
+
+    def close(self) -> None:
+        pass
+
+
+class FakeProducer:
+    def __init__(self, serializer: Optional[JsonSerializer] = None) -> None:
+        self.serializer = serializer or json_serializer()
+        self.messages: List[bytes] = []
+        self.headers: List[Dict[str, bytes]] = []
+        self.flushes = 0
+
+    def produce(self, payload: Any, on_delivery=None, key=None, headers=None) -> None:
+        self.messages.append(self.serializer.dumps(payload))
+        # Как их отдаёт librdkafka на стороне consumer'а: значения заголовков — bytes
+        self.headers.append({name: value.encode() for name, value in headers or ()})
+
+    def flush(self, timeout: float = 10) -> None:
+        self.flushes += 1
+
+
+class RoundTrips:
+    def __init__(self) -> None:
+        self.statements = 0
+        self.round_trips = 0
+        self.commits = 0
+        self.connections = 0
+
+
+class ConnectionTracker:
+    # Вне pipeline каждый запрос — отдельный round trip. В pipeline запросы копятся,
+    # а round trip случается на первом чтении результата и на выходе из pipeline.
+    def __init__(self, counter: RoundTrips) -> None:
+        self.counter = counter
+        self.in_pipeline = False
+        self.pending = False
+
+    def executed(self) -> None:
+        self.counter.statements += 1
+        if self.in_pipeline:
+            self.pending = True
+        else:
+            self.counter.round_trips += 1
+
+    def fetched(self) -> None:
+        if self.in_pipeline and self.pending:
+            self.counter.round_trips += 1
+            self.pending = False
+
+    def committed(self) -> None:
+        self.counter.round_trips += 1
+        self.counter.commits += 1
+
+    @contextmanager
+    def pipeline(self) -> Generator[None, None, None]:
+        self.in_pipeline, self.pending = True, False
+        try:
+            yield
+        finally:
+            if self.pending:
+                self.counter.round_trips += 1
+            self.in_pipeline, self.pending = False, False
+
+
+class RecordingCursor:
+    # Результаты эмулируются ровно настолько, насколько их читают репозитории:
+    # вставка хабов возвращает все ключи, claim_orders считает все заказы новыми, остальное пусто
+    def __init__(self, connection: 'RecordingConnection') -> None:
+        self.connection = connection
+        self.itersize = 0
+        self._rows: List[tuple] = []
+
+    def __enter__(self) -> 'RecordingCursor':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        pass
+
+    def execute(self, query, params=None, **kwargs) -> 'RecordingCursor':
+        self.connection.tracker.executed()
+        query = str(query)
+        self._rows = []
+        if 'RETURNING' in query and isinstance(params, dict) and 'bk' in params:
+            self._rows = list(zip(params['pk'], params['bk']))
+        elif 'RETURNING object_id' in query:
+            self._rows = [(object_id,) for object_id in params[1]]
+        return self
+
+    def fetchone(self) -> Optional[tuple]:
+        self.connection.tracker.fetched()
+        return self._rows[0] if self._rows else None
+
+    def fetchall(self) -> List[tuple]:
+        self.connection.tracker.fetched()
+        return self._rows
+
+    def __iter__(self):
+        return iter(self.fetchall())
+
+
+class RecordingConnection:
+    def __init__(self, counter: RoundTrips) -> None:
+        self.tracker = ConnectionTracker(counter)
+
+    def cursor(self, *args, **kwargs) -> RecordingCursor:
+        return RecordingCursor(self)
+
+    def execute(self, query, params=None, **kwargs) -> RecordingCursor:
+        return self.cursor().execute(query, params)
+
+    def pipeline(self):
+        return self.tracker.pipeline()
+
+
+class RecordingPgConnect:
+    # Замена PgConnect без БД: считает запросы, round trip'ы и commit'ы
+    def __init__(self, counter: Optional[RoundTrips] = None) -> None:
+        self.counter = counter or RoundTrips()
+
+    @contextmanager
+    def connection(self) -> Generator[RecordingConnection, None, None]:
+        self.counter.connections += 1
+        conn = RecordingConnection(self.counter)
+        yield conn
+        conn.tracker.committed()
+
+    def close(self) -> None:
+        pass
+
+
+class CountingPgConnect:
+    # Настоящий Postgres с тем же учётом round trip'ов; одно соединение переиспользуется, как в пуле
+    def __init__(self, uri: str, counter: Optional[RoundTrips] = None) -> None:
+        import psycopg
+
+        class CountingCursor(psycopg.Cursor):
+            def execute(self, query, params=None, **kwargs):
+                self.connection.tracker.executed()
+                return super().execute(query, params, **kwargs)
+
+            def fetchone(self):
+                self.connection.tracker.fetched()
+                return super().fetchone()
+
+            def fetchall(self):
+                self.connection.tracker.fetched()
+                return super().fetchall()
+
+        class CountingConnection(psycopg.Connection):
+            @contextmanager
+            def pipeline(self):
+                with self.tracker.pipeline(), super().pipeline() as pipeline:
+                    yield pipeline
+
+        self.uri = uri
+        self.counter = counter or RoundTrips()
+        self._connect = lambda: CountingConnection.connect(uri, cursor_factory=CountingCursor)
+        self._conn = None
+
+    @contextmanager
+    def connection(self) -> Generator[Any, None, None]:
+        if self._conn is None or self._conn.closed:
+            self._conn = self._connect()
+            self._conn.tracker = ConnectionTracker(self.counter)
+        self.counter.connections += 1
+        try:
+            yield self._conn
+            self._conn.commit()
+            self._conn.tracker.committed()
+        except Exception:
+            self._conn.rollback()
+            raise
+
+    def close(self) -> None:
+        if self._conn is not None:
+            self._conn.close()
@@ -0,0 +1,83 @@
+import random
+from datetime import datetime, timedelta
+from typing import Dict, List
+
+STATUSES = ['OPEN', 'COOKING', 'DELIVERING', 'CLOSED', 'CANCELLED']
+
+
+class OrderGenerator:
+    # Синтетические заказы в формате, который ожидает DdsMessageProcessor
+    def __init__(self,
+                 min_products: int = 1,
+                 max_products: int = 5,
+                 users: int = 1000,
+                 restaurants: int = 50,
+                 products: int = 500,
+                 categories: int = 20,
+                 update_ratio: float = 0.2,
+                 seed: int = 42
+                 ) -> None:
+        self.min_products = min_products
+        self.max_products = max_products
+        self.users = users
+        self.restaurants = restaurants
+        self.products = products
+        self.categories = categories
+        # Доля сообщений, которые повторно присылают уже отправленный заказ с новым статусом
+        self.update_ratio = update_ratio
+        self._random = random.Random(seed)
+        self._sent: List[Dict] = []
+        self._next_id = 1
+        self._start = datetime(2024, 1, 1)
+
+    def messages(self, count: int) -> List[Dict]:
+        return [self.message() for _ in range(count)]
+
+    def message(self) -> Dict:
+        if self._sent and self._random.random() < self.update_ratio:
+            return self._update(self._random.randrange(len(self._sent)))
+        msg = self._new_order()
+        self._sent.append(msg)
+        return msg
+
+    def _new_order(self) -> Dict:
+        order_id = self._next_id
+        self._next_id += 1
+        user = self._random.randrange(self.users)
+        restaurant = self._random.randrange(self.restaurants)
+        product_ids = self._random.sample(
+            range(self.products), self._random.randint(self.min_products, self.max_products))
+        products = [
+            {
+                "id": f"product-{p}",
+                "name": f"Product {p}",
+                "category": f"Category {p % self.categories}",
+                "price": 100 + p % 400,
+                "quantity": self._random.randint(1, 3),
+            }
+            for p in product_ids
+        ]
+        cost = sum(p["price"] * p["quantity"] for p in products)
+        return {
+            "object_id": order_id,
+            "object_type": "order",
+            "payload": {
+                "id": order_id,
+                "date": (self._start + timedelta(seconds=order_id)).strftime('%Y-%m-%d %H:%M:%S'),
+                "cost": cost,
+                "payment": cost,
+                "status": STATUSES[0],
+                "restaurant": {"id": f"restaurant-{restaurant}", "name": f"Restaurant {restaurant}"},
+                "user": {"id": f"user-{user}", "name": f"User {user}", "login": f"user{user}"},
+                "products": products,
+            },
+        }
+
+    def _update(self, index: int) -> Dict:
+        msg = self._sent[index]
+        payload = dict(msg["payload"])
+        status = STATUSES.index(payload["status"])
+        payload["status"] = STATUSES[min(status + 1, len(STATUSES) - 1)]
+        updated = dict(msg, payload=payload)
+        self._sent[index] = updated
+        return updated
@@ -0,0 +1,182 @@
+import argparse
+import json
+import logging
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+SOLUTION_DIR = os.path.dirname(BENCH_DIR)
+SERVICES = {
+    'dds': os.path.join(SOLUTION_DIR, 'service_dds', 'src'),
+    'cdm': os.path.join(SOLUTION_DIR, 'service_cdm', 'src'),
+}
+
+# Запуск из каталога solution:
+#   python bench/run_bench.py --messages 10000
+#   python bench/run_bench.py --messages 10000 --pg-uri postgresql://... --init-schema
+# С --pg-uri сервисы пишут в настоящие таблицы dds/cdm — используйте отдельную базу.
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description='DDS/CDM throughput and latency benchmark')
+    parser.add_argument('--messages', type=int, default=5000)
+    parser.add_argument('--min-products', type=int, default=1)
+    parser.add_argument('--max-products', type=int, default=5)
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--restaurants', type=int, default=50)
+    parser.add_argument('--products', type=int, default=500)
+    parser.add_argument('--categories', type=int, default=20)
+    parser.add_argument('--update-ratio', type=float, default=0.2)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--batch-size', type=int, default=100)
+    parser.add_argument('--dds-key-mode', default='random')
+    parser.add_argument('--dds-cache-size', type=int, default=10000)
+    parser.add_argument('--no-pipeline', action='store_true')
+    parser.add_argument('--serializer', default='auto')
+    parser.add_argument('--output-format', default='json', help='формат сообщений DDS -> CDM: json или compact')
+    parser.add_argument('--pg-uri', help='Postgres для прогона; без него используется RecordingPgConnect')
+    parser.add_argument('--init-schema', action='store_true', help='создать таблицы dds/cdm из bench/schema.sql')
+    parser.add_argument('--service', choices=sorted(SERVICES), help=argparse.SUPPRESS)
+    parser.add_argument('--input', help=argparse.SUPPRESS)
+    parser.add_argument('--output', help=argparse.SUPPRESS)
+    return parser.parse_args()
+
+
+def percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(int(len(values) * q), len(values) - 1)]
+
+
+def drive(processor, consumer, counter, total: int, batch_size: int) -> Dict:
+    # Латентность сообщения — время обработки батча, в котором оно пришло (от чтения до commit offset'ов)
+    latencies = []
+    started = time.perf_counter()
+    while True:
+        batch_started = time.perf_counter()
+        count = processor.run(batch_size, 0)
+        if not count:
+            break
+        latencies.extend([time.perf_counter() - batch_started] * count)
+    elapsed = time.perf_counter() - started
+    return {
+        'messages': total,
+        'seconds': round(elapsed, 3),
+        'msgs_per_sec': round(total / elapsed, 1) if elapsed else 0.0,
+        'p50_ms': round(percentile(latencies, 0.5) * 1000, 3),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 3),
+        'statements_per_msg': round(counter.statements / total, 3),
+        'round_trips_per_msg': round(counter.round_trips / total, 3),
+        'db_commits_per_msg': round(counter.commits / total, 3),
+        'kafka_commits': consumer.commits,
+    }
+
+
+def run_service(args: argparse.Namespace) -> Dict:
+    sys.path.insert(0, SERVICES[args.service])
+    sys.path.insert(1, BENCH_DIR)
+    from fakes import CountingPgConnect, FakeConsumer, FakeProducer, RecordingPgConnect
+    from lib.kafka_connect import ModelSerializer, json_serializer
+
+    logger = logging.getLogger(f'bench-{args.service}')
+    logger.setLevel(logging.ERROR)
+    db = CountingPgConnect(args.pg_uri) if args.pg_uri else RecordingPgConnect()
+    with open(args.input, 'rb') as f:
+        values = f.read().splitlines()
+    # Заголовки сообщений DDS лежат рядом с телами, по строке JSON на сообщение
+    headers = None
+    if os.path.exists(args.input + '.headers'):
+        with open(args.input + '.headers') as f:
+            headers = [{name: value.encode() for name, value in json.loads(line).items()} for line in f]
+    serializer = json_serializer(args.serializer)
+
+    if args.service == 'dds':
+        from dds_loader.dds_message_processor_job import DdsMessageProcessor
+        from dds_loader.order_messages import OrderMessage
+        from dds_loader.repository import DdsCache, DdsKeys, DdsRepository
+
+        consumer = FakeConsumer(values, ModelSerializer(OrderMessage, serializer))
+        producer = FakeProducer(serializer)
+        repository = DdsRepository(
+            db, DdsKeys(args.dds_key_mode), DdsCache(args.dds_cache_size), not args.no_pipeline)
+        processor = DdsMessageProcessor(consumer, producer, repository, logger, output_format=args.output_format)
+    else:
+        from cdm_loader.cdm_message_processor_job import CdmMessageProcessor
+        from cdm_loader.repository.cdm_repository import CdmRepository
+        from lib.order_format import OrderFormatSerializer
+
+        consumer = FakeConsumer(values, OrderFormatSerializer(serializer), headers=headers)
+        producer = None
+        repository = CdmRepository(db)
+        if args.pg_uri:
+            repository.ensure_schema()
+            db.counter.__init__()
+        processor = CdmMessageProcessor(consumer, repository, db, logger)
+
+    result = drive(processor, consumer, db.counter, len(values), args.batch_size)
+    result['input_bytes_per_msg'] = round(sum(map(len, values)) / len(values), 1) if values else 0.0
+    if producer is not None and args.output:
+        with open(args.output, 'wb') as f:
+            f.write(b'\n'.join(producer.messages))
+        with open(args.output + '.headers', 'w') as f:
+            f.write('\n'.join(json.dumps({name: value.decode() for name, value in message_headers.items()})
+                              for message_headers in producer.headers))
+    db.close()
+    return result
+
+
+def init_schema(uri: str) -> None:
+    import psycopg
+    with open(os.path.join(BENCH_DIR, 'schema.sql')) as f:
+        ddl = f.read()
+    with psycopg.connect(uri, autocommit=True) as conn:
+        conn.execute(ddl)
+
+
+def main() -> None:
+    args = parse_args()
+    if args.service:
+        print(json.dumps(run_service(args)))
+        return
+
+    sys.path.insert(0, BENCH_DIR)
+    from orders import OrderGenerator
+
+    if args.pg_uri and args.init_schema:
+        init_schema(args.pg_uri)
+
+    generator = OrderGenerator(
+        args.min_products, args.max_products, args.users, args.restaurants,
+        args.products, args.categories, args.update_ratio, args.seed)
+    # Каждый сервис запускается отдельным процессом: у них свои копии пакета lib
+    with tempfile.TemporaryDirectory() as tmp:
+        dds_input = os.path.join(tmp, 'dds_input.jsonl')
+        cdm_input = os.path.join(tmp, 'cdm_input.jsonl')
+        with open(dds_input, 'w') as f:
+            f.write('\n'.join(json.dumps(msg) for msg in generator.messages(args.messages)))
+
+        passthrough = [arg for arg in sys.argv[1:] if arg != '--init-schema']
+        results = {}
+        for service, source, target in (('dds', dds_input, cdm_input), ('cdm', cdm_input, None)):
+            command = [sys.executable, os.path.abspath(__file__), *passthrough,
+                       '--service', service, '--input', source]
+            if target:
+                command += ['--output', target]
+            output = subprocess.run(command, check=True, capture_output=True, text=True).stdout
+            results[service] = json.loads(output.strip().splitlines()[-1])
+
+    backend = 'postgres' if args.pg_uri else 'recording fake'
+    print(f"{args.messages} messages, batch size {args.batch_size}, db: {backend}")
+    columns = list(results['dds'])
+    print(f"{'metric':<22}" + ''.join(f'{service:>14}' for service in results))
+    for column in columns:
+        print(f'{column:<22}' + ''.join(f'{results[service][column]:>14}' for service in results))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,19 @@
+-- Схема для прогона бенчмарка на отдельной базе (python bench/run_bench.py --pg-uri ... --init-schema)
+CREATE SCHEMA IF NOT EXISTS dds;
+CREATE SCHEMA IF NOT EXISTS cdm;
+CREATE TABLE IF NOT EXISTS dds.h_order (h_order_pk uuid PRIMARY KEY, order_id varchar UNIQUE NOT NULL, order_dt timestamp, load_dt timestamp, load_src varchar);
+CREATE TABLE IF NOT EXISTS dds.h_user (h_user_pk uuid PRIMARY KEY, user_id varchar UNIQUE NOT NULL, load_dt timestamp, load_src varchar);
+CREATE TABLE IF NOT EXISTS dds.h_restaurant (h_restaurant_pk uuid PRIMARY KEY, restaurant_id varchar UNIQUE NOT NULL, load_dt timestamp, load_src varchar);
+CREATE TABLE IF NOT EXISTS dds.h_product (h_product_pk uuid PRIMARY KEY, product_id varchar UNIQUE NOT NULL, load_dt timestamp, load_src varchar);
+CREATE TABLE IF NOT EXISTS dds.h_category (h_category_pk uuid PRIMARY KEY, category_name varchar UNIQUE NOT NULL, load_dt timestamp, load_src varchar);
+CREATE TABLE IF NOT EXISTS dds.s_order_cost (h_order_pk uuid REFERENCES dds.h_order, cost numeric, payment numeric, load_dt timestamp, load_src varchar, hk_order_cost_hashdiff varchar, PRIMARY KEY (h_order_pk, load_dt));
+CREATE TABLE IF NOT EXISTS dds.s_order_status (h_order_pk uuid REFERENCES dds.h_order, status varchar, load_dt timestamp, load_src varchar, hk_order_status_hashdiff varchar, PRIMARY KEY (h_order_pk, load_dt));
+CREATE TABLE IF NOT EXISTS dds.s_user_names (h_user_pk uuid REFERENCES dds.h_user, username varchar, userlogin varchar, load_dt timestamp, load_src varchar, hk_user_names_hashdiff varchar, PRIMARY KEY (h_user_pk, load_dt));
+CREATE TABLE IF NOT EXISTS dds.s_restaurant_names (h_restaurant_pk uuid REFERENCES dds.h_restaurant, name varchar, load_dt timestamp, load_src varchar, hk_restaurant_names_hashdiff varchar, PRIMARY KEY (h_restaurant_pk, load_dt));
+CREATE TABLE IF NOT EXISTS dds.s_product_names (h_product_pk uuid REFERENCES dds.h_product, name varchar, load_dt timestamp, load_src varchar, hk_product_names_hashdiff varchar, PRIMARY KEY (h_product_pk, load_dt));
+CREATE TABLE IF NOT EXISTS dds.l_order_user (hk_order_user_pk uuid PRIMARY KEY, h_order_pk uuid REFERENCES dds.h_order, h_user_pk uuid REFERENCES dds.h_user, load_dt timestamp, load_src varchar, UNIQUE (h_order_pk, h_user_pk));
+CREATE TABLE IF NOT EXISTS dds.l_order_product (hk_order_product_pk uuid PRIMARY KEY, h_order_pk uuid REFERENCES dds.h_order, h_product_pk uuid REFERENCES dds.h_product, quantity integer, load_dt timestamp, load_src varchar, UNIQUE (h_order_pk, h_product_pk));
+CREATE TABLE IF NOT EXISTS dds.l_product_category (hk_product_category_pk uuid PRIMARY KEY, h_product_pk uuid REFERENCES dds.h_product, h_category_pk uuid REFERENCES dds.h_category, load_dt timestamp, load_src varchar, UNIQUE (h_product_pk, h_category_pk));
+CREATE TABLE IF NOT EXISTS dds.l_product_restaurant (hk_product_restaurant_pk uuid PRIMARY KEY, h_product_pk uuid REFERENCES dds.h_product, h_restaurant_pk uuid REFERENCES dds.h_restaurant, load_dt timestamp, load_src varchar, UNIQUE (h_product_pk, h_restaurant_pk));
+CREATE TABLE IF NOT EXISTS cdm.user_product_counters (id serial, user_id uuid NOT NULL, product_id uuid NOT NULL, product_name varchar NOT NULL, order_cnt int NOT NULL DEFAULT 0, UNIQUE (user_id, product_id));
+CREATE TABLE IF NOT EXISTS cdm.user_category_counters (id serial, user_id uuid NOT NULL, category_id uuid NOT NULL, category_name varchar NOT NULL, order_cnt int NOT NULL DEFAULT 0, UNIQUE (user_id, category_id));
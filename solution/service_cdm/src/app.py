@@ -1,39 +1,199 @@
 import logging
+import signal
+import sys
+
 from apscheduler.schedulers.background import BackgroundScheduler
-from flask import Flask
+from flask import Flask, Response, jsonify, request
 
 from app_config import AppConfig
+from cdm_loader.async_cdm_message_processor_job import AsyncCdmMessageProcessor
 from cdm_loader.cdm_message_processor_job import CdmMessageProcessor
+from cdm_loader.counter_queries import CounterQueries
+from cdm_loader.repository import AsyncCdmRepository, CdmCounterReader
 from cdm_loader.repository.cdm_repository import CdmRepository
+from lib.kafka_connect import AsyncDeadLetterQueue, AsyncKafkaConsumer
+from lib.streaming import AsyncWorkerPool, WorkerPool
 
 app = Flask(__name__)
 
 config = AppConfig()
+counter_cache = config.counter_cache()
+counter_queries = None
 
 @app.get('/health')
 def hello_world():
     return 'healthy'
 
+@app.get('/metrics')
+def metrics():
+    return Response(config.metrics.render(), mimetype='text/plain; version=0.0.4')
+
+def user_ids_arg():
+    return [user_id for value in request.args.getlist('user_id') for user_id in value.split(',') if user_id]
+
+def top_response(kind: str, user_ids, single: bool):
+    if counter_queries is None:
+        return jsonify(error='Service is starting'), 503
+    try:
+        users, etag = counter_queries.top(kind, user_ids, int(request.args.get('limit', 10)))
+    except ValueError as e:
+        return jsonify(error=str(e)), 400
+
+    if single:
+        user_id, rows = next(iter(users.items()))
+        body = {'user_id': user_id, kind: rows}
+    else:
+        body = {'users': [{'user_id': user_id, kind: rows} for user_id, rows in users.items()]}
+    # Клиент с тем же ETag получает 304 без тела
+    response = jsonify(body)
+    response.set_etag(etag)
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
+
+@app.get('/users/<user_id>/top-products')
+def user_top_products(user_id: str):
+    return top_response('products', [user_id], single=True)
+
+@app.get('/users/<user_id>/top-categories')
+def user_top_categories(user_id: str):
+    return top_response('categories', [user_id], single=True)
+
+@app.get('/top-products')
+def top_products():
+    # Несколько пользователей: ?user_id=a&user_id=b или ?user_id=a,b
+    return top_response('products', user_ids_arg(), single=False)
+
+@app.get('/top-categories')
+def top_categories():
+    return top_response('categories', user_ids_arg(), single=False)
+
+def collect_read_cache_stats(metrics) -> None:
+    stats = counter_cache.stats()
+    for name, value in stats.items():
+        metrics.set(f'cdm_read_cache_{name}', value)
+    lookups = stats['hits'] + stats['misses']
+    if lookups:
+        metrics.set('cdm_read_cache_hit_ratio', stats['hits'] / lookups)
+
+def start_read_api(db) -> None:
+    global counter_queries
+    counter_queries = CounterQueries(CdmCounterReader(db, config.metrics), counter_cache)
+    config.metrics.collector(collect_read_cache_stats)
+
+def start_async_workers() -> AsyncWorkerPool:
+    # Схема создаётся синхронным соединением без пула, дальше работает только асинхронный пул
+    CdmRepository(config.pg_warehouse_db(pooled=False), config.metrics).ensure_schema(
+        check_only=config.migrations_mode == 'check')
+    # API чтения обслуживают потоки Flask, ему нужен синхронный пул
+    start_read_api(config.pg_warehouse_db())
+    pg_connect = config.pg_warehouse_async_db()
+    cdm_repository = AsyncCdmRepository(pg_connect, config.metrics)
+
+    consumers = []
+    loops = []
+    for worker in range(config.workers):
+        consumer = AsyncKafkaConsumer(config.kafka_consumer(app.logger, worker))
+        consumers.append(consumer)
+        processor = AsyncCdmMessageProcessor(
+            consumer=consumer,
+            cdm_repository=cdm_repository,
+            logger=app.logger,
+            metrics=config.metrics,
+            dead_letters=AsyncDeadLetterQueue(config.dead_letter_queue(app.logger)),
+            retry=config.retry_policy(),
+            concurrency=config.async_concurrency,
+            counter_cache=counter_cache
+        )
+        loops.append(config.async_stream_loop(processor.run, consumer.lag, app.logger, worker))
+
+    async def shutdown() -> None:
+        # Выходим из consumer group и закрываем пул в том же event loop, где он работал
+        for consumer in consumers:
+            await consumer.close()
+        await pg_connect.close()
+
+    pool = AsyncWorkerPool(loops, startup=pg_connect.open, shutdown=shutdown)
+    pool.start()
+    return pool
+
+
 if __name__ == '__main__':
     app.logger.setLevel(logging.INFO)
-    
+
+    if config.run_mode == 'async':
+        async_pool = start_async_workers()
+
+        def shutdown_async(signum, frame):
+            app.logger.info("Shutting down CDM service")
+            stuck = async_pool.stop()
+            if stuck:
+                # Consumer'ы закрываются в event loop только после выхода всех воркеров
+                app.logger.warning(f"Workers {stuck} did not finish their batches, leaving consumers open")
+            sys.exit(0)
+
+        signal.signal(signal.SIGTERM, shutdown_async)
+        signal.signal(signal.SIGINT, shutdown_async)
+        app.logger.info("CDM Service started successfully")
+        app.run(debug=False, host='0.0.0.0', port=5000, use_reloader=False)
+        sys.exit(0)
+
     # Инициализация компонентов
-    consumer = config.kafka_consumer()
     pg_connect = config.pg_warehouse_db()
-    cdm_repository = CdmRepository(pg_connect)
-
-    # Инициализация процессора
-    processor = CdmMessageProcessor(
-        consumer=consumer,
-        cdm_repository=cdm_repository,
-        db=pg_connect,
-        logger=app.logger
-    )
-
-    # Запуск планировщика
-    scheduler = BackgroundScheduler()
-    scheduler.add_job(func=processor.run, trigger="interval", seconds=25)
-    scheduler.start()
+    cdm_repository = CdmRepository(pg_connect, config.metrics)
+    cdm_repository.ensure_schema(check_only=config.migrations_mode == 'check')
+    start_read_api(pg_connect)
+
+    # Инициализация процессоров: по consumer'у на воркер, соединения берутся из общего пула
+    consumers = []
+    processors = []
+    for worker in range(config.workers):
+        consumer = config.kafka_consumer(app.logger, worker)
+        processor = CdmMessageProcessor(
+            consumer=consumer,
+            cdm_repository=cdm_repository,
+            db=pg_connect,
+            logger=app.logger,
+            metrics=config.metrics,
+            dead_letters=config.dead_letter_queue(app.logger),
+            retry=config.retry_policy(),
+            counter_cache=counter_cache
+        )
+        consumers.append(consumer)
+        processors.append(processor)
+
+    if config.run_mode == 'stream':
+        # Непрерывное чтение с адаптивным размером батча
+        pool = WorkerPool([
+            config.stream_loop(processor.run, lambda c=consumer: sum(c.lag().values()), app.logger, worker)
+            for worker, (processor, consumer) in enumerate(zip(processors, consumers))
+        ])
+        pool.start()
+
+        def shutdown(signum, frame):
+            # Дорабатываем текущие батчи и корректно выходим из consumer group
+            app.logger.info("Shutting down CDM service")
+            stuck = pool.stop()
+            for worker, consumer in enumerate(consumers):
+                if worker in stuck:
+                    # Воркер ещё внутри батча и пользуется consumer'ом: не закрываем, offset'ы батча не закоммичены,
+                    # его сообщения прочитает следующий владелец партиций
+                    app.logger.warning(f"Worker {worker} did not finish its batch, leaving its consumer open")
+                else:
+                    consumer.close()
+            # Пул соединений закрываем, только если им больше никто не пользуется
+            if not stuck:
+                pg_connect.close()
+            sys.exit(0)
+
+        signal.signal(signal.SIGTERM, shutdown)
+        signal.signal(signal.SIGINT, shutdown)
+    else:
+        # Запуск планировщика
+        scheduler = BackgroundScheduler()
+        for processor in processors:
+            scheduler.add_job(func=processor.run, trigger="interval", seconds=config.job_interval)
+        scheduler.start()
 
     app.logger.info("CDM Service started successfully")
     app.run(debug=False, host='0.0.0.0', port=5000, use_reloader=False)
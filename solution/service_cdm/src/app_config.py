@@ -1,7 +1,12 @@
 import os
 
-from lib.kafka_connect import KafkaConsumer
-from lib.pg import PgConnect
+from cdm_loader.counter_cache import CounterCache
+from lib.kafka_connect import DeadLetterQueue, KafkaConsumer, KafkaProducer, json_serializer
+from lib.metrics import Metrics, NullMetrics
+from lib.order_format import OrderFormatSerializer
+from lib.pg import AsyncPgConnect, PgConnect
+from lib.retry import RetryPolicy
+from lib.streaming import AsyncStreamLoop, StreamLoop
 
 
 class AppConfig:
@@ -17,13 +22,56 @@ class AppConfig:
         self.kafka_consumer_group = str(os.getenv('KAFKA_CONSUMER_GROUP') or "")
         self.kafka_consumer_topic = str(os.getenv('KAFKA_SOURCE_TOPIC') or "")
 
+        # Статическое членство в consumer group: постоянное имя экземпляра (например, имя пода), к нему
+        # добавляется номер воркера. Перезапуск быстрее KAFKA_SESSION_TIMEOUT_MS проходит без ребалансировки
+        self.kafka_group_instance_id = str(os.getenv('KAFKA_GROUP_INSTANCE_ID') or '')
+        self.kafka_session_timeout_ms = int(os.getenv('KAFKA_SESSION_TIMEOUT_MS') or 45000)
+
+        # Топик для сообщений, которые не удалось обработать; пустой — такие сообщения только логируются
+        self.kafka_dlq_topic = str(os.getenv('KAFKA_DLQ_TOPIC') or '')
+        # auto — orjson, если установлен, иначе стандартный json
+        self.kafka_serializer = str(os.getenv('KAFKA_SERIALIZER') or 'auto')
+
         self.pg_warehouse_host = str(os.getenv('PG_WAREHOUSE_HOST') or "")
         self.pg_warehouse_port = int(str(os.getenv('PG_WAREHOUSE_PORT') or 0))
         self.pg_warehouse_dbname = str(os.getenv('PG_WAREHOUSE_DBNAME') or "")
         self.pg_warehouse_user = str(os.getenv('PG_WAREHOUSE_USER') or "")
         self.pg_warehouse_password = str(os.getenv('PG_WAREHOUSE_PASSWORD') or "")
+        self.pg_pool_min_size = int(os.getenv('PG_POOL_MIN_SIZE') or 1)
+        self.pg_pool_max_size = int(os.getenv('PG_POOL_MAX_SIZE') or 4)
+        self.pg_pool_max_idle = float(os.getenv('PG_POOL_MAX_IDLE') or 600)
+        self.pg_prepare_threshold = int(os.getenv('PG_PREPARE_THRESHOLD') or 1)
+
+        # stream — непрерывный цикл чтения, scheduler — запуск батча раз в job_interval секунд,
+        # async — воркеры-корутины в одном event loop с асинхронным пулом соединений
+        self.run_mode = str(os.getenv('RUN_MODE') or 'stream')
+        self.job_interval = int(os.getenv('JOB_INTERVAL') or self.DEFAULT_JOB_INTERVAL)
+        self.stream_min_batch_size = int(os.getenv('STREAM_MIN_BATCH_SIZE') or 10)
+        self.stream_max_batch_size = int(os.getenv('STREAM_MAX_BATCH_SIZE') or 1000)
+        self.stream_poll_timeout = float(os.getenv('STREAM_POLL_TIMEOUT') or 0.1)
+        # Количество воркеров (consumer'ов одной группы) в процессе, у каждого своё соединение из пула
+        self.workers = int(os.getenv('WORKERS') or 1)
+        # В режиме async: на сколько параллельных транзакций делится батч воркера
+        self.async_concurrency = int(os.getenv('ASYNC_CONCURRENCY') or 4)
+
+        # apply — недостающие миграции схемы применяются при старте, check — сервис не стартует, пока они не применены
+        self.migrations_mode = str(os.getenv('MIGRATIONS_MODE') or 'apply')
+
+        # Кэш API чтения счётчиков: сбрасывается записью в CDM по пользователю, TTL ограничивает
+        # устаревание от записей других реплик и пересборки витрин; размер 0 выключает кэш
+        self.cdm_read_cache_size = int(os.getenv('CDM_READ_CACHE_SIZE') or 10000)
+        self.cdm_read_cache_ttl = float(os.getenv('CDM_READ_CACHE_TTL') or 30)
+
+        # Метрики для /metrics; при выключении все вызовы инструментирования пустые
+        self.metrics_enabled = str(os.getenv('METRICS_ENABLED') or 'true').lower() == 'true'
+        self.metrics = Metrics() if self.metrics_enabled else NullMetrics()
 
-    def kafka_consumer(self):
+        # Повторы при временных ошибках БД/Kafka с экспоненциальной задержкой
+        self.retry_max_attempts = int(os.getenv('RETRY_MAX_ATTEMPTS') or 4)
+        self.retry_base_delay = float(os.getenv('RETRY_BASE_DELAY') or 0.5)
+        self.retry_max_delay = float(os.getenv('RETRY_MAX_DELAY') or 10)
+
+    def kafka_consumer(self, logger, worker: int = 0):
         return KafkaConsumer(
             self.kafka_host,
             self.kafka_port,
@@ -31,14 +79,91 @@ class AppConfig:
             self.kafka_consumer_password,
             self.kafka_consumer_topic,
             self.kafka_consumer_group,
-            self.CERTIFICATE_PATH
+            self.CERTIFICATE_PATH,
+            client_id=f'{self.kafka_consumer_group}-{worker}',
+            metrics=self.metrics,
+            group_instance_id=f'{self.kafka_group_instance_id}-{worker}' if self.kafka_group_instance_id else '',
+            session_timeout_ms=self.kafka_session_timeout_ms,
+            logger=logger,
+            # Формат сообщения DDS выбирается по заголовку: json или compact
+            serializer=OrderFormatSerializer(json_serializer(self.kafka_serializer))
         )
 
-    def pg_warehouse_db(self):
+    def pg_warehouse_db(self, pooled: bool = True):
         return PgConnect(
             self.pg_warehouse_host,
             self.pg_warehouse_port,
             self.pg_warehouse_dbname,
             self.pg_warehouse_user,
-            self.pg_warehouse_password
+            self.pg_warehouse_password,
+            pool_min_size=self.pg_pool_min_size,
+            pool_max_size=max(self.pg_pool_max_size, self.workers) if pooled else 0,
+            pool_max_idle=self.pg_pool_max_idle,
+            prepare_threshold=self.pg_prepare_threshold,
+            metrics=self.metrics
+        )
+
+    def pg_warehouse_async_db(self):
+        return AsyncPgConnect(
+            self.pg_warehouse_host,
+            self.pg_warehouse_port,
+            self.pg_warehouse_dbname,
+            self.pg_warehouse_user,
+            self.pg_warehouse_password,
+            pool_min_size=self.pg_pool_min_size,
+            pool_max_size=max(self.pg_pool_max_size, self.async_concurrency),
+            pool_max_idle=self.pg_pool_max_idle,
+            prepare_threshold=self.pg_prepare_threshold,
+            metrics=self.metrics
+        )
+
+    def stream_loop(self, run_batch, lag, logger, worker: int = 0):
+        return StreamLoop(
+            run_batch,
+            lag,
+            logger,
+            min_batch_size=self.stream_min_batch_size,
+            max_batch_size=self.stream_max_batch_size,
+            poll_timeout=self.stream_poll_timeout,
+            name=f'stream-loop-{worker}',
+            metrics=self.metrics
+        )
+
+    def async_stream_loop(self, run_batch, lag, logger, worker: int = 0):
+        return AsyncStreamLoop(
+            run_batch,
+            lag,
+            logger,
+            min_batch_size=self.stream_min_batch_size,
+            max_batch_size=self.stream_max_batch_size,
+            poll_timeout=self.stream_poll_timeout,
+            name=f'async-loop-{worker}',
+            metrics=self.metrics
+        )
+
+    def dead_letter_queue(self, logger):
+        producer = None
+        if self.kafka_dlq_topic:
+            producer = KafkaProducer(
+                self.kafka_host,
+                self.kafka_port,
+                self.kafka_consumer_username,
+                self.kafka_consumer_password,
+                self.kafka_dlq_topic,
+                self.CERTIFICATE_PATH,
+                batched=True,
+                serializer=json_serializer(self.kafka_serializer),
+                metrics=self.metrics
+            )
+        return DeadLetterQueue(producer, 'cdm', logger, self.metrics)
+
+    def counter_cache(self):
+        return CounterCache(self.cdm_read_cache_size, self.cdm_read_cache_ttl)
+
+    def retry_policy(self):
+        return RetryPolicy(
+            max_attempts=self.retry_max_attempts,
+            base_delay=self.retry_base_delay,
+            max_delay=self.retry_max_delay,
+            metrics=self.metrics
         )
@@ -0,0 +1,106 @@
+import asyncio
+from typing import List, Optional, Tuple
+
+from lib.kafka_connect import AsyncDeadLetterQueue, AsyncKafkaConsumer, DeadLetterQueue, KafkaMessage
+from lib.metrics import Metrics, NullMetrics
+from lib.retry import RetryPolicy
+from cdm_loader.cdm_message_processor_job import parse_order
+from cdm_loader.counter_aggregator import CounterOrder
+from cdm_loader.counter_cache import CounterCache
+from cdm_loader.repository.async_cdm_repository import AsyncCdmRepository
+
+Pending = Tuple[KafkaMessage, CounterOrder]
+
+
+class AsyncCdmMessageProcessor:
+    # Асинхронный вариант CdmMessageProcessor. Батч делится на части по пользователю: строки счётчиков
+    # у частей не пересекаются, поэтому параллельные транзакции не ждут блокировок друг друга.
+    def __init__(self,
+                 consumer: AsyncKafkaConsumer,
+                 cdm_repository: AsyncCdmRepository,
+                 logger,
+                 metrics: Optional[Metrics] = None,
+                 dead_letters: Optional[AsyncDeadLetterQueue] = None,
+                 retry: Optional[RetryPolicy] = None,
+                 concurrency: int = 4,
+                 counter_cache: Optional[CounterCache] = None) -> None:
+        self._consumer = consumer
+        self._cdm_repository = cdm_repository
+        self._logger = logger
+        self._metrics = metrics or NullMetrics()
+        self._dead_letters = dead_letters or AsyncDeadLetterQueue(DeadLetterQueue(None, 'cdm', logger, self._metrics))
+        self._retry = retry or RetryPolicy(metrics=self._metrics)
+        self._concurrency = max(1, concurrency)
+        self._counter_cache = counter_cache
+        self._batch_size = 100
+
+    async def run(self, batch_size: Optional[int] = None, timeout: float = 3.0) -> int:
+        messages = await self._consumer.consume_batch(batch_size or self._batch_size, timeout)
+
+        orders: List[Pending] = []
+        for message in messages:
+            if message.value is None:
+                self._metrics.inc('processor_messages_total', result='invalid')
+                await self._dead_letters.send(message, message.error, 'decode')
+                continue
+
+            try:
+                order = parse_order(message.value, self._logger)
+            except Exception as e:
+                self._metrics.inc('processor_messages_total', result='invalid')
+                await self._dead_letters.send(message, e, 'parse')
+                continue
+            if order:
+                orders.append((message, order))
+            else:
+                self._metrics.inc('processor_messages_total', result='skipped')
+
+        try:
+            with self._metrics.timer('processor_stage_seconds', stage='apply'):
+                results = await asyncio.gather(*(self._apply(part) for part in self._partition(orders)),
+                                               return_exceptions=True)
+                errors = [result for result in results if isinstance(result, BaseException)]
+                if errors:
+                    raise errors[0]
+            await self._dead_letters.flush()
+        except Exception as e:
+            self._metrics.inc('processor_errors_total', stage='apply', type=type(e).__name__)
+            self._logger.error(f"Error applying batch: {e}")
+            # Offset не коммитим и перечитываем батч; уже применённые части отсечёт processed_orders
+            await self._consumer.rewind()
+            raise
+
+        with self._metrics.timer('processor_stage_seconds', stage='commit'):
+            await self._consumer.commit()
+        if orders:
+            self._logger.info(f"Processed {len(orders)} messages, applied {sum(results)} new orders")
+        return len(messages)
+
+    def _partition(self, orders: List[Pending]) -> List[List[Pending]]:
+        parts: List[List[Pending]] = [[] for _ in range(self._concurrency)]
+        for message, order in orders:
+            parts[hash(order.user_id) % self._concurrency].append((message, order))
+        return [part for part in parts if part]
+
+    async def _apply(self, orders: List[Pending]) -> int:
+        try:
+            applied_count = await self._retry.call_async(
+                self._cdm_repository.apply_orders, [order for _, order in orders])
+        except Exception as e:
+            if self._retry.is_transient(e):
+                raise
+            if len(orders) == 1:
+                self._metrics.inc('processor_messages_total', result='dead_letter')
+                await self._dead_letters.send(orders[0][0], e, 'apply')
+                return 0
+            self._logger.warning(f"Batch of {len(orders)} failed ({type(e).__name__}: {e}), bisecting")
+            self._metrics.inc('processor_bisections_total')
+            middle = len(orders) // 2
+            return await self._apply(orders[:middle]) + await self._apply(orders[middle:])
+
+        if self._counter_cache is not None and applied_count:
+            # Одни повторы счётчики не меняют, тогда кэш не трогаем
+            self._counter_cache.invalidate(order.user_id for _, order in orders)
+        self._metrics.inc('processor_messages_total', applied_count, result='processed')
+        self._metrics.inc('processor_messages_total', len(orders) - applied_count, result='duplicate')
+        return applied_count
@@ -1,55 +1,117 @@
-from lib.kafka_connect import KafkaConsumer
+from lib.kafka_connect import DeadLetterQueue, KafkaConsumer, KafkaMessage
+from cdm_loader.counter_aggregator import CounterOrder
+from cdm_loader.counter_cache import CounterCache
 from cdm_loader.repository.cdm_repository import CdmRepository
+from lib.metrics import Metrics, NullMetrics
 from lib.pg import PgConnect
-import logging
+from lib.retry import RetryPolicy
+from typing import List, Optional, Tuple
+
+
+def parse_order(msg: dict, logger) -> Optional[CounterOrder]:
+    logger.debug(f"Received message: {msg}")
+    payload = msg.get('payload', {})
+
+    user_info = payload.get('user', {})
+    products = payload.get('products', [])
+
+    user_id = user_info.get('id')
+    if not user_id:
+        logger.warning("No user_id in message payload")
+        return None
+
+    if not products:
+        logger.warning(f"No products found for user: {user_id}")
+        return None
+
+    object_id = msg.get('object_id')
+    return CounterOrder(None if object_id is None else str(object_id), user_id, products)
+
 
 class CdmMessageProcessor:
-    def __init__(self, consumer: KafkaConsumer, cdm_repository: CdmRepository, db: PgConnect, logger) -> None:
+    def __init__(self, consumer: KafkaConsumer, cdm_repository: CdmRepository, db: PgConnect, logger,
+                 metrics: Optional[Metrics] = None,
+                 dead_letters: Optional[DeadLetterQueue] = None,
+                 retry: Optional[RetryPolicy] = None,
+                 counter_cache: Optional[CounterCache] = None) -> None:
         self._consumer = consumer
         self._cdm_repository = cdm_repository
         self._db = db
         self._logger = logger
+        self._metrics = metrics or NullMetrics()
+        self._dead_letters = dead_letters or DeadLetterQueue(None, 'cdm', logger, self._metrics)
+        self._retry = retry or RetryPolicy(metrics=self._metrics)
+        self._counter_cache = counter_cache
         self._batch_size = 100
 
-    def run(self) -> None:
-        processed_count = 0
-        for _ in range(self._batch_size):
-            msg = self._consumer.consume()
-            if not msg:
-                self._logger.info("No more messages to process")
-                break
-            
-            self._process_message(msg)
-            processed_count += 1
-        
-        if processed_count > 0:
-            self._logger.info(f"Processed {processed_count} messages")
-
-    def _process_message(self, msg: dict) -> None:
-        try:
-            self._logger.debug(f"Received message: {msg}")
-            payload = msg.get('payload', {})
-            
-            user_info = payload.get('user', {})
-            products = payload.get('products', [])
-            
-            user_id = user_info.get('id')
-            if not user_id:
-                self._logger.warning("No user_id in message payload")
-                return
-
-            if not products:
-                self._logger.warning(f"No products found for user: {user_id}")
-                return
-
-            self._logger.info(f"Processing user: {user_id} with {len(products)} products")
-            
-            self._cdm_repository.insert_user_product_counters(user_id, products)
-            self._cdm_repository.insert_user_category_counters(user_id, products)
-            
-            self._logger.info(f"Successfully processed user: {user_id}")
+    def run(self, batch_size: Optional[int] = None, timeout: float = 3.0) -> int:
+        messages = self._consumer.consume_batch(batch_size or self._batch_size, timeout)
+        if not messages:
+            self._logger.debug("No more messages to process")
+
+        orders: List[Tuple[KafkaMessage, CounterOrder]] = []
+        for message in messages:
+            if message.value is None:
+                self._metrics.inc('processor_messages_total', result='invalid')
+                self._dead_letters.send(message, message.error, 'decode')
+                continue
 
+            try:
+                order = self._parse_message(message.value)
+            except Exception as e:
+                self._metrics.inc('processor_messages_total', result='invalid')
+                self._dead_letters.send(message, e, 'parse')
+                continue
+            if order:
+                orders.append((message, order))
+            else:
+                self._metrics.inc('processor_messages_total', result='skipped')
+
+        try:
+            with self._metrics.timer('processor_stage_seconds', stage='apply'):
+                applied_count = self._apply(orders)
+            self._dead_letters.flush()
         except Exception as e:
-            self._logger.error(f"Error processing message: {e}")
+            self._metrics.inc('processor_errors_total', stage='apply', type=type(e).__name__)
+            self._logger.error(f"Error applying batch: {e}")
             import traceback
             self._logger.error(traceback.format_exc())
+            # Offset не коммитим и перечитываем батч; уже применённые заказы отсечёт processed_orders
+            self._consumer.rewind()
+            raise
+
+        with self._metrics.timer('processor_stage_seconds', stage='commit'):
+            self._consumer.commit()
+        if orders:
+            self._logger.info(f"Processed {len(orders)} messages, applied {applied_count} new orders")
+        return len(messages)
+
+    def _apply(self, orders: List[Tuple[KafkaMessage, CounterOrder]]) -> int:
+        try:
+            applied_count = self._retry.call(self._apply_orders, [order for _, order in orders])
+        except Exception as e:
+            if self._retry.is_transient(e):
+                raise
+            if len(orders) == 1:
+                self._metrics.inc('processor_messages_total', result='dead_letter')
+                self._dead_letters.send(orders[0][0], e, 'apply')
+                return 0
+            # Делим батч пополам: битое сообщение находится за log2(n) шагов, остальные пишутся пачками
+            self._logger.warning(f"Batch of {len(orders)} failed ({type(e).__name__}: {e}), bisecting")
+            self._metrics.inc('processor_bisections_total')
+            middle = len(orders) // 2
+            return self._apply(orders[:middle]) + self._apply(orders[middle:])
+
+        if self._counter_cache is not None and applied_count:
+            # Счётчики пользователей части уже закоммичены: API чтения перечитает их из БД.
+            # Одни повторы счётчики не меняют, тогда кэш не трогаем
+            self._counter_cache.invalidate(order.user_id for _, order in orders)
+        self._metrics.inc('processor_messages_total', applied_count, result='processed')
+        self._metrics.inc('processor_messages_total', len(orders) - applied_count, result='duplicate')
+        return applied_count
+
+    def _parse_message(self, msg: dict) -> Optional[CounterOrder]:
+        return parse_order(msg, self._logger)
+
+    def _apply_orders(self, orders: List[CounterOrder]) -> int:
+        return self._cdm_repository.apply_orders(orders)
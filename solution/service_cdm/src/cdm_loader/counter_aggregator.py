@@ -0,0 +1,39 @@
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from lib.keys import category_id
+
+
+class CounterOrder(NamedTuple):
+    object_id: Optional[str]
+    user_id: str
+    products: List[dict]
+
+
+class CounterDeltas(NamedTuple):
+    # (user_id, product_id) -> [product_name, order_cnt]
+    products: Dict[Tuple[str, str], list]
+    # (user_id, category_id) -> [category_name, order_cnt]
+    categories: Dict[Tuple[str, str], list]
+
+
+def fold_counters(orders: List[CounterOrder]) -> CounterDeltas:
+    # Сворачиваем весь батч в приращения по ключу: горячий пользователь/товар даёт одну строку на upsert
+    deltas = CounterDeltas({}, {})
+    for order in orders:
+        for product in order.products:
+            quantity = product.get('quantity', 1)
+
+            product_id = product.get('product_id')
+            product_name = product.get('product_name')
+            if product_id and product_name:
+                row = deltas.products.setdefault((order.user_id, product_id), [product_name, 0])
+                # Имя берём из последнего сообщения, как и ON CONFLICT ... SET product_name = EXCLUDED
+                row[0] = product_name
+                row[1] += quantity
+
+            category_name = product.get('category_name')
+            if category_name:
+                row = deltas.categories.setdefault((order.user_id, category_id(category_name)), [category_name, 0])
+                row[0] = category_name
+                row[1] += quantity
+    return deltas
@@ -0,0 +1,71 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Iterable, List, NamedTuple, Optional
+
+from cdm_loader.repository.cdm_counter_reader import COUNTER_TABLES
+
+
+class CachedTop(NamedTuple):
+    rows: List[dict]
+    etag: str
+    expires_at: float
+
+
+class CounterCache:
+    # Топы счётчиков по пользователю для API чтения. Запись в CDM сбрасывает записи своих пользователей,
+    # TTL ограничивает устаревание от записей в обход процесса (пересборка витрин, другие реплики).
+    def __init__(self, max_size: int = 10000, ttl: float = 30.0) -> None:
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        # Растёт при каждом сбросе. Чтение из БД запоминает версию до запроса и не кладёт результат в кэш,
+        # если его пользователя сбросили позже: сброс других пользователей чтению не мешает
+        self.version = 0
+        self._data: OrderedDict = OrderedDict()
+        # user_id -> версия последнего сброса; для вытесненных из этого списка — не новее _floor
+        self._invalidated: OrderedDict = OrderedDict()
+        self._floor = 0
+        self._lock = threading.Lock()
+
+    def get(self, kind: str, user_id: str) -> Optional[CachedTop]:
+        key = (kind, user_id)
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None or entry.expires_at < time.monotonic():
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._data.move_to_end(key)
+            return entry
+
+    def put(self, kind: str, user_id: str, rows: List[dict], etag: str, version: int) -> CachedTop:
+        entry = CachedTop(rows, etag, time.monotonic() + self.ttl)
+        with self._lock:
+            if self._invalidated.get(user_id, self._floor) > version or self.max_size <= 0:
+                return entry
+            key = (kind, user_id)
+            self._data[key] = entry
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+        return entry
+
+    def invalidate(self, user_ids: Iterable[str]) -> None:
+        user_ids = set(user_ids)
+        if not user_ids:
+            return
+        with self._lock:
+            self.version += 1
+            for user_id in user_ids:
+                for kind in COUNTER_TABLES:
+                    self._data.pop((kind, user_id), None)
+                self._invalidated[user_id] = self.version
+                self._invalidated.move_to_end(user_id)
+            # Список сбросов ограничен как и сам кэш: самый старый вытесненный сброс поднимает _floor
+            while len(self._invalidated) > max(self.max_size, 1):
+                _, self._floor = self._invalidated.popitem(last=False)
+
+    def stats(self) -> Dict[str, float]:
+        return {'hits': self.hits, 'misses': self.misses, 'size': len(self._data)}
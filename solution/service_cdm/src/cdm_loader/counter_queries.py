@@ -0,0 +1,62 @@
+import hashlib
+import uuid
+from typing import Dict, List, Tuple
+
+from lib.keys import hashdiff
+from cdm_loader.counter_cache import CachedTop, CounterCache
+from cdm_loader.repository.cdm_counter_reader import COUNTER_TABLES, CdmCounterReader
+
+
+class CounterQueries:
+    # В кэше держим топ из MAX_LIMIT строк на пользователя, меньший limit отдаётся срезом
+    MAX_LIMIT = 50
+    MAX_USERS = 100
+
+    def __init__(self, reader: CdmCounterReader, cache: CounterCache) -> None:
+        self._reader = reader
+        self._cache = cache
+
+    def top(self, kind: str, user_ids: List[str], limit: int) -> Tuple[Dict[str, List[dict]], str]:
+        user_ids = self._validate(kind, user_ids, limit)
+
+        entries: Dict[str, CachedTop] = {}
+        missing = []
+        for user_id in user_ids:
+            entry = self._cache.get(kind, user_id)
+            if entry is None:
+                missing.append(user_id)
+            else:
+                entries[user_id] = entry
+
+        if missing:
+            # Версию берём до чтения: если запись в CDM сбросит пользователя во время запроса, его результат
+            # не сохранится
+            version = self._cache.version
+            loaded = self._reader.top(kind, missing, self.MAX_LIMIT)
+            for user_id in missing:
+                rows = loaded[user_id]
+                entries[user_id] = self._cache.put(kind, user_id, rows, self._etag(rows), version)
+
+        users = {user_id: entries[user_id].rows[:limit] for user_id in user_ids}
+        etag = hashlib.md5(
+            f"{kind}:{limit}:{','.join(f'{user_id}={entries[user_id].etag}' for user_id in user_ids)}".encode()
+        ).hexdigest()
+        return users, etag
+
+    def _validate(self, kind: str, user_ids: List[str], limit: int) -> List[str]:
+        if kind not in COUNTER_TABLES:
+            raise ValueError(f"Unknown counters kind: {kind}")
+        if not 1 <= limit <= self.MAX_LIMIT:
+            raise ValueError(f"limit must be between 1 and {self.MAX_LIMIT}")
+        user_ids = list(dict.fromkeys(user_ids))
+        if not 1 <= len(user_ids) <= self.MAX_USERS:
+            raise ValueError(f"Expected from 1 to {self.MAX_USERS} user_id")
+        try:
+            # Приводим к каноническому виду uuid: он же ключ кэша и ключ сброса на пути записи
+            return [str(uuid.UUID(user_id)) for user_id in user_ids]
+        except ValueError:
+            raise ValueError("user_id must be a uuid")
+
+    @staticmethod
+    def _etag(rows: List[dict]) -> str:
+        return hashdiff(*(tuple(row.values()) for row in rows))
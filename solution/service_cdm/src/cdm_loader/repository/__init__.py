@@ -1 +1,3 @@
-from .cdm_repository import CdmRepository  # noqa
+from .cdm_repository import CdmRepository  # noqa
+from .async_cdm_repository import AsyncCdmRepository  # noqa
+from .cdm_counter_reader import CdmCounterReader  # noqa
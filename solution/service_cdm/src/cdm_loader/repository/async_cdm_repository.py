@@ -0,0 +1,21 @@
+from typing import List, Optional
+
+from lib.metrics import Metrics, NullMetrics
+from lib.pg import AsyncPgConnect, execute_round_async, run_plan_async
+from cdm_loader.counter_aggregator import CounterOrder
+from cdm_loader.repository.cdm_counter_plan import CdmCounterPlan
+
+
+class AsyncCdmRepository:
+    # Применение батча CdmRepository поверх asyncio: тот же план, соединение из асинхронного пула
+    def __init__(self, db: AsyncPgConnect, metrics: Optional[Metrics] = None) -> None:
+        self._db = db
+        self._metrics = metrics or NullMetrics()
+        self._plan = CdmCounterPlan(self._metrics)
+
+    async def apply_orders(self, orders: List[CounterOrder]) -> int:
+        if not orders:
+            return 0
+        async with self._db.connection() as conn:
+            return await run_plan_async(
+                self._plan.apply_orders(orders), lambda statements: execute_round_async(conn.cursor, statements))
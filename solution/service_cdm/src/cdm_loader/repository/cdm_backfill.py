@@ -0,0 +1,241 @@
+import logging
+import time
+from datetime import datetime
+from logging import Logger
+from typing import Tuple
+
+from lib.keys import category_id
+from lib.pg import PgConnect
+from cdm_loader.repository.cdm_repository import CdmRepository
+
+# Порядок важен: сервис сначала пишет в processed_orders, потом в счётчики — блокируем в том же порядке
+_TABLES = ('cdm.processed_orders', 'cdm.user_product_counters', 'cdm.user_category_counters')
+_SHADOW = '{}__backfill'
+_REPLACED = '{}__replaced'
+
+# Заказы, попавшие в счётчики: есть пользователь и хотя бы один товар
+_CATCH_UP_SCOPE = 'WHERE ou.h_order_pk IN (SELECT h_order_pk FROM backfill_catch_up)'
+
+_PRODUCT_COUNTERS_SQL = """
+    INSERT INTO {target} (user_id, product_id, product_name, order_cnt)
+    SELECT ou.h_user_pk, op.h_product_pk, pn.name, sum(op.quantity)
+    FROM dds.l_order_user ou
+    JOIN dds.l_order_product op ON op.h_order_pk = ou.h_order_pk
+    JOIN backfill_product_names pn ON pn.h_product_pk = op.h_product_pk
+    {scope}
+    GROUP BY ou.h_user_pk, op.h_product_pk, pn.name
+    ON CONFLICT (user_id, product_id)
+    DO UPDATE SET
+        order_cnt = {target}.order_cnt + EXCLUDED.order_cnt,
+        product_name = EXCLUDED.product_name
+"""
+
+# Счётчики растут на количество товара в заказе, как и в потоковой обработке: категория — на каждый её товар
+_CATEGORY_COUNTERS_SQL = """
+    INSERT INTO {target} (user_id, category_id, category_name, order_cnt)
+    SELECT ou.h_user_pk, ci.category_id, c.category_name, sum(op.quantity)
+    FROM dds.l_order_user ou
+    JOIN dds.l_order_product op ON op.h_order_pk = ou.h_order_pk
+    JOIN dds.l_product_category pc ON pc.h_product_pk = op.h_product_pk
+    JOIN dds.h_category c ON c.h_category_pk = pc.h_category_pk
+    JOIN backfill_category_ids ci ON ci.category_name = c.category_name
+    {scope}
+    GROUP BY ou.h_user_pk, ci.category_id, c.category_name
+    ON CONFLICT (user_id, category_id)
+    DO UPDATE SET
+        order_cnt = {target}.order_cnt + EXCLUDED.order_cnt,
+        category_name = EXCLUDED.category_name
+"""
+
+_PROCESSED_ORDERS_SQL = """
+    INSERT INTO {target} (object_id, processed_dt)
+    SELECT h.order_id, %s
+    FROM dds.h_order h
+    JOIN dds.l_order_user ou ON ou.h_order_pk = h.h_order_pk
+    {scope}
+    {condition} EXISTS (SELECT 1 FROM dds.l_order_product op WHERE op.h_order_pk = h.h_order_pk)
+    ON CONFLICT (object_id) DO NOTHING
+"""
+
+# Секции сателлита старше срока хранения DDS отсоединяет в dds_archive — имя товара ищем и в них
+_PRODUCT_NAME_SOURCES_SQL = """
+    SELECT schemaname || '.' || tablename
+    FROM pg_tables
+    WHERE schemaname = 'dds_archive' AND tablename LIKE 's\\_product\\_names\\_p%'
+"""
+
+# serial-последовательности принадлежат столбцам старой таблицы, а теневая копия использует их же в DEFAULT
+_OWNED_SEQUENCES_SQL = """
+    SELECT s.oid::regclass::text, a.attname
+    FROM pg_class s
+    JOIN pg_depend d ON d.objid = s.oid AND d.deptype = 'a'
+    JOIN pg_attribute a ON a.attrelid = d.refobjid AND a.attnum = d.refobjsubid
+    WHERE s.relkind = 'S' AND d.refobjid = %s::regclass
+"""
+
+
+# Пересобирает витрины CDM из DDS одним проходом SQL вместо перечитывания топика:
+#   python -m cdm_loader.repository.cdm_backfill   (из каталога src, с теми же переменными окружения, что у сервиса)
+# Теневые таблицы строятся на одном снимке DDS, затем подменяют рабочие переименованием в одной транзакции.
+# Сервис можно не останавливать: заказы, которые он успел учесть после снимка, досчитываются при подмене,
+# а новые сообщения отсекаются по processed_orders — это и есть точка продолжения потока.
+# Количество товара DDS хранит в l_order_product.quantity; пока в DDS есть линки без него, пересборка отказывает:
+# количество старым линкам дописывает повторная загрузка их заказов в DDS (например, перечитыванием топика).
+# Имя товара — последняя версия из сателлита и его архивных секций; товар без имени тоже останавливает пересборку.
+class CdmBackfill:
+    def __init__(self, db: PgConnect, logger: Logger) -> None:
+        self._db = db
+        self._logger = logger
+
+    def run(self) -> None:
+        CdmRepository(self._db).ensure_schema()
+
+        started_at = datetime.utcnow()
+        started = time.perf_counter()
+        orders, watermark = self._build(started_at)
+        self._logger.info(
+            f"Built shadow counters for {orders} orders up to {watermark} in {time.perf_counter() - started:.1f}s")
+
+        started = time.perf_counter()
+        caught_up = self._swap(started_at, orders, watermark)
+        self._logger.info(
+            f"Swapped in rebuilt counters, {caught_up} orders caught up, in {time.perf_counter() - started:.1f}s")
+
+    def _build(self, started_at: datetime) -> Tuple[int, datetime]:
+        with self._db.connection() as conn:
+            with conn.cursor() as cur:
+                # Все выборки — на одном снимке, иначе счётчики и processed_orders разойдутся
+                cur.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ")
+                # Линки, записанные до появления количества, дали бы счётчики меньше потоковых
+                cur.execute("SELECT count(*) FROM dds.l_order_product WHERE quantity IS NULL")
+                legacy = cur.fetchone()[0]
+                if legacy:
+                    raise Exception(f'{legacy} order products in DDS have no quantity, counters cannot be rebuilt; '
+                                    f'reload their orders into DDS to fill it in')
+                cur.execute("SELECT max(load_dt) FROM dds.l_order_user")
+                watermark = cur.fetchone()[0]
+
+                for table in _TABLES:
+                    cur.execute(f"DROP TABLE IF EXISTS {_SHADOW.format(table)}")
+                    cur.execute(f"CREATE TABLE {_SHADOW.format(table)} (LIKE {table} INCLUDING ALL)")
+                self._create_category_ids(cur)
+                self._create_product_names(cur)
+
+                processed, products, categories = (_SHADOW.format(table) for table in _TABLES)
+                cur.execute(_PRODUCT_COUNTERS_SQL.format(target=products, scope=''))
+                cur.execute(_CATEGORY_COUNTERS_SQL.format(target=categories, scope=''))
+                cur.execute(_PROCESSED_ORDERS_SQL.format(target=processed, scope='', condition='WHERE'),
+                            (started_at,))
+                orders = cur.rowcount
+
+                for table in _TABLES:
+                    cur.execute(f"ANALYZE {_SHADOW.format(table)}")
+        return orders, watermark
+
+    def _swap(self, started_at: datetime, orders: int, watermark: datetime) -> int:
+        processed, products, categories = (_SHADOW.format(table) for table in _TABLES)
+        with self._db.connection() as conn:
+            with conn.cursor() as cur:
+                # Чтение витрин не блокируется до самих переименований, запись сервиса ждёт конца транзакции
+                cur.execute(f"LOCK TABLE {', '.join(_TABLES)} IN EXCLUSIVE MODE")
+
+                # Заказы, которые сервис учёл уже после снимка
+                cur.execute(
+                    f"""
+                    CREATE TEMP TABLE backfill_catch_up ON COMMIT DROP AS
+                    SELECT h.h_order_pk
+                    FROM cdm.processed_orders p
+                    JOIN dds.h_order h ON h.order_id = p.object_id
+                    WHERE NOT EXISTS (SELECT 1 FROM {processed} b WHERE b.object_id = p.object_id)
+                    """
+                )
+                caught_up = cur.rowcount
+                if caught_up:
+                    self._create_category_ids(cur)
+                    self._create_product_names(cur)
+                    cur.execute(_PRODUCT_COUNTERS_SQL.format(target=products, scope=_CATCH_UP_SCOPE))
+                    cur.execute(_CATEGORY_COUNTERS_SQL.format(target=categories, scope=_CATCH_UP_SCOPE))
+                    cur.execute(
+                        _PROCESSED_ORDERS_SQL.format(target=processed, scope=_CATCH_UP_SCOPE, condition='AND'),
+                        (datetime.utcnow(),))
+
+                cur.execute(
+                    f"""
+                    SELECT count(*) FROM cdm.processed_orders p
+                    WHERE NOT EXISTS (SELECT 1 FROM {processed} b WHERE b.object_id = p.object_id)
+                    """
+                )
+                missing = cur.fetchone()[0]
+                if missing:
+                    self._logger.warning(f"{missing} processed orders are not in DDS, their counters are dropped")
+
+                for table in _TABLES:
+                    schema, name = table.split('.')
+                    cur.execute(_OWNED_SEQUENCES_SQL, (table,))
+                    sequences = cur.fetchall()
+                    cur.execute(f"ALTER TABLE {table} RENAME TO {_REPLACED.format(name)}")
+                    cur.execute(f"ALTER TABLE {_SHADOW.format(table)} RENAME TO {name}")
+                    for sequence, column in sequences:
+                        cur.execute(f"ALTER SEQUENCE {sequence} OWNED BY {table}.{column}")
+                    cur.execute(f"DROP TABLE {schema}.{_REPLACED.format(name)}")
+                    # Индексы и ограничения копии получили имена от теневой таблицы — возвращаем исходные
+                    cur.execute(
+                        "SELECT relname FROM pg_class "
+                        "WHERE oid IN (SELECT indexrelid FROM pg_index WHERE indrelid = %s::regclass)",
+                        (table,))
+                    for index, in cur.fetchall():
+                        if _SHADOW.format(name) in index:
+                            cur.execute(f"ALTER INDEX {schema}.{index} "
+                                        f"RENAME TO {index.replace(_SHADOW.format(name), name)}")
+
+                cur.execute(
+                    """
+                    INSERT INTO cdm.counter_backfills (started_at, finished_at, dds_load_dt, orders, caught_up)
+                    VALUES (%s, %s, %s, %s, %s)
+                    """,
+                    (started_at, datetime.utcnow(), watermark, orders, caught_up)
+                )
+        return caught_up
+
+    def _create_category_ids(self, cur) -> None:
+        # uuid5 считаем так же, как потоковая обработка, и передаём в SQL готовым справочником
+        cur.execute("SELECT category_name FROM dds.h_category")
+        names = [row[0] for row in cur.fetchall()]
+        cur.execute(
+            """
+            CREATE TEMP TABLE IF NOT EXISTS backfill_category_ids ON COMMIT DROP AS
+            SELECT * FROM unnest(%s::varchar[], %s::uuid[]) AS v (category_name, category_id)
+            """,
+            (names, [category_id(name) for name in names])
+        )
+
+    def _create_product_names(self, cur) -> None:
+        cur.execute(_PRODUCT_NAME_SOURCES_SQL)
+        sources = ['dds.s_product_names'] + [row[0] for row in cur.fetchall()]
+        union = ' UNION ALL '.join(f'SELECT h_product_pk, name, load_dt FROM {source}' for source in sources)
+        cur.execute(
+            f"""
+            CREATE TEMP TABLE IF NOT EXISTS backfill_product_names ON COMMIT DROP AS
+            SELECT DISTINCT ON (h_product_pk) h_product_pk, name
+            FROM ({union}) n
+            ORDER BY h_product_pk, load_dt DESC
+            """
+        )
+        # Без имени товар выпал бы из счётчиков товаров, оставшись в счётчиках категорий
+        cur.execute(
+            """
+            SELECT count(DISTINCT op.h_product_pk)
+            FROM dds.l_order_product op
+            WHERE NOT EXISTS (SELECT 1 FROM backfill_product_names n WHERE n.h_product_pk = op.h_product_pk)
+            """
+        )
+        unnamed = cur.fetchone()[0]
+        if unnamed:
+            raise Exception(f'{unnamed} products in DDS have no name, counters cannot be rebuilt')
+
+
+if __name__ == '__main__':
+    from app_config import AppConfig
+
+    logging.basicConfig(level=logging.INFO)
+    CdmBackfill(AppConfig().pg_warehouse_db(), logging.getLogger(__name__)).run()
@@ -0,0 +1,97 @@
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from lib.metrics import Metrics, NullMetrics
+from lib.pg import Plan, Statement
+from cdm_loader.counter_aggregator import CounterOrder, fold_counters
+
+
+def claim_orders_statement(object_ids: List[str]) -> Statement:
+    # Возвращает только заказы, которые ещё не были учтены в счётчиках
+    return Statement(
+        """
+        INSERT INTO cdm.processed_orders (object_id, processed_dt)
+        SELECT v.object_id, %s FROM unnest(%s::varchar[]) AS v (object_id)
+        ON CONFLICT (object_id) DO NOTHING
+        RETURNING object_id
+        """,
+        (datetime.utcnow(), object_ids),
+        True
+    )
+
+
+def product_counters_statement(deltas: Dict[Tuple[str, str], list]) -> Statement:
+    # Сортировка по ключу задаёт единый порядок блокировок строк между воркерами
+    keys = sorted(deltas)
+    return Statement(
+        """
+        INSERT INTO cdm.user_product_counters
+            (user_id, product_id, product_name, order_cnt)
+        SELECT * FROM unnest(%s::uuid[], %s::uuid[], %s::varchar[], %s::int[])
+        ON CONFLICT (user_id, product_id)
+        DO UPDATE SET
+            order_cnt = cdm.user_product_counters.order_cnt + EXCLUDED.order_cnt,
+            product_name = EXCLUDED.product_name
+        """,
+        (
+            [user_id for user_id, _ in keys],
+            [product_id for _, product_id in keys],
+            [deltas[key][0] for key in keys],
+            [deltas[key][1] for key in keys],
+        )
+    )
+
+
+def category_counters_statement(deltas: Dict[Tuple[str, str], list]) -> Statement:
+    keys = sorted(deltas)
+    return Statement(
+        """
+        INSERT INTO cdm.user_category_counters
+            (user_id, category_id, category_name, order_cnt)
+        SELECT * FROM unnest(%s::uuid[], %s::uuid[], %s::varchar[], %s::int[])
+        ON CONFLICT (user_id, category_id)
+        DO UPDATE SET
+            order_cnt = cdm.user_category_counters.order_cnt + EXCLUDED.order_cnt,
+            category_name = EXCLUDED.category_name
+        """,
+        (
+            [user_id for user_id, _ in keys],
+            [category_id for _, category_id in keys],
+            [deltas[key][0] for key in keys],
+            [deltas[key][1] for key in keys],
+        )
+    )
+
+
+class CdmCounterPlan:
+    # Применение батча заказов без ввода-вывода: исполняют его CdmRepository и AsyncCdmRepository
+    def __init__(self, metrics: Optional[Metrics] = None) -> None:
+        self._metrics = metrics or NullMetrics()
+
+    def apply_orders(self, orders: List[CounterOrder]) -> Plan[int]:
+        # Счётчики аддитивные: заказ применяется один раз даже при повторном чтении топика
+        new_ids = set()
+        object_ids = list(dict.fromkeys(order.object_id for order in orders if order.object_id is not None))
+        if object_ids:
+            with self._metrics.timer('cdm_repository_seconds', call='claim_orders'):
+                rows, = yield [claim_orders_statement(object_ids)]
+                new_ids = {row[0] for row in rows}
+
+        fresh = []
+        for order in orders:
+            if order.object_id is None:
+                fresh.append(order)
+            elif order.object_id in new_ids:
+                # Повтор того же заказа внутри батча тоже учитываем один раз
+                new_ids.discard(order.object_id)
+                fresh.append(order)
+
+        # Весь батч сворачивается в приращения и применяется одним upsert на таблицу
+        deltas = fold_counters(fresh)
+        if deltas.products:
+            with self._metrics.timer('cdm_repository_seconds', call='upsert_product_counters'):
+                yield [product_counters_statement(deltas.products)]
+        if deltas.categories:
+            with self._metrics.timer('cdm_repository_seconds', call='upsert_category_counters'):
+                yield [category_counters_statement(deltas.categories)]
+        return len(fresh)
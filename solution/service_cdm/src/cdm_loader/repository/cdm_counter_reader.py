@@ -0,0 +1,48 @@
+from typing import Dict, List, NamedTuple, Optional
+
+from lib.metrics import Metrics, NullMetrics
+from lib.pg import PgConnect
+
+
+class CounterTable(NamedTuple):
+    table: str
+    id: str
+    name: str
+
+
+COUNTER_TABLES = {
+    'products': CounterTable('cdm.user_product_counters', 'product_id', 'product_name'),
+    'categories': CounterTable('cdm.user_category_counters', 'category_id', 'category_name'),
+}
+
+
+def _top_sql(counters: CounterTable) -> str:
+    # Строк на пользователя немного, их отдаёт префикс уникального индекса (user_id, ...); отдельный индекс
+    # по order_cnt не заводим — он отключил бы HOT-обновления счётчиков на пути записи
+    return f"""
+        SELECT user_id::text, {counters.id}::text, {counters.name}, order_cnt
+        FROM (
+            SELECT c.*, row_number() OVER (PARTITION BY c.user_id ORDER BY c.order_cnt DESC, c.{counters.name}) AS rn
+            FROM {counters.table} c
+            WHERE c.user_id = ANY(%s::uuid[])
+        ) t
+        WHERE rn <= %s
+        ORDER BY user_id, rn
+    """
+
+
+class CdmCounterReader:
+    def __init__(self, db: PgConnect, metrics: Optional[Metrics] = None) -> None:
+        self._db = db
+        self._metrics = metrics or NullMetrics()
+
+    def top(self, kind: str, user_ids: List[str], limit: int) -> Dict[str, List[dict]]:
+        # Топ по числу заказов для нескольких пользователей одним запросом
+        counters = COUNTER_TABLES[kind]
+        result: Dict[str, List[dict]] = {user_id: [] for user_id in user_ids}
+        with self._metrics.timer('cdm_repository_seconds', call=f'top_{kind}'):
+            with self._db.connection() as conn:
+                rows = conn.execute(_top_sql(counters), (user_ids, limit)).fetchall()
+        for user_id, counter_id, name, order_cnt in rows:
+            result[user_id].append({counters.id: counter_id, counters.name: name, 'order_cnt': order_cnt})
+        return result
@@ -0,0 +1,75 @@
+import logging
+
+from psycopg import Cursor
+
+from lib.migrations import Migration, Migrator
+from lib.pg import PgConnect
+
+
+def _baseline(cur: Cursor) -> None:
+    # Таблицы уже могут существовать — их создавали до появления миграций
+    cur.execute("CREATE SCHEMA IF NOT EXISTS cdm")
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS cdm.user_product_counters (
+            id serial,
+            user_id uuid NOT NULL,
+            product_id uuid NOT NULL,
+            product_name varchar NOT NULL,
+            order_cnt int NOT NULL DEFAULT 0,
+            UNIQUE (user_id, product_id)
+        )
+        """
+    )
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS cdm.user_category_counters (
+            id serial,
+            user_id uuid NOT NULL,
+            category_id uuid NOT NULL,
+            category_name varchar NOT NULL,
+            order_cnt int NOT NULL DEFAULT 0,
+            UNIQUE (user_id, category_id)
+        )
+        """
+    )
+    # Таблица идемпотентности: заказы, уже учтённые в счётчиках
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS cdm.processed_orders (
+            object_id varchar NOT NULL PRIMARY KEY,
+            processed_dt timestamp NOT NULL
+        )
+        """
+    )
+    # История пересборок: снимок DDS, на котором построены счётчики
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS cdm.counter_backfills (
+            id serial PRIMARY KEY,
+            started_at timestamp NOT NULL,
+            finished_at timestamp NOT NULL,
+            dds_load_dt timestamp,
+            orders int NOT NULL,
+            caught_up int NOT NULL
+        )
+        """
+    )
+
+
+MIGRATIONS = [
+    Migration(1, 'baseline', _baseline),
+]
+
+
+def cdm_migrator(db: PgConnect, logger=None) -> Migrator:
+    return Migrator(db, 'cdm', MIGRATIONS, logger)
+
+
+# Применить миграции вручную, не запуская сервис:
+#     python -m cdm_loader.repository.cdm_migrations
+if __name__ == '__main__':
+    from app_config import AppConfig
+
+    logging.basicConfig(level=logging.INFO)
+    cdm_migrator(AppConfig().pg_warehouse_db(pooled=False), logging.getLogger(__name__)).run()
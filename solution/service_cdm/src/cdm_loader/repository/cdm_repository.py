@@ -1,66 +1,28 @@
-from typing import List
-from lib.pg import PgConnect
-import uuid
-
-class CdmRepository:
-    def __init__(self, db: PgConnect) -> None:
-        self._db = db
-
-    def insert_user_product_counters(self, user_id: str, products: List[dict]) -> None:
-        with self._db.connection() as conn:
-            with conn.cursor() as cur:
-                for product in products:
-                    product_id = product.get('product_id')
-                    product_name = product.get('product_name')
-                    quantity = product.get('quantity', 1)
-                    
-                    if not all([user_id, product_id, product_name]):
-                        continue
-                    cur.execute(
-                        """
-                        INSERT INTO cdm.user_product_counters 
-                            (user_id, product_id, product_name, order_cnt)
-                        VALUES (%s, %s, %s, %s)
-                        ON CONFLICT (user_id, product_id) 
-                        DO UPDATE SET 
-                            order_cnt = cdm.user_product_counters.order_cnt + EXCLUDED.order_cnt,
-                            product_name = EXCLUDED.product_name
-                        """,
-                        (user_id, product_id, product_name, quantity)
-                    )
-
-    def insert_user_category_counters(self, user_id: str, products: List[dict]) -> None:
-        category_data = {}
-        
-        for product in products:
-            category_name = product.get('category_name')
-            quantity = product.get('quantity', 1)
-            
-            if not category_name:
-                continue
-                
-            category_id = str(uuid.uuid5(uuid.NAMESPACE_DNS, f"category_{category_name}"))
-            
-            if category_id not in category_data:
-                category_data[category_id] = {
-                    'category_id': category_id,
-                    'category_name': category_name,
-                    'order_cnt': 0
-                }
-            category_data[category_id]['order_cnt'] += quantity
-
-        with self._db.connection() as conn:
-            with conn.cursor() as cur:
-                for category in category_data.values():
-                    cur.execute(
-                        """
-                        INSERT INTO cdm.user_category_counters 
-                            (user_id, category_id, category_name, order_cnt)
-                        VALUES (%s, %s, %s, %s)
-                        ON CONFLICT (user_id, category_id) 
-                        DO UPDATE SET 
-                            order_cnt = cdm.user_category_counters.order_cnt + EXCLUDED.order_cnt,
-                            category_name = EXCLUDED.category_name
-                        """,
-                        (user_id, category['category_id'], category['category_name'], category['order_cnt'])
-                    )
+from typing import List, Optional
+from lib.metrics import Metrics, NullMetrics
+from lib.pg import PgConnect, execute_round, run_plan
+from cdm_loader.counter_aggregator import CounterOrder
+from cdm_loader.repository.cdm_migrations import cdm_migrator
+from cdm_loader.repository.cdm_counter_plan import CdmCounterPlan
+
+
+class CdmRepository:
+    def __init__(self, db: PgConnect, metrics: Optional[Metrics] = None) -> None:
+        self._db = db
+        self._metrics = metrics or NullMetrics()
+        self._plan = CdmCounterPlan(self._metrics)
+
+    def ensure_schema(self, check_only: bool = False) -> None:
+        # Схема cdm ведётся версионными миграциями; check_only — только убедиться, что все применены
+        migrator = cdm_migrator(self._db)
+        if check_only:
+            migrator.check()
+        else:
+            migrator.run()
+
+    def apply_orders(self, orders: List[CounterOrder]) -> int:
+        # Все заказы батча — в одной транзакции; возвращает число впервые учтённых
+        if not orders:
+            return 0
+        with self._db.connection() as conn:
+            return run_plan(self._plan.apply_orders(orders), lambda statements: execute_round(conn.cursor, statements))
@@ -1 +1,4 @@
-from .kafka_connectors import KafkaConsumer, KafkaProducer  # noqa
+from .kafka_connectors import KafkaConsumer, KafkaMessage, KafkaProducer, OutgoingMessage  # noqa
+from .dead_letter import DeadLetterQueue  # noqa
+from .async_kafka import AsyncDeadLetterQueue, AsyncKafkaConsumer, AsyncKafkaProducer  # noqa
+from .serializers import JsonSerializer, ModelSerializer, OrjsonSerializer, json_serializer  # noqa
@@ -0,0 +1,50 @@
+from datetime import datetime
+from logging import Logger
+from typing import Optional, Union
+
+from lib.kafka_connect.kafka_connectors import KafkaMessage, KafkaProducer
+from lib.metrics import Metrics, NullMetrics
+
+
+class DeadLetterQueue:
+    # Сообщения, которые не обработать повтором, уходят в отдельный топик в исходном виде,
+    # причина и источник — в заголовках. Без топика сообщение только логируется.
+    def __init__(self,
+                 producer: Optional[KafkaProducer],
+                 service: str,
+                 logger: Logger,
+                 metrics: Optional[Metrics] = None
+                 ) -> None:
+        self._producer = producer
+        self._service = service
+        self._logger = logger
+        self._metrics = metrics or NullMetrics()
+
+    def send(self, message: KafkaMessage, error: Union[BaseException, str, None], stage: str) -> None:
+        error_type = type(error).__name__ if isinstance(error, BaseException) else 'DecodeError'
+        self._metrics.inc('dead_letters_total', stage=stage, type=error_type)
+        if self._producer is None:
+            self._logger.error(
+                f"Dropping message {message.topic}:{message.partition}:{message.offset} "
+                f"({stage}, {error_type}: {error}), dead-letter topic is not configured")
+            return
+
+        self._logger.warning(
+            f"Sending message {message.topic}:{message.partition}:{message.offset} "
+            f"to {self._producer.topic} ({stage}, {error_type}: {error})")
+        # Исходные заголовки сохраняем: по ним сообщение из dead-letter топика разбирается при повторе
+        headers = list((message.headers or {}).items()) + [
+            ('dlq.service', self._service),
+            ('dlq.stage', stage),
+            ('dlq.error.type', error_type),
+            ('dlq.error.message', str(error)[:1000]),
+            ('dlq.source.topic', message.topic),
+            ('dlq.source.partition', str(message.partition)),
+            ('dlq.source.offset', str(message.offset)),
+            ('dlq.failed_at', datetime.utcnow().isoformat()),
+        ]
+        self._producer.produce(message.raw or b'', key=message.key, headers=headers)
+
+    def flush(self) -> None:
+        if self._producer is not None:
+            self._producer.flush()
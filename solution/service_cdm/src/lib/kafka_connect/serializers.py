@@ -0,0 +1,64 @@
+import json
+from typing import Any, Dict, Type
+
+import pydantic_core
+from pydantic import BaseModel
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+class JsonSerializer:
+    name = 'json'
+
+    def loads(self, data: bytes) -> Any:
+        return json.loads(data)
+
+    def loads_message(self, data: bytes, headers: Dict[str, bytes]) -> Any:
+        # Сериализаторы, которым важны заголовки сообщения, переопределяют этот метод
+        return self.loads(data)
+
+    def dumps(self, value: Any) -> bytes:
+        if isinstance(value, BaseModel):
+            # Модель сериализуется сразу в bytes на стороне pydantic-core, без промежуточного dict и str
+            return pydantic_core.to_json(value)
+        return json.dumps(value).encode()
+
+
+class OrjsonSerializer(JsonSerializer):
+    name = 'orjson'
+
+    def loads(self, data: bytes) -> Any:
+        return orjson.loads(data)
+
+    def dumps(self, value: Any) -> bytes:
+        if isinstance(value, BaseModel):
+            return pydantic_core.to_json(value)
+        return orjson.dumps(value)
+
+
+class ModelSerializer(JsonSerializer):
+    # Разбор байтов сообщения и проверка схемы за один проход; ошибка схемы — ValueError, как и битый JSON
+    def __init__(self, model: Type[BaseModel], base: JsonSerializer) -> None:
+        self.model = model
+        self.base = base
+        self.name = f'{base.name}+{model.__name__}'
+
+    def loads(self, data: bytes) -> BaseModel:
+        return self.model.model_validate_json(data)
+
+    def dumps(self, value: Any) -> bytes:
+        return self.base.dumps(value)
+
+
+def json_serializer(backend: str = 'auto') -> JsonSerializer:
+    # auto — orjson, если установлен, иначе стандартный json
+    if backend == 'orjson' or (backend == 'auto' and orjson is not None):
+        if orjson is None:
+            raise ValueError('orjson serializer requested but orjson is not installed')
+        return OrjsonSerializer()
+    if backend in ('json', 'auto'):
+        return JsonSerializer()
+    raise ValueError(f'Unknown serializer: {backend}')
@@ -0,0 +1 @@
+from .hashing import KEY_CACHE_SIZE, canonical, category_id, hashdiff, hashdiffs, md5_uuid  # noqa
@@ -0,0 +1 @@
+from .migrator import Migration, MigrationError, Migrator, index_exists  # noqa
@@ -0,0 +1,3 @@
+from .formats import (COMPACT_FORMAT, COMPACT_VERSION, FORMAT_HEADER, FORMATS, JSON_FORMAT,  # noqa
+                      PRODUCT_COUNT_HEADER, STATUS_HEADER, USER_ID_HEADER, OrderFormatSerializer, compact_order,
+                      order_headers)
@@ -0,0 +1,80 @@
+from typing import Any, Dict, List, Optional, Tuple
+
+from lib.kafka_connect.serializers import JsonSerializer
+
+# Формат сообщений DDS -> CDM.
+# json — полное обогащённое сообщение (DdsOrderMessage).
+# compact — массив только с полями, которые читает CDM, первым элементом идёт версия схемы:
+#   [1, object_id, user_id, status, [[product_id, product_name, category_name, quantity], ...]]
+# Поля добавляются в конец массива с новой версией; CDM разбирает все известные ему версии,
+# поэтому при смене схемы CDM обновляется раньше DDS.
+# В обоих форматах ключ сообщения — user_id, а поля для маршрутизации продублированы в заголовках.
+FORMAT_HEADER = 'format'
+USER_ID_HEADER = 'user_id'
+STATUS_HEADER = 'status'
+PRODUCT_COUNT_HEADER = 'product_count'
+
+JSON_FORMAT = 'json'
+COMPACT_FORMAT = 'compact'
+FORMATS = (JSON_FORMAT, COMPACT_FORMAT)
+COMPACT_VERSION = 1
+
+
+def order_headers(output_format: str, user_id: str, status: str, product_count: int) -> List[Tuple[str, str]]:
+    return [
+        (FORMAT_HEADER, output_format),
+        (USER_ID_HEADER, user_id),
+        (STATUS_HEADER, status),
+        (PRODUCT_COUNT_HEADER, str(product_count)),
+    ]
+
+
+def compact_order(object_id: Any, user_id: str, status: str, products: List[tuple]) -> list:
+    return [COMPACT_VERSION, object_id, user_id, status, products]
+
+
+def _message(object_id: Any, user_id: Optional[str], status: Optional[str], products: List[dict]) -> dict:
+    # Разобранное сообщение любого формата имеет вид json-формата, но только с полями, которые нужны CDM
+    return {'object_id': object_id, 'payload': {'user': {'id': user_id}, 'status': status, 'products': products}}
+
+
+def _compact_message(value: Any) -> dict:
+    if not isinstance(value, list) or not value or value[0] != COMPACT_VERSION:
+        version = value[0] if isinstance(value, list) and value else None
+        raise ValueError(f'Unsupported compact order version: {version}')
+    try:
+        _, object_id, user_id, status, products = value[:5]
+        return _message(object_id, user_id, status, [
+            {'product_id': product_id, 'product_name': product_name, 'category_name': category_name,
+             'quantity': quantity}
+            for product_id, product_name, category_name, quantity in products
+        ])
+    except (TypeError, ValueError) as e:
+        raise ValueError(f'Malformed compact order: {e}')
+
+
+class OrderFormatSerializer(JsonSerializer):
+    # Разбор входа CDM: формат выбирается по заголовку, сообщения без заголовка — json, как раньше
+    def __init__(self, base: JsonSerializer) -> None:
+        self.base = base
+        self.name = f'{base.name}+orders'
+
+    def loads(self, data: bytes) -> Any:
+        return self.base.loads(data)
+
+    def dumps(self, value: Any) -> bytes:
+        return self.base.dumps(value)
+
+    def loads_message(self, data: bytes, headers: Dict[str, bytes]) -> Any:
+        output_format = headers.get(FORMAT_HEADER)
+        if output_format is None:
+            return self.base.loads(data)
+        if output_format.decode(errors='replace') not in FORMATS:
+            raise ValueError(f"Unknown order format: {output_format.decode(errors='replace')}")
+        if headers.get(PRODUCT_COUNT_HEADER) == b'0':
+            # Заказ без товаров не меняет счётчики — тело не разбираем
+            user_id = headers.get(USER_ID_HEADER)
+            return _message(None, user_id.decode() if user_id else None, None, [])
+        if output_format == JSON_FORMAT.encode():
+            return self.base.loads(data)
+        return _compact_message(self.base.loads(data))
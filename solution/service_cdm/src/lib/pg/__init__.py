@@ -1 +1,4 @@
 from .pg_connect import PgConnect  # noqa
+from .async_pg_connect import AsyncPgConnect  # noqa
+from .statements import (Plan, Statement, execute_round, execute_round_async, run_plan,  # noqa
+                         run_plan_async)
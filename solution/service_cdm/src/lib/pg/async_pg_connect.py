@@ -0,0 +1,106 @@
+from contextlib import asynccontextmanager
+from typing import AsyncGenerator, Optional
+
+import psycopg
+from psycopg import AsyncConnection
+from psycopg_pool import AsyncConnectionPool
+
+from lib.metrics import Metrics, NullMetrics
+from lib.pg.instrumented import InstrumentedAsyncConnection, InstrumentedAsyncCursor
+from lib.pg.pg_connect import conninfo
+
+
+class AsyncPgConnect:
+    # Те же параметры, что у PgConnect, но соединения asyncio. Пул привязан к event loop,
+    # поэтому создаётся закрытым и открывается в том цикле, где будет работать.
+    def __init__(self,
+                 host: str,
+                 port: int,
+                 db_name: str,
+                 user: str,
+                 pw: str,
+                 sslmode: str = "require",
+                 pool_min_size: int = 0,
+                 pool_max_size: int = 0,
+                 pool_max_idle: float = 600.0,
+                 prepare_threshold: Optional[int] = 5,
+                 metrics: Optional[Metrics] = None
+                 ) -> None:
+        self.host = host
+        self.port = port
+        self.db_name = db_name
+        self.user = user
+        self.pw = pw
+        self.sslmode = sslmode
+        self.prepare_threshold = prepare_threshold
+        self._metrics = metrics or NullMetrics()
+        # Те же счётчики запросов и round trip'ов, что у PgConnect
+        self._connection_class = InstrumentedAsyncConnection if self._metrics.enabled else AsyncConnection
+        self._cursor_factory = InstrumentedAsyncCursor if self._metrics.enabled else psycopg.AsyncCursor
+
+        self._pool: Optional[AsyncConnectionPool] = None
+        if pool_max_size > 0:
+            self._pool = AsyncConnectionPool(
+                self.url(),
+                min_size=pool_min_size,
+                max_size=pool_max_size,
+                max_idle=pool_max_idle,
+                check=AsyncConnectionPool.check_connection,
+                kwargs={'prepare_threshold': prepare_threshold, 'cursor_factory': self._cursor_factory},
+                connection_class=self._connection_class,
+                name=f'{self.db_name}@{self.host}-async',
+                open=False
+            )
+            self._metrics.collector(self._collect_pool_stats)
+
+    def url(self) -> str:
+        return conninfo(self.host, self.port, self.db_name, self.user, self.pw, self.sslmode)
+
+    async def open(self) -> None:
+        if self._pool is not None:
+            await self._pool.open()
+
+    @asynccontextmanager
+    async def connection(self) -> AsyncGenerator[AsyncConnection, None]:
+        if self._pool is not None:
+            try:
+                async with self._pool.connection() as conn:
+                    self._instrument(conn)
+                    yield conn
+            except Exception:
+                self._metrics.inc('db_rollbacks_total')
+                raise
+            self._committed()
+            return
+
+        conn = await self._connection_class.connect(
+            self.url(), prepare_threshold=self.prepare_threshold, cursor_factory=self._cursor_factory)
+        self._instrument(conn)
+        try:
+            yield conn
+            await conn.commit()
+            self._committed()
+        except Exception as e:
+            await conn.rollback()
+            self._metrics.inc('db_rollbacks_total')
+            raise e
+        finally:
+            await conn.close()
+
+    def _instrument(self, conn: AsyncConnection) -> None:
+        if self._metrics.enabled:
+            conn.metrics = self._metrics
+
+    def _committed(self) -> None:
+        self._metrics.inc('db_commits_total')
+        self._metrics.inc('db_round_trips_total')
+
+    def _collect_pool_stats(self, metrics: Metrics) -> None:
+        stats = self._pool.get_stats()
+        metrics.set('db_pool_size', stats.get('pool_size', 0))
+        metrics.set('db_pool_available', stats.get('pool_available', 0))
+        metrics.set('db_pool_requests_waiting', stats.get('requests_waiting', 0))
+
+    async def close(self) -> None:
+        if self._pool is not None:
+            await self._pool.close()
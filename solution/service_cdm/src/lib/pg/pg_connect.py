@@ -1,44 +1,121 @@
 from contextlib import contextmanager
-from typing import Generator
+from typing import Generator, Optional
 
 import psycopg
 from psycopg import Connection
+from psycopg_pool import ConnectionPool
+
+from lib.metrics import Metrics, NullMetrics
+from lib.pg.instrumented import InstrumentedConnection, InstrumentedCursor
+
+
+def conninfo(host: str, port: int, db_name: str, user: str, pw: str, sslmode: str) -> str:
+    return """
+        host={host}
+        port={port}
+        dbname={db_name}
+        user={user}
+        password={pw}
+        target_session_attrs=read-write
+        sslmode={sslmode}
+    """.format(
+        host=host,
+        port=port,
+        db_name=db_name,
+        user=user,
+        pw=pw,
+        sslmode=sslmode)
 
 
 class PgConnect:
-    def __init__(self, host: str, port: int, db_name: str, user: str, pw: str, sslmode: str = "require") -> None:
+    def __init__(self,
+                 host: str,
+                 port: int,
+                 db_name: str,
+                 user: str,
+                 pw: str,
+                 sslmode: str = "require",
+                 pool_min_size: int = 0,
+                 pool_max_size: int = 0,
+                 pool_max_idle: float = 600.0,
+                 prepare_threshold: Optional[int] = 5,
+                 metrics: Optional[Metrics] = None
+                 ) -> None:
         self.host = host
         self.port = port
         self.db_name = db_name
         self.user = user
         self.pw = pw
         self.sslmode = sslmode
+        self.prepare_threshold = prepare_threshold
+        self._metrics = metrics or NullMetrics()
+        # Счётчики запросов подключаются только при включённых метриках, иначе классы psycopg как есть
+        self._connection_class = InstrumentedConnection if self._metrics.enabled else Connection
+        self._cursor_factory = InstrumentedCursor if self._metrics.enabled else psycopg.Cursor
+
+        # Пул включается при pool_max_size > 0, иначе соединение открывается на каждый вызов
+        self._pool: Optional[ConnectionPool] = None
+        if pool_max_size > 0:
+            self._pool = ConnectionPool(
+                self.url(),
+                min_size=pool_min_size,
+                max_size=pool_max_size,
+                max_idle=pool_max_idle,
+                # Проверяем соединение при выдаче из пула, битые пул пересоздаёт сам
+                check=ConnectionPool.check_connection,
+                # Соединения живут долго, поэтому подготовленные запросы переиспользуются между вызовами
+                kwargs={'prepare_threshold': prepare_threshold, 'cursor_factory': self._cursor_factory},
+                connection_class=self._connection_class,
+                name=f'{self.db_name}@{self.host}',
+                open=True
+            )
+            self._metrics.collector(self._collect_pool_stats)
 
     def url(self) -> str:
-        return """
-            host={host}
-            port={port}
-            dbname={db_name}
-            user={user}
-            password={pw}
-            target_session_attrs=read-write
-            sslmode={sslmode}
-        """.format(
-            host=self.host,
-            port=self.port,
-            db_name=self.db_name,
-            user=self.user,
-            pw=self.pw,
-            sslmode=self.sslmode)
+        return conninfo(self.host, self.port, self.db_name, self.user, self.pw, self.sslmode)
 
     @contextmanager
     def connection(self) -> Generator[Connection, None, None]:
-        conn = psycopg.connect(self.url())
+        if self._pool is not None:
+            # Пул сам делает commit/rollback и возвращает соединение обратно
+            try:
+                with self._pool.connection() as conn:
+                    self._instrument(conn)
+                    yield conn
+            except Exception:
+                self._metrics.inc('db_rollbacks_total')
+                raise
+            self._committed()
+            return
+
+        conn = self._connection_class.connect(
+            self.url(), prepare_threshold=self.prepare_threshold, cursor_factory=self._cursor_factory)
+        self._instrument(conn)
         try:
             yield conn
             conn.commit()
+            self._committed()
         except Exception as e:
             conn.rollback()
+            self._metrics.inc('db_rollbacks_total')
             raise e
         finally:
             conn.close()
+
+    def _instrument(self, conn: Connection) -> None:
+        if self._metrics.enabled:
+            conn.metrics = self._metrics
+
+    def _committed(self) -> None:
+        self._metrics.inc('db_commits_total')
+        self._metrics.inc('db_round_trips_total')
+
+    def _collect_pool_stats(self, metrics: Metrics) -> None:
+        stats = self._pool.get_stats()
+        metrics.set('db_pool_size', stats.get('pool_size', 0))
+        metrics.set('db_pool_available', stats.get('pool_available', 0))
+        metrics.set('db_pool_requests_waiting', stats.get('requests_waiting', 0))
+
+    def close(self) -> None:
+        if self._pool is not None:
+            self._pool.close()
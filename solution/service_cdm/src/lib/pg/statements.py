@@ -0,0 +1,55 @@
+from typing import Any, Awaitable, Callable, Generator, List, NamedTuple, Optional, TypeVar
+
+T = TypeVar('T')
+
+
+class Statement(NamedTuple):
+    sql: str
+    params: Any = None
+    # Нужны ли строки результата; остальные запросы в pipeline не ждут ответа
+    fetch: bool = False
+
+
+Results = List[Optional[list]]
+# План — генератор без ввода-вывода: отдаёт раунды запросов, получает их результаты и возвращает итог.
+# Один и тот же план исполняется синхронным и асинхронным соединением.
+Plan = Generator[List[Statement], Results, T]
+
+
+def run_plan(plan: Plan[T], execute: Callable[[List[Statement]], Results]) -> T:
+    results: Optional[Results] = None
+    while True:
+        try:
+            statements = plan.send(results)
+        except StopIteration as stop:
+            return stop.value
+        results = execute(statements) if statements else []
+
+
+async def run_plan_async(plan: Plan[T], execute: Callable[[List[Statement]], Awaitable[Results]]) -> T:
+    results: Optional[Results] = None
+    while True:
+        try:
+            statements = plan.send(results)
+        except StopIteration as stop:
+            return stop.value
+        results = await execute(statements) if statements else []
+
+
+def execute_round(cursor: Callable[[], Any], statements: List[Statement]) -> Results:
+    # Сначала отправляем все запросы раунда, потом читаем результаты: в pipeline это одна синхронизация
+    cursors = []
+    for statement in statements:
+        cur = cursor()
+        cur.execute(statement.sql, statement.params)
+        cursors.append(cur)
+    return [cur.fetchall() if statement.fetch else None for cur, statement in zip(cursors, statements)]
+
+
+async def execute_round_async(cursor: Callable[[], Any], statements: List[Statement]) -> Results:
+    cursors = []
+    for statement in statements:
+        cur = cursor()
+        await cur.execute(statement.sql, statement.params)
+        cursors.append(cur)
+    return [await cur.fetchall() if statement.fetch else None for cur, statement in zip(cursors, statements)]
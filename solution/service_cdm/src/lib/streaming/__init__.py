@@ -0,0 +1,3 @@
+from .stream_loop import StreamLoop  # noqa
+from .worker_pool import WorkerPool  # noqa
+from .async_stream_loop import AsyncStreamLoop, AsyncWorkerPool  # noqa
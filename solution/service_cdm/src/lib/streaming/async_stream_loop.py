@@ -0,0 +1,93 @@
+import asyncio
+import threading
+import time
+from logging import Logger
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from lib.streaming.stream_loop import StreamLoop
+
+
+class AsyncStreamLoop(StreamLoop):
+    # Тот же цикл с адаптивным батчем, но run_batch и lag — корутины; поток не создаёт,
+    # запускается из AsyncWorkerPool вместе с остальными воркерами в одном event loop
+    def __init__(self,
+                 run_batch: Callable[[int, float], Awaitable[int]],
+                 lag: Callable[[], Awaitable[Dict[int, int]]],
+                 logger: Logger,
+                 **kwargs) -> None:
+        super().__init__(run_batch, lag, logger, **kwargs)
+
+    def start(self) -> None:
+        raise RuntimeError(f"{self.name} runs inside AsyncWorkerPool")
+
+    async def run(self) -> None:
+        error_backoff = 0.0
+        while not self._stop.is_set():
+            await self._update_lag_async()
+            started = time.monotonic()
+            try:
+                processed = await self._run_batch(self.batch_size, self._poll_timeout)
+            except Exception as e:
+                self._metrics.inc('stream_batch_errors_total', loop=self.name, type=type(e).__name__)
+                error_backoff = min(max(error_backoff * 2, 1.0), self._max_error_backoff)
+                self._logger.error(f"Stream batch failed, retrying in {error_backoff}s: {e}")
+                await self._sleep(error_backoff)
+                continue
+
+            error_backoff = 0.0
+            self._adapt_batch_size(processed, time.monotonic() - started)
+            self._metrics.set('stream_batch_size', self.batch_size, loop=self.name)
+
+    async def _update_lag_async(self) -> None:
+        now = time.monotonic()
+        if now - self._lag_checked_at < self._lag_interval:
+            return
+        self._lag_checked_at = now
+        try:
+            self.last_lag = sum((await self._lag()).values())
+            self._metrics.set('stream_lag', self.last_lag, loop=self.name)
+        except Exception as e:
+            self._logger.warning(f"Failed to get consumer lag: {e}")
+
+    async def _sleep(self, seconds: float) -> None:
+        # Остановка приходит из другого потока через threading.Event — проверяем её между короткими паузами
+        deadline = time.monotonic() + seconds
+        while not self._stop.is_set() and time.monotonic() < deadline:
+            await asyncio.sleep(min(0.1, seconds))
+
+
+class AsyncWorkerPool:
+    # Все воркеры — корутины одного event loop в отдельном потоке: пока один ждёт Kafka,
+    # другие пишут в БД через общий асинхронный пул соединений
+    def __init__(self,
+                 loops: List[AsyncStreamLoop],
+                 startup: Optional[Callable[[], Awaitable[None]]] = None,
+                 shutdown: Optional[Callable[[], Awaitable[None]]] = None,
+                 name: str = 'async-workers'
+                 ) -> None:
+        self.loops = loops
+        self._startup = startup
+        self._shutdown = shutdown
+        self._thread = threading.Thread(target=lambda: asyncio.run(self._main()), name=name, daemon=True)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self, timeout: float = 30.0) -> List[int]:
+        # Как WorkerPool.stop; воркеры делят один поток, поэтому не остановились либо все, либо никто
+        for loop in self.loops:
+            loop.request_stop()
+        self._thread.join(timeout)
+        return list(range(self.alive()))
+
+    def alive(self) -> int:
+        return len(self.loops) if self._thread.is_alive() else 0
+
+    async def _main(self) -> None:
+        if self._startup is not None:
+            await self._startup()
+        try:
+            await asyncio.gather(*(loop.run() for loop in self.loops))
+        finally:
+            if self._shutdown is not None:
+                await self._shutdown()
@@ -0,0 +1,95 @@
+import threading
+import time
+from logging import Logger
+from typing import Callable, Optional
+
+from lib.metrics import Metrics, NullMetrics
+
+
+class StreamLoop:
+    def __init__(self,
+                 run_batch: Callable[[int, float], int],
+                 lag: Callable[[], int],
+                 logger: Logger,
+                 min_batch_size: int = 10,
+                 max_batch_size: int = 1000,
+                 poll_timeout: float = 0.1,
+                 max_batch_seconds: float = 5.0,
+                 lag_interval: float = 5.0,
+                 max_error_backoff: float = 30.0,
+                 name: str = 'stream-loop',
+                 metrics: Optional[Metrics] = None
+                 ) -> None:
+        self._run_batch = run_batch
+        self._lag = lag
+        self._logger = logger
+        self._min_batch_size = min_batch_size
+        self._max_batch_size = max_batch_size
+        self._poll_timeout = poll_timeout
+        self._max_batch_seconds = max_batch_seconds
+        self._lag_interval = lag_interval
+        self._max_error_backoff = max_error_backoff
+        self.name = name
+        self._metrics = metrics or NullMetrics()
+
+        self.batch_size = min_batch_size
+        self.last_lag = 0
+        self._lag_checked_at = 0.0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self._loop, name=self.name, daemon=True)
+        self._thread.start()
+
+    def request_stop(self) -> None:
+        # Текущий батч дорабатывается до конца, новый не начинается
+        self._stop.set()
+
+    def stop(self, timeout: float = 30.0) -> None:
+        self.request_stop()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def is_alive(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def _loop(self) -> None:
+        error_backoff = 0.0
+        while not self._stop.is_set():
+            self._update_lag()
+            started = time.monotonic()
+            try:
+                processed = self._run_batch(self.batch_size, self._poll_timeout)
+            except Exception as e:
+                self._metrics.inc('stream_batch_errors_total', loop=self.name, type=type(e).__name__)
+                # Ошибка уровня батча (например, недоступна БД) — не крутим цикл вхолостую
+                error_backoff = min(max(error_backoff * 2, 1.0), self._max_error_backoff)
+                self._logger.error(f"Stream batch failed, retrying in {error_backoff}s: {e}")
+                self._stop.wait(error_backoff)
+                continue
+
+            error_backoff = 0.0
+            self._adapt_batch_size(processed, time.monotonic() - started)
+            self._metrics.set('stream_batch_size', self.batch_size, loop=self.name)
+
+    def _update_lag(self) -> None:
+        now = time.monotonic()
+        if now - self._lag_checked_at < self._lag_interval:
+            return
+        self._lag_checked_at = now
+        try:
+            self.last_lag = self._lag()
+            self._metrics.set('stream_lag', self.last_lag, loop=self.name)
+        except Exception as e:
+            self._logger.warning(f"Failed to get consumer lag: {e}")
+
+    def _adapt_batch_size(self, processed: int, elapsed: float) -> None:
+        if elapsed > self._max_batch_seconds:
+            # Батч обрабатывается слишком долго — уменьшаем его, чтобы не копить задержку
+            self.batch_size = max(self._min_batch_size, self.batch_size // 2)
+        elif processed >= self.batch_size and self.last_lag > self.batch_size:
+            # Отставание растёт, а батч заполнен целиком — укрупняем
+            self.batch_size = min(self._max_batch_size, self.batch_size * 2)
+        elif self.last_lag < self.batch_size:
+            self.batch_size = max(self._min_batch_size, min(self.batch_size, self.last_lag))
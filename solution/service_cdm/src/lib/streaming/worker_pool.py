@@ -0,0 +1,26 @@
+from typing import List
+
+from lib.streaming.stream_loop import StreamLoop
+
+
+class WorkerPool:
+    # Несколько consumer'ов одной группы в одном процессе: Kafka раздаёт им партиции,
+    # поэтому порядок сообщений с одним ключом сохраняется внутри своего воркера.
+    def __init__(self, loops: List[StreamLoop]) -> None:
+        self.loops = loops
+
+    def start(self) -> None:
+        for loop in self.loops:
+            loop.start()
+
+    def stop(self, timeout: float = 30.0) -> List[int]:
+        # Сначала просим остановиться всех, потом ждём — воркеры завершаются параллельно.
+        # Возвращает номера воркеров, не доработавших батч за timeout
+        for loop in self.loops:
+            loop.request_stop()
+        for loop in self.loops:
+            loop.stop(timeout)
+        return [worker for worker, loop in enumerate(self.loops) if loop.is_alive()]
+
+    def alive(self) -> int:
+        return sum(1 for loop in self.loops if loop.is_alive())
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# Тесты запускаются из service_cdm: python -m pytest tests
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
@@ -0,0 +1,112 @@
+import asyncio
+from typing import List, Set
+
+from lib.pg import Statement, run_plan, run_plan_async
+from cdm_loader.counter_aggregator import CounterOrder
+from cdm_loader.repository.cdm_counter_plan import CdmCounterPlan
+
+USER_1 = '11111111-1111-1111-1111-111111111111'
+USER_2 = '22222222-2222-2222-2222-222222222222'
+PRODUCT_1 = 'aaaaaaaa-aaaa-aaaa-aaaa-aaaaaaaaaaaa'
+PRODUCT_2 = 'bbbbbbbb-bbbb-bbbb-bbbb-bbbbbbbbbbbb'
+
+
+class FakeWarehouse:
+    # processed — заказы, уже учтённые в счётчиках: claim_orders их не вернёт
+    def __init__(self, processed: Set[str] = frozenset()) -> None:
+        self.processed = set(processed)
+        self.rounds: List[List[Statement]] = []
+
+    def __call__(self, statements: List[Statement]) -> List[list]:
+        self.rounds.append(statements)
+        return [self._execute(statement) for statement in statements]
+
+    async def execute_async(self, statements: List[Statement]) -> List[list]:
+        return self(statements)
+
+    def _execute(self, statement: Statement):
+        if 'cdm.processed_orders' not in statement.sql:
+            return None
+        _, object_ids = statement.params
+        claimed = [(object_id,) for object_id in object_ids if object_id not in self.processed]
+        self.processed.update(object_ids)
+        return claimed
+
+    def upserts(self, table: str) -> List[tuple]:
+        rows = []
+        for statements in self.rounds:
+            for statement in statements:
+                if f'INSERT INTO {table}' in statement.sql:
+                    rows.extend(zip(*statement.params))
+        return rows
+
+
+def order(object_id, user_id: str, *products) -> CounterOrder:
+    return CounterOrder(object_id, user_id, [
+        {'product_id': product_id, 'product_name': 'name', 'category_name': category, 'quantity': 1}
+        for product_id, category in products
+    ])
+
+
+def test_order_is_applied_once():
+    warehouse = FakeWarehouse(processed={'1'})
+    applied = run_plan(CdmCounterPlan().apply_orders([
+        order('1', USER_1, (PRODUCT_1, 'Супы')),
+        order('2', USER_1, (PRODUCT_1, 'Супы')),
+        order('2', USER_1, (PRODUCT_1, 'Супы')),
+        order('3', USER_2, (PRODUCT_2, 'Горячее')),
+    ]), warehouse)
+
+    assert applied == 2
+    assert warehouse.rounds[0][0].params[1] == ['1', '2', '3']
+    assert sorted(warehouse.upserts('cdm.user_product_counters')) == [
+        (USER_1, PRODUCT_1, 'name', 1), (USER_2, PRODUCT_2, 'name', 1)]
+
+
+def test_orders_without_id_are_always_applied():
+    warehouse = FakeWarehouse()
+    applied = run_plan(CdmCounterPlan().apply_orders([
+        order(None, USER_1, (PRODUCT_1, 'Супы')),
+        order(None, USER_1, (PRODUCT_1, 'Супы')),
+    ]), warehouse)
+
+    assert applied == 2
+    # Заказы без id не записываются в processed_orders
+    assert [len(statements) for statements in warehouse.rounds] == [1, 1]
+    assert warehouse.upserts('cdm.user_product_counters') == [(USER_1, PRODUCT_1, 'name', 2)]
+
+
+def test_replayed_batch_writes_no_counters():
+    warehouse = FakeWarehouse()
+    orders = [order('1', USER_1, (PRODUCT_1, 'Супы'))]
+    run_plan(CdmCounterPlan().apply_orders(orders), warehouse)
+    warehouse.rounds.clear()
+
+    assert run_plan(CdmCounterPlan().apply_orders(orders), warehouse) == 0
+    assert len(warehouse.rounds) == 1
+
+
+def test_counters_are_upserted_in_key_order():
+    warehouse = FakeWarehouse()
+    run_plan(CdmCounterPlan().apply_orders([
+        order('1', USER_2, (PRODUCT_2, 'Супы'), (PRODUCT_1, 'Горячее')),
+        order('2', USER_1, (PRODUCT_2, 'Супы')),
+    ]), warehouse)
+
+    keys = [(user_id, product_id) for user_id, product_id, _, _ in warehouse.upserts('cdm.user_product_counters')]
+    assert keys == sorted(keys)
+    keys = [(user_id, category_id) for user_id, category_id, _, _ in warehouse.upserts('cdm.user_category_counters')]
+    assert keys == sorted(keys)
+
+
+def test_async_execution_sends_the_same_statements():
+    orders = [order('1', USER_1, (PRODUCT_1, 'Супы')), order('2', USER_2, (PRODUCT_2, 'Горячее'))]
+    sync_warehouse = FakeWarehouse()
+    run_plan(CdmCounterPlan().apply_orders(orders), sync_warehouse)
+    async_warehouse = FakeWarehouse()
+    asyncio.run(run_plan_async(CdmCounterPlan().apply_orders(orders), async_warehouse.execute_async))
+
+    assert [[s.sql for s in statements] for statements in async_warehouse.rounds] == [
+        [s.sql for s in statements] for statements in sync_warehouse.rounds]
+    assert async_warehouse.upserts('cdm.user_product_counters') == sync_warehouse.upserts(
+        'cdm.user_product_counters')
@@ -0,0 +1,56 @@
+from lib.keys import category_id
+from cdm_loader.counter_aggregator import CounterOrder, fold_counters
+
+USER_1 = '11111111-1111-1111-1111-111111111111'
+USER_2 = '22222222-2222-2222-2222-222222222222'
+PRODUCT_1 = 'aaaaaaaa-aaaa-aaaa-aaaa-aaaaaaaaaaaa'
+PRODUCT_2 = 'bbbbbbbb-bbbb-bbbb-bbbb-bbbbbbbbbbbb'
+
+
+def product(product_id: str, name: str, category: str, quantity: int = 1) -> dict:
+    return {'product_id': product_id, 'product_name': name, 'category_name': category, 'quantity': quantity}
+
+
+def test_quantities_are_summed_per_key():
+    deltas = fold_counters([
+        CounterOrder('1', USER_1, [product(PRODUCT_1, 'Борщ', 'Супы', 2), product(PRODUCT_2, 'Солянка', 'Супы')]),
+        CounterOrder('2', USER_1, [product(PRODUCT_1, 'Борщ', 'Супы', 3)]),
+        CounterOrder('3', USER_2, [product(PRODUCT_1, 'Борщ', 'Супы')]),
+    ])
+
+    assert deltas.products == {
+        (USER_1, PRODUCT_1): ['Борщ', 5],
+        (USER_1, PRODUCT_2): ['Солянка', 1],
+        (USER_2, PRODUCT_1): ['Борщ', 1],
+    }
+    assert deltas.categories == {
+        (USER_1, category_id('Супы')): ['Супы', 6],
+        (USER_2, category_id('Супы')): ['Супы', 1],
+    }
+
+
+def test_latest_name_wins():
+    deltas = fold_counters([
+        CounterOrder('1', USER_1, [product(PRODUCT_1, 'Борщ', 'Супы')]),
+        CounterOrder('2', USER_1, [product(PRODUCT_1, 'Борщ с пампушками', 'Супы')]),
+    ])
+
+    assert deltas.products == {(USER_1, PRODUCT_1): ['Борщ с пампушками', 2]}
+
+
+def test_quantity_defaults_to_one_and_incomplete_products_are_skipped():
+    deltas = fold_counters([CounterOrder('1', USER_1, [
+        {'product_id': PRODUCT_1, 'product_name': 'Борщ', 'category_name': 'Супы'},
+        {'product_id': PRODUCT_2, 'category_name': 'Горячее', 'quantity': 2},
+        {'product_id': PRODUCT_2, 'product_name': 'Плов'},
+    ])])
+
+    assert deltas.products == {(USER_1, PRODUCT_1): ['Борщ', 1], (USER_1, PRODUCT_2): ['Плов', 1]}
+    assert deltas.categories == {
+        (USER_1, category_id('Супы')): ['Супы', 1],
+        (USER_1, category_id('Горячее')): ['Горячее', 2],
+    }
+
+
+def test_empty_batch():
+    assert fold_counters([]) == ({}, {})
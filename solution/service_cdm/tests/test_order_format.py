@@ -0,0 +1,98 @@
+import logging
+
+import pytest
+
+from lib.kafka_connect import json_serializer
+from lib.order_format import (COMPACT_FORMAT, FORMAT_HEADER, JSON_FORMAT, OrderFormatSerializer, compact_order,
+                              order_headers)
+from cdm_loader.cdm_message_processor_job import parse_order
+
+LOGGER = logging.getLogger(__name__)
+USER_ID = '11111111-1111-1111-1111-111111111111'
+PRODUCTS = [
+    ['aaaaaaaa-aaaa-aaaa-aaaa-aaaaaaaaaaaa', 'Борщ', 'Супы', 2],
+    ['bbbbbbbb-bbbb-bbbb-bbbb-bbbbbbbbbbbb', 'Плов', 'Горячее', 1],
+]
+
+
+def json_order() -> dict:
+    # Полное сообщение DDS: поля, которые CDM не читает, тоже есть
+    return {
+        'object_id': 42,
+        'object_type': 'order',
+        'payload': {
+            'id': 42,
+            'date': '2024-01-01 10:00:00',
+            'cost': 300,
+            'payment': 300,
+            'status': 'CLOSED',
+            'user': {'id': USER_ID, 'name': 'name'},
+            'restaurant': {'id': 'cccccccc-cccc-cccc-cccc-cccccccccccc', 'name': 'name'},
+            'products': [
+                {'product_id': product_id, 'product_name': name, 'category_name': category, 'price': 150,
+                 'quantity': quantity}
+                for product_id, name, category, quantity in PRODUCTS
+            ],
+            'processed_ts': '2024-01-01 10:00:01',
+        },
+    }
+
+
+def encode(output_format: str, value):
+    headers = order_headers(output_format, USER_ID, 'CLOSED', len(PRODUCTS))
+    return json_serializer().dumps(value), {name: header.encode() for name, header in headers}
+
+
+@pytest.fixture
+def serializer() -> OrderFormatSerializer:
+    return OrderFormatSerializer(json_serializer())
+
+
+def test_compact_and_json_give_the_same_order(serializer):
+    data, headers = encode(COMPACT_FORMAT, compact_order(42, USER_ID, 'CLOSED', PRODUCTS))
+    compact = parse_order(serializer.loads_message(data, headers), LOGGER)
+    data, headers = encode(JSON_FORMAT, json_order())
+    full = parse_order(serializer.loads_message(data, headers), LOGGER)
+
+    assert compact.object_id == full.object_id == '42'
+    assert compact.user_id == full.user_id == USER_ID
+    assert compact.products == [
+        {key: product[key] for key in ('product_id', 'product_name', 'category_name', 'quantity')}
+        for product in full.products
+    ]
+
+
+def test_message_without_format_header_is_json(serializer):
+    data, _ = encode(JSON_FORMAT, json_order())
+
+    assert serializer.loads_message(data, {}) == json_order()
+
+
+def test_order_without_products_is_not_decoded(serializer):
+    headers = {name: value.encode() for name, value in order_headers(COMPACT_FORMAT, USER_ID, 'CLOSED', 0)}
+
+    value = serializer.loads_message(b'not json', headers)
+    assert value['payload']['user']['id'] == USER_ID
+    assert parse_order(value, LOGGER) is None
+
+
+def test_unknown_compact_version_is_rejected(serializer):
+    data, headers = encode(COMPACT_FORMAT, [2, 42, USER_ID, 'CLOSED', PRODUCTS])
+
+    with pytest.raises(ValueError, match='Unsupported compact order version: 2'):
+        serializer.loads_message(data, headers)
+
+
+def test_malformed_compact_order_is_rejected(serializer):
+    data, headers = encode(COMPACT_FORMAT, compact_order(42, USER_ID, 'CLOSED', [['only-id']]))
+
+    with pytest.raises(ValueError, match='Malformed compact order'):
+        serializer.loads_message(data, headers)
+
+
+def test_unknown_format_is_rejected(serializer):
+    data, headers = encode(JSON_FORMAT, json_order())
+    headers[FORMAT_HEADER] = b'avro'
+
+    with pytest.raises(ValueError, match='Unknown order format: avro'):
+        serializer.loads_message(data, headers)
@@ -1,11 +1,17 @@
 import logging
+import signal
+import sys
 
 from apscheduler.schedulers.background import BackgroundScheduler
-from flask import Flask
+from flask import Flask, Response
 
 from app_config import AppConfig
+from dds_loader.async_dds_message_processor_job import AsyncDdsMessageProcessor
 from dds_loader.dds_message_processor_job import DdsMessageProcessor
+from dds_loader.repository import AsyncDdsRepository
 from dds_loader.repository.dds_repository import DdsRepository
+from lib.kafka_connect import AsyncDeadLetterQueue, AsyncKafkaConsumer, AsyncKafkaProducer
+from lib.streaming import AsyncWorkerPool, WorkerPool
 
 app = Flask(__name__)
 
@@ -17,24 +23,148 @@ def hello_world():
     return 'healthy'
 
 
+@app.get('/metrics')
+def metrics():
+    return Response(config.metrics.render(), mimetype='text/plain; version=0.0.4')
+
+
+def collect_cache_stats(metrics, repository, worker: int) -> None:
+    for cache, stats in repository.cache_stats().items():
+        for name, value in stats.items():
+            metrics.set(f'dds_cache_{name}', value, cache=cache, worker=worker)
+        lookups = stats.get('hits', 0) + stats.get('misses', 0)
+        if lookups:
+            metrics.set('dds_cache_hit_ratio', stats['hits'] / lookups, cache=cache, worker=worker)
+
+
+def start_maintenance(db) -> BackgroundScheduler:
+    # Миграции и секции сателлитов — до старта воркеров, дальше секции обслуживаются в фоне
+    DdsRepository(db).ensure_schema(check_only=config.migrations_mode == 'check')
+    partitions = config.dds_partitions(db, app.logger)
+    partitions.maintain()
+    maintenance = BackgroundScheduler()
+    maintenance.add_job(func=partitions.maintain, trigger="interval", hours=6)
+    maintenance.start()
+    return maintenance
+
+
+def start_async_workers() -> AsyncWorkerPool:
+    # Синхронное соединение без пула нужно только для схемы, секций и загрузки индекса hashdiff
+    sync_db = config.pg_warehouse_db(pooled=False)
+    start_maintenance(sync_db)
+    hashdiff_index = config.dds_hashdiff_index(sync_db, app.logger)
+    pg_connect = config.pg_warehouse_async_db()
+
+    consumers = []
+    loops = []
+    for worker in range(config.workers):
+        consumer = AsyncKafkaConsumer(config.kafka_consumer(app.logger, worker))
+        consumers.append(consumer)
+        dds_repository = AsyncDdsRepository(
+            pg_connect, config.dds_keys(), config.dds_cache(hashdiff_index), config.dds_pipeline, config.metrics)
+        config.metrics.collector(lambda m, r=dds_repository, w=worker: collect_cache_stats(m, r, w))
+
+        proc = AsyncDdsMessageProcessor(
+            consumer=consumer,
+            producer=AsyncKafkaProducer(config.kafka_producer()),
+            dds_repository=dds_repository,
+            logger=app.logger,
+            metrics=config.metrics,
+            dead_letters=AsyncDeadLetterQueue(config.dead_letter_queue(app.logger)),
+            retry=config.retry_policy(),
+            concurrency=config.async_concurrency,
+            output_format=config.dds_output_format
+        )
+        loops.append(config.async_stream_loop(proc.run, consumer.lag, app.logger, worker))
+
+    async def shutdown() -> None:
+        # Выходим из consumer group и закрываем пул в том же event loop, где он работал
+        for consumer in consumers:
+            await consumer.close()
+        await pg_connect.close()
+
+    pool = AsyncWorkerPool(loops, startup=pg_connect.open, shutdown=shutdown)
+    pool.start()
+    return pool
+
+
 if __name__ == '__main__':
     app.logger.setLevel(logging.DEBUG)
 
-    consumer = config.kafka_consumer()
-    producer = config.kafka_producer()
+    if config.run_mode == 'async':
+        async_pool = start_async_workers()
+
+        def shutdown_async(signum, frame):
+            app.logger.info("Shutting down DDS service")
+            stuck = async_pool.stop()
+            if stuck:
+                # Consumer'ы закрываются в event loop только после выхода всех воркеров
+                app.logger.warning(f"Workers {stuck} did not finish their batches, leaving consumers open")
+            sys.exit(0)
+
+        signal.signal(signal.SIGTERM, shutdown_async)
+        signal.signal(signal.SIGINT, shutdown_async)
+        app.run(debug=True, host='0.0.0.0', use_reloader=False)
+        sys.exit(0)
+
     pg_connect = config.pg_warehouse_db()
-    
-    dds_repository = DdsRepository(pg_connect)
-
-    proc = DdsMessageProcessor(
-        consumer=consumer,
-        producer=producer,
-        dds_repository=dds_repository,
-        logger=app.logger
-    )
-
-    scheduler = BackgroundScheduler()
-    scheduler.add_job(func=proc.run, trigger="interval", seconds=25)
-    scheduler.start()
+    start_maintenance(pg_connect)
+    # Индекс hashdiff один на процесс: воркеры видят изменения друг друга сразу после commit
+    hashdiff_index = config.dds_hashdiff_index(pg_connect, app.logger)
+
+    # У каждого воркера свои consumer, producer и кэш репозитория; пул соединений общий
+    consumers = []
+    processors = []
+    for worker in range(config.workers):
+        consumer = config.kafka_consumer(app.logger, worker)
+        producer = config.kafka_producer()
+        dds_repository = DdsRepository(
+            pg_connect, config.dds_keys(), config.dds_cache(hashdiff_index), config.dds_pipeline, config.metrics)
+        config.metrics.collector(lambda m, r=dds_repository, w=worker: collect_cache_stats(m, r, w))
+
+        proc = DdsMessageProcessor(
+            consumer=consumer,
+            producer=producer,
+            dds_repository=dds_repository,
+            logger=app.logger,
+            metrics=config.metrics,
+            dead_letters=config.dead_letter_queue(app.logger),
+            retry=config.retry_policy(),
+            bulk_lag_threshold=config.dds_bulk_lag_threshold,
+            output_format=config.dds_output_format
+        )
+        consumers.append(consumer)
+        processors.append(proc)
+
+    if config.run_mode == 'stream':
+        pool = WorkerPool([
+            config.stream_loop(proc.run, proc.lag, app.logger, worker)
+            for worker, proc in enumerate(processors)
+        ])
+        pool.start()
+
+        def shutdown(signum, frame):
+            # Дорабатываем текущие батчи и корректно выходим из consumer group
+            app.logger.info("Shutting down DDS service")
+            stuck = pool.stop()
+            for worker, consumer in enumerate(consumers):
+                if worker in stuck:
+                    # Воркер ещё внутри батча и пользуется consumer'ом: не закрываем, offset'ы батча не закоммичены,
+                    # его сообщения прочитает следующий владелец партиций
+                    app.logger.warning(f"Worker {worker} did not finish its batch, leaving its consumer open")
+                else:
+                    consumer.close()
+            # Пул соединений закрываем, только если им больше никто не пользуется
+            if not stuck:
+                pg_connect.close()
+            sys.exit(0)
+
+        signal.signal(signal.SIGTERM, shutdown)
+        signal.signal(signal.SIGINT, shutdown)
+    else:
+        scheduler = BackgroundScheduler()
+        for proc in processors:
+            scheduler.add_job(func=proc.run, trigger="interval", seconds=config.job_interval)
+        scheduler.start()
 
     app.run(debug=True, host='0.0.0.0', use_reloader=False)
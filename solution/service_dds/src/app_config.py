@@ -1,7 +1,13 @@
 import os
 
-from lib.kafka_connect import KafkaConsumer, KafkaProducer
-from lib.pg import PgConnect
+from lib.kafka_connect import DeadLetterQueue, KafkaConsumer, KafkaProducer, ModelSerializer, json_serializer
+from lib.metrics import Metrics, NullMetrics
+from lib.pg import AsyncPgConnect, PgConnect
+from lib.retry import RetryPolicy
+from lib.streaming import AsyncStreamLoop, StreamLoop
+from dds_loader.order_messages import OrderMessage
+from dds_loader.repository import DdsCache, DdsHashdiffIndex, DdsKeys, DdsPartitions
+from dds_loader.repository.dds_tables import hub_satellites
 
 
 class AppConfig:
@@ -18,12 +24,72 @@ class AppConfig:
         self.kafka_producer_username = str(os.getenv('KAFKA_CONSUMER_USERNAME'))
         self.kafka_producer_password = str(os.getenv('KAFKA_CONSUMER_PASSWORD'))
         self.kafka_producer_topic = str(os.getenv('KAFKA_DESTINATION_TOPIC'))
+        self.kafka_producer_batched = str(os.getenv('KAFKA_PRODUCER_BATCHED') or 'true').lower() == 'true'
+        self.kafka_producer_linger_ms = int(os.getenv('KAFKA_PRODUCER_LINGER_MS') or 20)
+        self.kafka_producer_batch_size = int(os.getenv('KAFKA_PRODUCER_BATCH_SIZE') or 131072)
+        self.kafka_producer_compression = str(os.getenv('KAFKA_PRODUCER_COMPRESSION') or 'lz4')
+        # json — полное обогащённое сообщение, compact — версионированный массив только с полями для CDM
+        self.dds_output_format = str(os.getenv('DDS_OUTPUT_FORMAT') or 'json')
+
+        # Статическое членство в consumer group: постоянное имя экземпляра (например, имя пода), к нему
+        # добавляется номер воркера. Перезапуск быстрее KAFKA_SESSION_TIMEOUT_MS проходит без ребалансировки
+        self.kafka_group_instance_id = str(os.getenv('KAFKA_GROUP_INSTANCE_ID') or '')
+        self.kafka_session_timeout_ms = int(os.getenv('KAFKA_SESSION_TIMEOUT_MS') or 45000)
+
+        # Топик для сообщений, которые не удалось обработать; пустой — такие сообщения только логируются
+        self.kafka_dlq_topic = str(os.getenv('KAFKA_DLQ_TOPIC') or '')
+        # auto — orjson, если установлен, иначе стандартный json
+        self.kafka_serializer = str(os.getenv('KAFKA_SERIALIZER') or 'auto')
 
         self.pg_warehouse_host = str(os.getenv('PG_WAREHOUSE_HOST'))
         self.pg_warehouse_port = int(str(os.getenv('PG_WAREHOUSE_PORT')))
         self.pg_warehouse_dbname = str(os.getenv('PG_WAREHOUSE_DBNAME'))
         self.pg_warehouse_user = str(os.getenv('PG_WAREHOUSE_USER'))
         self.pg_warehouse_password = str(os.getenv('PG_WAREHOUSE_PASSWORD'))
+        self.pg_pool_min_size = int(os.getenv('PG_POOL_MIN_SIZE') or 1)
+        self.pg_pool_max_size = int(os.getenv('PG_POOL_MAX_SIZE') or 4)
+        self.pg_pool_max_idle = float(os.getenv('PG_POOL_MAX_IDLE') or 600)
+        self.pg_prepare_threshold = int(os.getenv('PG_PREPARE_THRESHOLD') or 1)
+
+        # stream — непрерывный цикл чтения, scheduler — запуск батча раз в job_interval секунд,
+        # async — воркеры-корутины в одном event loop с асинхронным пулом соединений
+        self.run_mode = str(os.getenv('RUN_MODE') or 'stream')
+        self.job_interval = int(os.getenv('JOB_INTERVAL') or 25)
+        self.stream_min_batch_size = int(os.getenv('STREAM_MIN_BATCH_SIZE') or 10)
+        self.stream_max_batch_size = int(os.getenv('STREAM_MAX_BATCH_SIZE') or 1000)
+        self.stream_poll_timeout = float(os.getenv('STREAM_POLL_TIMEOUT') or 0.1)
+        # Количество воркеров (consumer'ов одной группы) в процессе, у каждого своё соединение из пула
+        self.workers = int(os.getenv('WORKERS') or 1)
+        # В режиме async: на сколько параллельных транзакций делится батч воркера
+        self.async_concurrency = int(os.getenv('ASYNC_CONCURRENCY') or 4)
+
+        # apply — недостающие миграции схемы применяются при старте, check — сервис не стартует, пока они не применены
+        self.migrations_mode = str(os.getenv('MIGRATIONS_MODE') or 'apply')
+
+        # Метрики для /metrics; при выключении все вызовы инструментирования пустые
+        self.metrics_enabled = str(os.getenv('METRICS_ENABLED') or 'true').lower() == 'true'
+        self.metrics = Metrics() if self.metrics_enabled else NullMetrics()
+
+        # Повторы при временных ошибках БД/Kafka с экспоненциальной задержкой
+        self.retry_max_attempts = int(os.getenv('RETRY_MAX_ATTEMPTS') or 4)
+        self.retry_base_delay = float(os.getenv('RETRY_BASE_DELAY') or 0.5)
+        self.retry_max_delay = float(os.getenv('RETRY_MAX_DELAY') or 10)
+
+        self.dds_key_mode = str(os.getenv('DDS_KEY_MODE') or DdsKeys.RANDOM)
+        self.dds_cache_size = int(os.getenv('DDS_CACHE_SIZE') or 10000)
+        # Хаб, по бизнес-ключу которого разложен входной топик: кэшируются только hashdiff его сателлитов.
+        # none — ключ сообщения не задан, последние версии всех сателлитов читаются из БД
+        self.dds_partition_hub = str(os.getenv('DDS_PARTITION_HUB') or 'order')
+        # pipeline-режим psycopg: запросы батча отправляются без ожидания ответа на каждый
+        self.dds_pipeline = str(os.getenv('DDS_PIPELINE') or 'true').lower() == 'true'
+        # Индекс текущих hashdiff кэшируемых сателлитов в памяти, загружается при каждом назначении партиций
+        self.dds_hashdiff_warm_up = str(os.getenv('DDS_HASHDIFF_WARM_UP') or 'false').lower() == 'true'
+        # Отставание consumer'а, начиная с которого батчи грузятся через COPY во временные таблицы;
+        # 0 — выключено. Отставание опрашивает цикл режима stream
+        self.dds_bulk_lag_threshold = int(os.getenv('DDS_BULK_LAG_THRESHOLD') or 10000)
+        # Помесячные секции сателлитов: сколько месяцев создавать наперёд и сколько хранить подключёнными (0 — все)
+        self.dds_partition_months_ahead = int(os.getenv('DDS_PARTITION_MONTHS_AHEAD') or 2)
+        self.dds_partition_retain_months = int(os.getenv('DDS_PARTITION_RETAIN_MONTHS') or 0)
 
     def kafka_producer(self):
         return KafkaProducer(
@@ -32,10 +98,16 @@ class AppConfig:
             self.kafka_producer_username,
             self.kafka_producer_password,
             self.kafka_producer_topic,
-            self.CERTIFICATE_PATH
+            self.CERTIFICATE_PATH,
+            batched=self.kafka_producer_batched,
+            linger_ms=self.kafka_producer_linger_ms,
+            batch_size=self.kafka_producer_batch_size,
+            compression=self.kafka_producer_compression,
+            serializer=json_serializer(self.kafka_serializer),
+            metrics=self.metrics
         )
 
-    def kafka_consumer(self):
+    def kafka_consumer(self, logger, worker: int = 0):
         return KafkaConsumer(
             self.kafka_host,
             self.kafka_port,
@@ -43,14 +115,102 @@ class AppConfig:
             self.kafka_consumer_password,
             self.kafka_consumer_topic,
             self.kafka_consumer_group,
-            self.CERTIFICATE_PATH
+            self.CERTIFICATE_PATH,
+            client_id=f'{self.kafka_consumer_group}-{worker}',
+            metrics=self.metrics,
+            group_instance_id=f'{self.kafka_group_instance_id}-{worker}' if self.kafka_group_instance_id else '',
+            session_timeout_ms=self.kafka_session_timeout_ms,
+            logger=logger,
+            serializer=ModelSerializer(OrderMessage, json_serializer(self.kafka_serializer))
         )
 
-    def pg_warehouse_db(self):
+    def pg_warehouse_db(self, pooled: bool = True):
         return PgConnect(
             self.pg_warehouse_host,
             self.pg_warehouse_port,
             self.pg_warehouse_dbname,
             self.pg_warehouse_user,
-            self.pg_warehouse_password
+            self.pg_warehouse_password,
+            pool_min_size=self.pg_pool_min_size,
+            pool_max_size=max(self.pg_pool_max_size, self.workers) if pooled else 0,
+            pool_max_idle=self.pg_pool_max_idle,
+            prepare_threshold=self.pg_prepare_threshold,
+            metrics=self.metrics
+        )
+
+    def pg_warehouse_async_db(self):
+        return AsyncPgConnect(
+            self.pg_warehouse_host,
+            self.pg_warehouse_port,
+            self.pg_warehouse_dbname,
+            self.pg_warehouse_user,
+            self.pg_warehouse_password,
+            pool_min_size=self.pg_pool_min_size,
+            pool_max_size=max(self.pg_pool_max_size, self.async_concurrency),
+            pool_max_idle=self.pg_pool_max_idle,
+            prepare_threshold=self.pg_prepare_threshold,
+            metrics=self.metrics
+        )
+
+    def dds_keys(self):
+        return DdsKeys(self.dds_key_mode)
+
+    def dds_cache(self, hashdiff_index=None):
+        return DdsCache(self.dds_cache_size, hashdiff_index, self.dds_partition_hub)
+
+    def dds_hashdiff_index(self, db, logger):
+        if not self.dds_hashdiff_warm_up:
+            return None
+        # Загрузку запускает первое назначение партиций: раньше заказы ещё пишут другие consumer'ы
+        return DdsHashdiffIndex(db, logger, hub_satellites(self.dds_partition_hub))
+
+    def dds_partitions(self, db, logger):
+        return DdsPartitions(db, logger, self.dds_partition_months_ahead, self.dds_partition_retain_months)
+
+    def stream_loop(self, run_batch, lag, logger, worker: int = 0):
+        return StreamLoop(
+            run_batch,
+            lag,
+            logger,
+            min_batch_size=self.stream_min_batch_size,
+            max_batch_size=self.stream_max_batch_size,
+            poll_timeout=self.stream_poll_timeout,
+            name=f'stream-loop-{worker}',
+            metrics=self.metrics
+        )
+
+    def async_stream_loop(self, run_batch, lag, logger, worker: int = 0):
+        return AsyncStreamLoop(
+            run_batch,
+            lag,
+            logger,
+            min_batch_size=self.stream_min_batch_size,
+            max_batch_size=self.stream_max_batch_size,
+            poll_timeout=self.stream_poll_timeout,
+            name=f'async-loop-{worker}',
+            metrics=self.metrics
+        )
+
+    def dead_letter_queue(self, logger):
+        producer = None
+        if self.kafka_dlq_topic:
+            producer = KafkaProducer(
+                self.kafka_host,
+                self.kafka_port,
+                self.kafka_producer_username,
+                self.kafka_producer_password,
+                self.kafka_dlq_topic,
+                self.CERTIFICATE_PATH,
+                batched=True,
+                serializer=json_serializer(self.kafka_serializer),
+                metrics=self.metrics
+            )
+        return DeadLetterQueue(producer, 'dds', logger, self.metrics)
+
+    def retry_policy(self):
+        return RetryPolicy(
+            max_attempts=self.retry_max_attempts,
+            base_delay=self.retry_base_delay,
+            max_delay=self.retry_max_delay,
+            metrics=self.metrics
         )
@@ -0,0 +1,144 @@
+import asyncio
+from logging import Logger
+from typing import Dict, List, Optional, Tuple
+
+from lib.kafka_connect import (AsyncDeadLetterQueue, AsyncKafkaConsumer, AsyncKafkaProducer, DeadLetterQueue,
+                               KafkaMessage)
+from lib.metrics import Metrics, NullMetrics
+from lib.order_format import FORMATS, JSON_FORMAT
+from lib.retry import RetryPolicy
+from dds_loader.dds_message_processor_job import latest_copies, output_record
+from dds_loader.order_messages import OrderMessage
+from dds_loader.repository.async_dds_repository import AsyncDdsRepository
+
+
+def _satellite_hub_keys(msg: OrderMessage) -> List[Tuple[str, str]]:
+    payload = msg.payload
+    keys = [('order', str(msg.object_id)), ('user', payload.user.id), ('restaurant', payload.restaurant.id)]
+    keys.extend(('product', product.id) for product in payload.products)
+    return keys
+
+
+class AsyncDdsMessageProcessor:
+    # Асинхронный вариант DdsMessageProcessor с той же семантикой батча: DLQ, повторы, деление пополам,
+    # commit offset только после flush. Батч делится на независимые части, части пишутся параллельно
+    # в своих транзакциях — порядок сообщений сохраняется внутри части.
+    def __init__(self,
+                 consumer: AsyncKafkaConsumer,
+                 producer: AsyncKafkaProducer,
+                 dds_repository: AsyncDdsRepository,
+                 logger: Logger,
+                 metrics: Optional[Metrics] = None,
+                 dead_letters: Optional[AsyncDeadLetterQueue] = None,
+                 retry: Optional[RetryPolicy] = None,
+                 concurrency: int = 4,
+                 output_format: str = JSON_FORMAT) -> None:
+        if output_format not in FORMATS:
+            raise ValueError(f'Unknown output format: {output_format}')
+        self._consumer = consumer
+        self._producer = producer
+        self._dds_repository = dds_repository
+        self._logger = logger
+        self._metrics = metrics or NullMetrics()
+        self._dead_letters = dead_letters or AsyncDeadLetterQueue(DeadLetterQueue(None, 'dds', logger, self._metrics))
+        self._retry = retry or RetryPolicy(metrics=self._metrics)
+        self._concurrency = max(1, concurrency)
+        self._output_format = output_format
+        self._batch_size = 30
+        self._consumer.add_rebalance_listener(self._on_rebalance)
+
+    def _on_rebalance(self, event: str, partitions: List[int]) -> None:
+        # Вызывается в потоке consumer'а, пока этот воркер ждёт consume_batch и не трогает свой кэш
+        self._logger.info(f"Partitions {event}: {partitions}")
+        if event == 'assign':
+            # Пока партиции были не у нас, их заказы писали другие consumer'ы: известные кэшу версии сателлитов
+            # могли устареть. Отозванные партиции кэш не трогает — если они вернутся, придёт новый assign
+            self._dds_repository.drop_satellite_state()
+
+    async def run(self, batch_size: Optional[int] = None, timeout: float = 3.0) -> int:
+        messages = await self._consumer.consume_batch(batch_size or self._batch_size, timeout)
+        batch = []
+        for message in messages:
+            if message.value is None:
+                self._metrics.inc('processor_messages_total', result='invalid')
+                await self._dead_letters.send(message, message.error, 'decode')
+                continue
+            batch.append(message)
+
+        if batch:
+            # Дожидаемся всех частей, даже если одна упала: rewind до их завершения перечитал бы батч параллельно
+            results = await asyncio.gather(*(self._process(part) for part in self._partition(batch)),
+                                           return_exceptions=True)
+            errors = [result for result in results if isinstance(result, BaseException)]
+            if errors:
+                self._logger.error(f"Error processing batch, it will be re-read: {errors[0]}")
+                self._metrics.inc('processor_errors_total', stage='batch', type=type(errors[0]).__name__)
+                await self._consumer.rewind()
+                raise errors[0]
+
+        if messages:
+            try:
+                with self._metrics.timer('processor_stage_seconds', stage='flush'):
+                    await self._producer.flush()
+                    await self._dead_letters.flush()
+            except Exception as e:
+                self._logger.error(f"Error flushing producer: {e}")
+                self._metrics.inc('processor_errors_total', stage='flush', type=type(e).__name__)
+                await self._consumer.rewind()
+                raise
+
+        with self._metrics.timer('processor_stage_seconds', stage='commit'):
+            await self._consumer.commit()
+        return len(messages)
+
+    def _partition(self, messages: List[KafkaMessage]) -> List[List[KafkaMessage]]:
+        # Заказы, которые пишут сателлиты одного хаба (тот же заказ, пользователь, ресторан или товар), остаются
+        # в одной части: две транзакции прочитали бы одну последнюю версию и записали бы её изменение дважды.
+        # Связные группы раскладываются по частям от больших к меньшим
+        group_of = list(range(len(messages)))
+
+        def find(i: int) -> int:
+            while group_of[i] != i:
+                group_of[i] = group_of[group_of[i]]
+                i = group_of[i]
+            return i
+
+        first_seen: Dict[Tuple[str, str], int] = {}
+        for i, message in enumerate(messages):
+            for key in _satellite_hub_keys(message.value):
+                group_of[find(i)] = find(first_seen.setdefault(key, i))
+
+        groups: Dict[int, List[int]] = {}
+        for i in range(len(messages)):
+            groups.setdefault(find(i), []).append(i)
+        parts: List[List[int]] = [[] for _ in range(self._concurrency)]
+        for group in sorted(groups.values(), key=len, reverse=True):
+            min(parts, key=len).extend(group)
+        return [[messages[i] for i in sorted(part)] for part in parts if part]
+
+    async def _process(self, messages: List[KafkaMessage]) -> None:
+        try:
+            await self._retry.call_async(self._process_batch, [message.value for message in messages])
+        except Exception as e:
+            if self._retry.is_transient(e):
+                raise
+            if len(messages) == 1:
+                self._metrics.inc('processor_messages_total', result='dead_letter')
+                await self._dead_letters.send(messages[0], e, 'process')
+                return
+            self._logger.warning(f"Batch of {len(messages)} failed ({type(e).__name__}: {e}), bisecting")
+            self._metrics.inc('processor_bisections_total')
+            middle = len(messages) // 2
+            await self._process(messages[:middle])
+            await self._process(messages[middle:])
+            return
+        self._metrics.inc('processor_messages_total', len(messages), result='processed')
+
+    async def _process_batch(self, batch: List[OrderMessage]) -> None:
+        with self._metrics.timer('processor_stage_seconds', stage='load'):
+            keys = await self._dds_repository.load_orders(batch)
+        with self._metrics.timer('processor_stage_seconds', stage='produce'):
+            latest = latest_copies(batch, keys)
+            self._metrics.inc('processor_coalesced_total', len(batch) - len(latest))
+            await self._producer.produce_batch(
+                [output_record(msg, order_keys, self._output_format) for msg, order_keys in latest])
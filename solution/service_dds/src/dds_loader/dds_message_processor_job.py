@@ -1,91 +1,190 @@
 from datetime import datetime
 from logging import Logger
-from dds_loader.repository.dds_repository import DdsRepository
+from typing import List, Optional, Tuple
+
+from lib.kafka_connect import DeadLetterQueue, KafkaMessage, OutgoingMessage
+from lib.metrics import Metrics, NullMetrics
+from lib.order_format import COMPACT_FORMAT, FORMATS, JSON_FORMAT, compact_order, order_headers
+from lib.retry import RetryPolicy
+from dds_loader.order_messages import (DdsOrderMessage, DdsOrderPayload, DdsOrderProduct, DdsOrderRestaurant,
+                                      DdsOrderUser, OrderMessage)
+from dds_loader.repository.dds_repository import DdsRepository, OrderKeys
+
+
+def output_message(msg: OrderMessage, keys: OrderKeys) -> DdsOrderMessage:
+    # Модели собираются без повторной валидации: входное сообщение уже проверено при разборе
+    payload = msg.payload
+    return DdsOrderMessage.model_construct(
+        object_id=msg.object_id,
+        object_type="order",
+        payload=DdsOrderPayload.model_construct(
+            id=msg.object_id,
+            date=payload.date,
+            cost=payload.cost,
+            payment=payload.payment,
+            status=payload.status,
+            user=DdsOrderUser.model_construct(id=str(keys.user_pk), name=payload.user.name),
+            restaurant=DdsOrderRestaurant.model_construct(
+                id=str(keys.restaurant_pk), name=payload.restaurant.name),
+            products=[
+                DdsOrderProduct.model_construct(
+                    product_id=str(product_pk),
+                    product_name=product.name,
+                    category_name=product.category,
+                    price=product.price,
+                    quantity=product.quantity
+                )
+                for product, product_pk in zip(payload.products, keys.product_pks)
+            ],
+            processed_ts=datetime.utcnow()
+        )
+    )
+
+
+def output_record(msg: OrderMessage, keys: OrderKeys, output_format: str = JSON_FORMAT) -> OutgoingMessage:
+    # Ключ — пользователь: его заказы попадают в одну партицию, и CDM применяет их по порядку
+    payload = msg.payload
+    user_id = str(keys.user_pk)
+    if output_format == COMPACT_FORMAT:
+        value = compact_order(msg.object_id, user_id, payload.status, [
+            [str(product_pk), product.name, product.category, product.quantity]
+            for product, product_pk in zip(payload.products, keys.product_pks)
+        ])
+    else:
+        value = output_message(msg, keys)
+    return OutgoingMessage(
+        value, user_id.encode(), order_headers(output_format, user_id, payload.status, len(payload.products)))
+
+
+def latest_copies(batch: List[OrderMessage], keys: List[OrderKeys]) -> List[Tuple[OrderMessage, OrderKeys]]:
+    # Из нескольких копий заказа в батче дальше уходит только последняя — с актуальным статусом:
+    # CDM всё равно учитывает заказ один раз. Копии идут в порядке последнего появления заказа.
+    latest = {}
+    for msg, order_keys in zip(batch, keys):
+        object_id = str(msg.object_id)
+        latest.pop(object_id, None)
+        latest[object_id] = (msg, order_keys)
+    return list(latest.values())
+
 
 class DdsMessageProcessor:
-    def __init__(self, consumer, producer, dds_repository: DdsRepository, logger: Logger) -> None:
+    def __init__(self, consumer, producer, dds_repository: DdsRepository, logger: Logger,
+                 metrics: Optional[Metrics] = None,
+                 dead_letters: Optional[DeadLetterQueue] = None,
+                 retry: Optional[RetryPolicy] = None,
+                 bulk_lag_threshold: int = 0,
+                 output_format: str = JSON_FORMAT) -> None:
+        if output_format not in FORMATS:
+            raise ValueError(f'Unknown output format: {output_format}')
         self._consumer = consumer
         self._producer = producer
         self._dds_repository = dds_repository
         self._logger = logger
+        self._metrics = metrics or NullMetrics()
+        self._dead_letters = dead_letters or DeadLetterQueue(None, 'dds', logger, self._metrics)
+        self._retry = retry or RetryPolicy(metrics=self._metrics)
         self._batch_size = 30
+        # При отставании от порога и выше батчи грузятся через COPY; 0 — всегда обычная загрузка
+        self._bulk_lag_threshold = bulk_lag_threshold
+        self._bulk = False
+        self._output_format = output_format
+        self._consumer.add_rebalance_listener(self._on_rebalance)
+
+    def _on_rebalance(self, event: str, partitions: List[int]) -> None:
+        self._logger.info(f"Partitions {event}: {partitions}")
+        if event == 'assign':
+            # Пока партиции были не у нас, их заказы писали другие consumer'ы: известные кэшу версии сателлитов
+            # могли устареть. Отозванные партиции кэш не трогает — если они вернутся, придёт новый assign
+            self._dds_repository.drop_satellite_state()
+
+    def lag(self) -> int:
+        # Отставание опрашивает StreamLoop, по нему же переключается режим загрузки
+        lag = sum(self._consumer.lag().values())
+        self._switch_load_mode(lag)
+        return lag
 
-    def run(self) -> None:
-        for _ in range(self._batch_size):
-            msg = self._consumer.consume()
-            if not msg:
-                break
+    def _switch_load_mode(self, lag: int) -> None:
+        if self._bulk_lag_threshold <= 0:
+            return
+        # Назад к обычной загрузке — только когда отставание упало вдвое ниже порога, чтобы режим не дребезжал
+        bulk = lag > self._bulk_lag_threshold // 2 if self._bulk else lag >= self._bulk_lag_threshold
+        if bulk != self._bulk:
+            self._logger.info(f"Consumer lag is {lag}, switching to {'bulk' if bulk else 'regular'} load")
+            self._bulk = bulk
+        self._metrics.set('processor_bulk_mode', int(self._bulk))
+
+    def run(self, batch_size: Optional[int] = None, timeout: float = 3.0) -> int:
+        messages = self._consumer.consume_batch(batch_size or self._batch_size, timeout)
+        batch = []
+        for message in messages:
+            if message.value is None:
+                self._metrics.inc('processor_messages_total', result='invalid')
+                self._dead_letters.send(message, message.error, 'decode')
+                continue
+            batch.append(message)
+
+        if batch:
             try:
-                self._process_single_message(msg)
+                self._process(batch)
             except Exception as e:
-                self._logger.error(f"Error processing message: {e}")
-                continue
+                # Временная ошибка пережила все повторы — offset не коммитим, батч будет прочитан заново
+                self._logger.error(f"Error processing batch, it will be re-read: {e}")
+                self._metrics.inc('processor_errors_total', stage='batch', type=type(e).__name__)
+                self._consumer.rewind()
+                raise
 
-    def _process_single_message(self, msg: dict) -> None:
-        payload = msg["payload"]
-        
-        order_pk = self._dds_repository.hub_order_insert(
-            str(msg["object_id"]),
-            datetime.strptime(payload["date"], '%Y-%m-%d %H:%M:%S')
-        )
-        user_pk = self._dds_repository.hub_user_insert(payload["user"]["id"])
-        restaurant_pk = self._dds_repository.hub_restaurant_insert(payload["restaurant"]["id"])
-        
-        self._dds_repository.sat_order_cost_insert(order_pk, payload["cost"], payload["payment"])
-        self._dds_repository.sat_order_status_insert(order_pk, payload["status"])
-        self._dds_repository.sat_user_names_insert(user_pk, payload["user"]["name"], payload["user"]["login"])
-        self._dds_repository.sat_restaurant_names_insert(restaurant_pk, payload["restaurant"]["name"])
-        self._dds_repository.link_order_user_insert(order_pk, user_pk)
-        
-        products_data = self._process_products(msg, order_pk, restaurant_pk)
-        self._send_to_output_topic(msg, products_data, user_pk, restaurant_pk)
-
-    def _process_products(self, msg: dict, order_pk: str, restaurant_pk: str) -> list:
-        products_data = []
-        for product in msg["payload"]["products"]:
-            product_pk = self._dds_repository.hub_product_insert(product["id"])
-            category_pk = self._dds_repository.hub_category_insert(product["category"])
-            
-            self._dds_repository.sat_product_names_insert(product_pk, product["name"])
-            self._dds_repository.link_order_product_insert(order_pk, product_pk)
-            self._dds_repository.link_product_category_insert(product_pk, category_pk)
-            self._dds_repository.link_product_restaurant_insert(product_pk, restaurant_pk)
-            
-            products_data.append({
-                "product_id": product_pk,
-                "product_name": product["name"],
-                "category_name": product["category"],
-                "price": product["price"],
-                "quantity": product["quantity"]
-            })
-        return products_data
-
-    def _send_to_output_topic(self, msg: dict, products_data: list, user_pk: str, restaurant_pk: str) -> None:
-        output_message = {
-            "object_id": msg["object_id"],
-            "object_type": "order",
-            "payload": {
-                "id": msg["object_id"],
-                "date": msg["payload"]["date"],
-                "cost": msg["payload"]["cost"],
-                "payment": msg["payload"]["payment"],
-                "status": msg["payload"]["status"],
-                "user": {
-                    "id": str(user_pk),
-                    "name": msg["payload"]["user"]["name"]
-                },
-                "restaurant": {
-                    "id": str(restaurant_pk),
-                    "name": msg["payload"]["restaurant"]["name"]
-                },
-                "products": [{
-                    "product_id": str(product["product_id"]),
-                    "product_name": product["product_name"],
-                    "category_name": product["category_name"],
-                    "price": product["price"],
-                    "quantity": product["quantity"]
-                } for product in products_data],
-                "processed_ts": datetime.utcnow().isoformat()
-            }
-        }
-        self._producer.produce(output_message)
+        if messages:
+            # Один flush на батч: дожидаемся подтверждений брокера для всех отправленных сообщений
+            try:
+                with self._metrics.timer('processor_stage_seconds', stage='flush'):
+                    self._producer.flush()
+                    self._dead_letters.flush()
+            except Exception as e:
+                self._logger.error(f"Error flushing producer: {e}")
+                self._metrics.inc('processor_errors_total', stage='flush', type=type(e).__name__)
+                # Без подтверждения доставки offset не коммитим — батч будет прочитан заново
+                self._consumer.rewind()
+                raise
+
+        # Записи в DDS идемпотентны, поэтому повтор батча после сбоя до commit безопасен
+        with self._metrics.timer('processor_stage_seconds', stage='commit'):
+            self._consumer.commit()
+        return len(messages)
+
+    def _process(self, messages: List[KafkaMessage]) -> None:
+        try:
+            self._retry.call(self._process_batch, [message.value for message in messages])
+        except Exception as e:
+            if self._retry.is_transient(e):
+                raise
+            if len(messages) == 1:
+                self._metrics.inc('processor_messages_total', result='dead_letter')
+                self._dead_letters.send(messages[0], e, 'process')
+                return
+            # Делим батч пополам: битое сообщение находится за log2(n) шагов, остальные пишутся пачками
+            self._logger.warning(f"Batch of {len(messages)} failed ({type(e).__name__}: {e}), bisecting")
+            self._metrics.inc('processor_bisections_total')
+            middle = len(messages) // 2
+            self._process(messages[:middle])
+            self._process(messages[middle:])
+            return
+        self._metrics.inc('processor_messages_total', len(messages), result='processed')
+
+    def _process_batch(self, batch: List[OrderMessage]) -> None:
+        # Весь батч пишется в одной транзакции: частично загруженный заказ не останется в DDS
+        with self._metrics.timer('processor_stage_seconds', stage='load', mode='bulk' if self._bulk else 'regular'):
+            if self._bulk:
+                with self._dds_repository.unit_of_work(pipeline=False):
+                    keys = self._dds_repository.bulk_load_orders(batch)
+            else:
+                with self._dds_repository.unit_of_work():
+                    keys = self._dds_repository.load_orders(batch)
+        with self._metrics.timer('processor_stage_seconds', stage='produce'):
+            latest = latest_copies(batch, keys)
+            self._metrics.inc('processor_coalesced_total', len(batch) - len(latest))
+            for msg, order_keys in latest:
+                self._send_to_output_topic(msg, order_keys)
+
+    def _send_to_output_topic(self, msg: OrderMessage, keys: OrderKeys) -> None:
+        record = output_record(msg, keys, self._output_format)
+        self._producer.produce(record.value, key=record.key, headers=record.headers)
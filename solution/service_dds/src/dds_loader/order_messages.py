@@ -0,0 +1,94 @@
+from datetime import datetime
+from typing import List, Union
+
+from pydantic import BaseModel, ConfigDict, field_serializer, field_validator
+
+DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+# int не превращается во float: от строкового вида значений зависит hashdiff сателлитов
+Number = Union[int, float]
+
+
+class _Message(BaseModel):
+    model_config = ConfigDict(coerce_numbers_to_str=True)
+
+
+class OrderUser(_Message):
+    id: str
+    name: str
+    login: str
+
+
+class OrderRestaurant(_Message):
+    id: str
+    name: str
+
+
+class OrderProduct(_Message):
+    id: str
+    name: str
+    category: str
+    price: Number
+    quantity: int
+
+
+class OrderPayload(_Message):
+    date: datetime
+    cost: Number
+    payment: Number
+    status: str
+    user: OrderUser
+    restaurant: OrderRestaurant
+    products: List[OrderProduct]
+
+    @field_validator('date', mode='before')
+    @classmethod
+    def _parse_date(cls, value):
+        return datetime.strptime(value, DATE_FORMAT) if isinstance(value, str) else value
+
+
+class OrderMessage(_Message):
+    object_id: Union[int, str]
+    object_type: str = 'order'
+    payload: OrderPayload
+
+
+class DdsOrderUser(_Message):
+    id: str
+    name: str
+
+
+class DdsOrderRestaurant(_Message):
+    id: str
+    name: str
+
+
+class DdsOrderProduct(_Message):
+    product_id: str
+    product_name: str
+    category_name: str
+    price: Number
+    quantity: int
+
+
+class DdsOrderPayload(_Message):
+    id: Union[int, str]
+    date: datetime
+    cost: Number
+    payment: Number
+    status: str
+    user: DdsOrderUser
+    restaurant: DdsOrderRestaurant
+    products: List[DdsOrderProduct]
+    processed_ts: datetime
+
+    @field_serializer('date')
+    def _format_date(self, value: datetime) -> str:
+        # Формат даты в выходном топике совпадает с входным
+        return value.strftime(DATE_FORMAT)
+
+
+class DdsOrderMessage(_Message):
+    object_id: Union[int, str]
+    object_type: str = 'order'
+    payload: DdsOrderPayload
@@ -1 +1,7 @@
-from .dds_repository import DdsRepository  # noqa
+from .dds_cache import DdsCache  # noqa
+from .dds_keys import DdsKeys  # noqa
+from .dds_repository import DdsRepository, OrderKeys  # noqa
+from .async_dds_repository import AsyncDdsRepository  # noqa
+from .dds_unit_of_work import AsyncDdsUnitOfWork, DdsUnitOfWork  # noqa
+from .dds_hashdiff_index import DdsHashdiffIndex  # noqa
+from .dds_partitions import DdsPartitions  # noqa
@@ -0,0 +1,38 @@
+from typing import Dict, List, Optional
+
+from lib.metrics import Metrics, NullMetrics
+from lib.pg import AsyncPgConnect, run_plan_async
+from dds_loader.order_messages import OrderMessage
+from dds_loader.repository.dds_cache import DdsCache
+from dds_loader.repository.dds_keys import DdsKeys
+from dds_loader.repository.dds_load_plan import DdsLoadPlan, OrderKeys
+from dds_loader.repository.dds_unit_of_work import AsyncDdsUnitOfWork
+
+
+class AsyncDdsRepository:
+    # Пакетная загрузка DdsRepository поверх asyncio: тот же план запросов, другое исполнение.
+    # Каждый вызов load_orders — своя транзакция, параллельные вызовы занимают разные соединения пула.
+    def __init__(self,
+                 db: AsyncPgConnect,
+                 keys: Optional[DdsKeys] = None,
+                 cache: Optional[DdsCache] = None,
+                 pipeline: bool = True,
+                 metrics: Optional[Metrics] = None
+                 ) -> None:
+        self._db = db
+        self._keys = keys or DdsKeys()
+        self._cache = cache or DdsCache(max_size=0)
+        self._pipeline = pipeline
+        self._metrics = metrics or NullMetrics()
+        self._plan = DdsLoadPlan(self._keys, self._metrics)
+
+    def cache_stats(self) -> Dict[str, Dict[str, float]]:
+        return self._cache.stats()
+
+    def drop_satellite_state(self) -> None:
+        # Хабы и линки не меняются после вставки, а последние версии сателлитов мог переписать другой consumer
+        self._cache.clear('sat')
+
+    async def load_orders(self, orders: List[OrderMessage]) -> List[OrderKeys]:
+        async with AsyncDdsUnitOfWork(self._db, self._cache, self._pipeline) as uow:
+            return await run_plan_async(self._plan.load_orders(uow.tx, orders), uow.execute)
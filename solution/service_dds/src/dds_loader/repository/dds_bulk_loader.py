@@ -0,0 +1,226 @@
+import uuid
+from datetime import datetime
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
+
+from psycopg import Connection
+
+from lib.keys import hashdiffs
+from lib.metrics import Metrics, NullMetrics
+from lib.pg import Statement, execute_round
+from dds_loader.order_messages import OrderMessage
+from dds_loader.repository.dds_cache import DdsCacheTransaction
+from dds_loader.repository.dds_keys import DdsKeys
+from dds_loader.repository.dds_load_plan import DdsLoadPlan, OrderKeys, _as_text, _link_conflict
+from dds_loader.repository.dds_tables import HUBS, LINKS, SATELLITES, HubTable, LinkTable, SatelliteTable
+from dds_loader.repository.order_batch import OrderBatch
+
+Columns = Tuple[Tuple[str, str], ...]
+
+
+def _stage(table: str) -> str:
+    # dds.h_order -> pg_temp.stage_h_order
+    return f"pg_temp.stage_{table.split('.')[-1]}"
+
+
+def _hub_columns(hub: HubTable) -> Columns:
+    return (('pk', 'uuid'), ('bk', 'varchar')) + hub.extra
+
+
+def _sat_columns(sat: SatelliteTable) -> Columns:
+    # Значения сателлита — текстом, как и в обычной загрузке: типы приводятся при вставке
+    return (('bk', 'varchar'),) + tuple((column, 'text') for column, _ in sat.columns) \
+        + (('load_dt', 'timestamp'), ('hashdiff', 'varchar'))
+
+
+def _link_columns(link: LinkTable) -> Columns:
+    return (('pk', 'uuid'), ('left_bk', 'varchar'), ('right_bk', 'varchar')) + link.extra
+
+
+# Временные таблицы не пишутся в WAL, как и UNLOGGED, но видны только своей сессии:
+# воркеры на разных соединениях пула не мешают друг другу. Строки удаляются на commit.
+STAGES: Dict[str, Columns] = {
+    **{hub.table: _hub_columns(hub) for hub in HUBS.values()},
+    **{sat.table: _sat_columns(sat) for sat in SATELLITES.values()},
+    **{link.table: _link_columns(link) for link in LINKS.values()},
+}
+
+_STAGE_COLUMNS_SQL = """
+    SELECT c.relname, array_agg(a.attname::text ORDER BY a.attnum)
+    FROM pg_class c
+    JOIN pg_attribute a ON a.attrelid = c.oid AND a.attnum > 0 AND NOT a.attisdropped
+    WHERE c.relnamespace = pg_my_temp_schema() AND c.relname = ANY(%s)
+    GROUP BY c.relname
+"""
+
+
+@lru_cache(maxsize=None)
+def _hub_merge_sql(hub: HubTable, blind: bool) -> str:
+    columns = ', '.join([hub.pk, hub.bk] + [column for column, _ in hub.extra])
+    values = ', '.join(['s.pk', 's.bk'] + [f's.{column}' for column, _ in hub.extra])
+    exists = f"WHERE NOT EXISTS (SELECT 1 FROM {hub.table} h WHERE h.{hub.bk} = s.bk)"
+    return f"""
+        INSERT INTO {hub.table} ({columns}, load_dt, load_src)
+        SELECT {values}, %(load_dt)s, %(load_src)s FROM {_stage(hub.table)} s
+        {'' if blind else exists}
+        ON CONFLICT DO NOTHING
+    """
+
+
+@lru_cache(maxsize=None)
+def _sat_merge_sql(sat: SatelliteTable) -> str:
+    # Новая версия пишется, если hashdiff отличается от предыдущей строки батча,
+    # а для первой строки ключа — от последней версии в сателлите
+    hub = HUBS[sat.hub]
+    columns = [column for column, _ in sat.columns]
+    casts = ', '.join(f'v.{column}::{type_}' for column, type_ in sat.columns)
+    return f"""
+        WITH v AS (
+            SELECT h.{hub.pk} AS pk, s.*,
+                   lag(s.hashdiff) OVER (PARTITION BY h.{hub.pk} ORDER BY s.load_dt) AS previous
+            FROM {_stage(sat.table)} s
+            JOIN {hub.table} h ON h.{hub.bk} = s.bk
+        ), latest AS (
+            SELECT DISTINCT ON (t.{hub.pk}) t.{hub.pk} AS pk, t.{sat.hashdiff} AS hashdiff
+            FROM {sat.table} t
+            WHERE t.{hub.pk} IN (SELECT pk FROM v)
+            ORDER BY t.{hub.pk}, t.load_dt DESC
+        )
+        INSERT INTO {sat.table} ({hub.pk}, {', '.join(columns)}, load_dt, load_src, {sat.hashdiff})
+        SELECT v.pk, {casts}, v.load_dt, %(load_src)s, v.hashdiff
+        FROM v
+        LEFT JOIN latest ON latest.pk = v.pk
+        WHERE v.hashdiff IS DISTINCT FROM coalesce(v.previous, latest.hashdiff)
+    """
+
+
+@lru_cache(maxsize=None)
+def _link_merge_sql(link: LinkTable, blind: bool) -> str:
+    left, right = HUBS[link.left], HUBS[link.right]
+    columns = ''.join(f', {column}' for column, _ in link.extra)
+    values = ''.join(f', s.{column}' for column, _ in link.extra)
+    return f"""
+        INSERT INTO {link.table} AS t ({link.pk}, {left.pk}, {right.pk}{columns}, load_dt, load_src)
+        SELECT s.pk, l.{left.pk}, r.{right.pk}{values}, %(load_dt)s, %(load_src)s
+        FROM {_stage(link.table)} s
+        JOIN {left.table} l ON l.{left.bk} = s.left_bk
+        JOIN {right.table} r ON r.{right.bk} = s.right_bk
+        {_link_conflict(link, blind)}
+    """
+
+
+@lru_cache(maxsize=None)
+def _hub_keys_sql(names: Tuple[str, ...]) -> str:
+    return ' UNION ALL '.join(
+        f"SELECT '{name}', s.bk, h.{HUBS[name].pk} FROM {_stage(HUBS[name].table)} s "
+        f"JOIN {HUBS[name].table} h ON h.{HUBS[name].bk} = s.bk"
+        for name in names
+    )
+
+
+class DdsBulkLoader:
+    # Загрузка больших батчей при отставании: строки потоком идут через COPY (binary) во временные таблицы,
+    # а хабы, сателлиты и линки заполняются несколькими INSERT ... SELECT за одну синхронизацию pipeline
+    def __init__(self, keys: DdsKeys, plan: DdsLoadPlan, metrics: Optional[Metrics] = None) -> None:
+        self._keys = keys
+        self._plan = plan
+        self._metrics = metrics or NullMetrics()
+
+    def load_orders(self, conn: Connection, tx: DdsCacheTransaction, orders: List[OrderMessage]) -> List[OrderKeys]:
+        if not orders:
+            return []
+        batch = OrderBatch(orders)
+        self._metrics.inc('dds_satellite_rows_coalesced_total', batch.coalesced)
+
+        with self._metrics.timer('dds_repository_seconds', call='bulk_load.stage'):
+            self._ensure_stages(conn)
+            pks = {name: {bk: self._keys.hub_key(bk) for bk in keys} for name, keys in batch.hubs.items()}
+            for name, keys in batch.hubs.items():
+                self._copy(conn, HUBS[name].table,
+                           [(uuid.UUID(pks[name][bk]), bk, *extra) for bk, extra in keys.items()])
+
+            hashes = {}
+            for name, sat_rows in batch.satellites.items():
+                hashes[name] = hashdiffs(values for _, values in sat_rows)
+                load_dts = self._plan.load_dts(len(sat_rows)) if sat_rows else []
+                self._copy(conn, SATELLITES[name].table, [
+                    (bk, *(_as_text(value) for value in values), load_dt, hashdiff)
+                    for (bk, values), load_dt, hashdiff in zip(sat_rows, load_dts, hashes[name])
+                ])
+
+            # В режиме hash ключи хабов уже известны, и ключ линка считается так же, как в обычной загрузке
+            for name, pairs in batch.links.items():
+                link = LINKS[name]
+                self._copy(conn, link.table, [
+                    (uuid.UUID(self._keys.link_key(pks[link.left][left], pks[link.right][right])), left, right,
+                     *extra)
+                    for (left, right), extra in pairs.items()
+                ])
+
+        with self._metrics.timer('dds_repository_seconds', call='bulk_load.merge'):
+            blind = self._keys.deterministic
+            params = {'load_dt': datetime.utcnow(), 'load_src': self._plan.LOAD_SRC}
+            statements = [Statement(_hub_merge_sql(HUBS[name], blind), params)
+                          for name, keys in batch.hubs.items() if keys]
+            statements += [Statement(_sat_merge_sql(SATELLITES[name]), params)
+                           for name, sat_rows in batch.satellites.items() if sat_rows]
+            statements += [Statement(_link_merge_sql(LINKS[name], blind), params)
+                           for name, pairs in batch.links.items() if pairs]
+            if not blind:
+                # Ключи хабов, которые уже были в БД, читаем в конце того же раунда
+                names = tuple(name for name, keys in batch.hubs.items() if keys)
+                statements.append(Statement(_hub_keys_sql(names), fetch=True))
+
+            with conn.pipeline():
+                results = execute_round(conn.cursor, statements)
+            if not blind:
+                for name, bk, pk in results[-1]:
+                    pks[name][bk] = str(pk)
+
+        # Кэш после загрузки совпадает с тем, что оставила бы обычная загрузка
+        for name, keys in pks.items():
+            for bk, pk in keys.items():
+                tx.put_hub_key(HUBS[name].table, bk, pk)
+        for name, sat_rows in batch.satellites.items():
+            sat = SATELLITES[name]
+            for (bk, _), hashdiff in zip(sat_rows, hashes[name]):
+                tx.put_hashdiff(sat.table, pks[sat.hub][bk], hashdiff)
+        for name, pairs in batch.links.items():
+            link = LINKS[name]
+            for left, right in pairs:
+                tx.put_link(link.table, pks[link.left][left], pks[link.right][right])
+
+        return [
+            OrderKeys(
+                pks['order'][order.order_id],
+                pks['user'][order.user_id],
+                pks['restaurant'][order.restaurant_id],
+                [pks['product'][product_id] for product_id in order.product_ids]
+            )
+            for order in batch.orders
+        ]
+
+    def _ensure_stages(self, conn: Connection) -> None:
+        # Временные таблицы живут, пока живёт соединение пула, — создаём их один раз на соединение.
+        # Таблицы, созданные кодом с другим набором колонок (например, до миграции link_attributes), пересоздаём
+        with conn.cursor() as cur:
+            cur.execute(_STAGE_COLUMNS_SQL, ([_stage(table).split('.')[-1] for table in STAGES],))
+            existing = dict(cur.fetchall())
+            for table, columns in STAGES.items():
+                name = _stage(table).split('.')[-1]
+                if existing.get(name) == [column for column, _ in columns]:
+                    continue
+                definition = ', '.join(f'{column} {type_}' for column, type_ in columns)
+                cur.execute(f"DROP TABLE IF EXISTS {_stage(table)}")
+                cur.execute(f"CREATE TEMP TABLE {name} ({definition}) ON COMMIT DELETE ROWS")
+
+    def _copy(self, conn: Connection, table: str, rows: List[tuple]) -> None:
+        if not rows:
+            return
+        columns = STAGES[table]
+        with conn.cursor() as cur:
+            with cur.copy(f"COPY {_stage(table)} ({', '.join(c for c, _ in columns)}) FROM STDIN (FORMAT BINARY)") \
+                    as copy:
+                copy.set_types([type_ for _, type_ in columns])
+                for row in rows:
+                    copy.write_row(row)
@@ -0,0 +1,151 @@
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Dict, Generator, Hashable, Optional, Tuple
+
+from dds_loader.repository.dds_hashdiff_index import DdsHashdiffIndex
+from dds_loader.repository.dds_tables import hub_satellites
+
+
+class LruCache:
+    def __init__(self, max_size: int) -> None:
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._data: OrderedDict = OrderedDict()
+
+    def get(self, key: Hashable):
+        value = self._data.get(key)
+        if value is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._data.move_to_end(key)
+        return value
+
+    def put(self, key: Hashable, value) -> None:
+        if self.max_size <= 0:
+            return
+        self._data[key] = value
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_size:
+            self._data.popitem(last=False)
+
+    def pop(self, key: Hashable) -> None:
+        self._data.pop(key, None)
+
+    def clear(self) -> None:
+        self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+class DdsCacheTransaction:
+    def __init__(self, cache: 'DdsCache') -> None:
+        self._cache = cache
+        # Изменения видны только внутри транзакции, в общий кэш попадают после commit
+        self.staged: Dict[Tuple[str, str], Dict[Hashable, object]] = {}
+
+    def hub_key(self, table: str, business_key: str) -> Optional[str]:
+        return self._get('hub', table, business_key)
+
+    def put_hub_key(self, table: str, business_key: str, hub_pk: str) -> None:
+        self._put('hub', table, business_key, hub_pk)
+
+    def hashdiff(self, table: str, hub_pk: str) -> Optional[str]:
+        return self.hashdiff_state(table, hub_pk)[1]
+
+    def hashdiff_state(self, table: str, hub_pk: str) -> Tuple[bool, Optional[str]]:
+        # (известно ли состояние ключа без запроса в БД, текущий hashdiff или None, если строк нет)
+        staged = self.staged.get(('sat', table))
+        if staged and hub_pk in staged:
+            return True, staged[hub_pk]
+        if table not in self._cache.owned_satellites:
+            return False, None
+        index = self._cache.hashdiff_index
+        if index is not None and index.covers(table):
+            return index.lookup(table, hub_pk)
+        hashdiff = self._cache.lru('sat', table).get(hub_pk)
+        return hashdiff is not None, hashdiff
+
+    def put_hashdiff(self, table: str, hub_pk: str, hashdiff: str) -> None:
+        self._put('sat', table, hub_pk, hashdiff)
+
+    def has_link(self, table: str, left_pk: str, right_pk: str) -> bool:
+        return self._get('link', table, (left_pk, right_pk)) is not None
+
+    def put_link(self, table: str, left_pk: str, right_pk: str) -> None:
+        self._put('link', table, (left_pk, right_pk), True)
+
+    def _get(self, kind: str, table: str, key: Hashable):
+        staged = self.staged.get((kind, table))
+        if staged and key in staged:
+            return staged[key]
+        return self._cache.lru(kind, table).get(key)
+
+    def _put(self, kind: str, table: str, key: Hashable, value) -> None:
+        self.staged.setdefault((kind, table), {})[key] = value
+
+
+class DdsCache:
+    def __init__(self, max_size: int = 10000, hashdiff_index: Optional[DdsHashdiffIndex] = None,
+                 partition_hub: Optional[str] = 'order') -> None:
+        self.max_size = max_size
+        # Для загруженных в индекс сателлитов hashdiff берётся из него, а не из LRU
+        self.hashdiff_index = hashdiff_index
+        # partition_hub — хаб, чей бизнес-ключ решает партицию входного топика: его сателлиты пишет только
+        # владелец партиции, и кэш знает их последнюю версию. Сателлиты остальных хабов пишут все воркеры,
+        # поэтому их последние версии всегда читаются из БД
+        self.owned_satellites = hub_satellites(partition_hub)
+        self._lru: Dict[Tuple[str, str], LruCache] = {}
+
+    def lru(self, kind: str, table: str) -> LruCache:
+        key = (kind, table)
+        if key not in self._lru:
+            self._lru[key] = LruCache(self.max_size)
+        return self._lru[key]
+
+    @contextmanager
+    def transaction(self) -> Generator[DdsCacheTransaction, None, None]:
+        # Оборачивает PgConnect.connection(): нормальный выход означает, что commit в БД уже прошёл
+        tx = DdsCacheTransaction(self)
+        try:
+            yield tx
+        except Exception:
+            self._invalidate(tx)
+            raise
+        for (kind, table), values in tx.staged.items():
+            if kind == 'sat' and table not in self.owned_satellites:
+                continue
+            # Индекс запоминает значения и во время загрузки, но читать их из него можно только после неё
+            if kind == 'sat' and self.hashdiff_index is not None and self.hashdiff_index.publish(table, values):
+                continue
+            lru = self.lru(kind, table)
+            for key, value in values.items():
+                lru.put(key, value)
+
+    def _invalidate(self, tx: DdsCacheTransaction) -> None:
+        for (kind, table), values in tx.staged.items():
+            # Неизвестно, дошёл ли commit до БД — такие ключи перечитываем из БД
+            if kind == 'sat' and self.hashdiff_index is not None and self.hashdiff_index.forget(table, values):
+                continue
+            lru = self.lru(kind, table)
+            for key in values:
+                lru.pop(key)
+
+    def clear(self, kind: Optional[str] = None) -> None:
+        for (lru_kind, _), lru in self._lru.items():
+            if kind is None or lru_kind == kind:
+                lru.clear()
+        if kind in (None, 'sat') and self.hashdiff_index is not None:
+            # Индекс общий для воркеров процесса и не знает, какие ключи из каких партиций, — загружаем заново
+            self.hashdiff_index.reload()
+
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        stats = {
+            f'{kind}:{table}': {'hits': lru.hits, 'misses': lru.misses, 'size': len(lru)}
+            for (kind, table), lru in self._lru.items()
+        }
+        if self.hashdiff_index is not None:
+            stats.update((f'index:{table}', value) for table, value in self.hashdiff_index.stats().items())
+        return stats
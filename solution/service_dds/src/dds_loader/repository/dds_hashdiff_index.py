@@ -0,0 +1,173 @@
+import sys
+import threading
+import time
+import uuid
+from logging import Logger
+from typing import Collection, Dict, Iterable, Optional, Set, Tuple
+
+from lib.pg import PgConnect
+from dds_loader.repository.dds_tables import HUBS, SATELLITES, SatelliteTable
+
+
+class DdsHashdiffIndex:
+    # Текущий hashdiff каждого ключа хаба по сателлитам кэшируемых таблиц, загруженный целиком из БД.
+    # Ключ и значение хранятся как 16-байтовые digest'ы, а не строки: так индекс занимает в разы меньше памяти.
+    # Для загруженной таблицы индекс авторитетен: отсутствие ключа означает, что строк в сателлите нет.
+    # Поэтому индекс перезагружается при каждом назначении партиций: до назначения их заказы писали другие
+    # consumer'ы. Пока идёт загрузка, таблица не покрывается индексом и hashdiff читаются из БД.
+    def __init__(self, db: PgConnect, logger: Logger, tables: Optional[Collection[str]] = None) -> None:
+        self._db = db
+        self._logger = logger
+        # tables — сателлиты, hashdiff которых кэшируется (см. DdsCache.owned_satellites); по умолчанию все
+        self._tables = [sat for sat in SATELLITES.values() if tables is None or sat.table in tables]
+        self._lock = threading.Lock()
+        self._hashes: Dict[str, Dict[bytes, bytes]] = {}
+        # Ключи, исход записи которых неизвестен (ошибка при commit) — по ним идём в БД
+        self._unknown: Dict[str, Set[bytes]] = {}
+        # Записи, опубликованные во время загрузки таблицы: снимок БД мог их не увидеть
+        self._loading: Dict[str, Tuple[Dict[bytes, bytes], Set[bytes]]] = {}
+        self._generation = 0
+        self._loader: Optional[threading.Thread] = None
+        self.warmup_seconds: Dict[str, float] = {}
+
+    def reload(self) -> None:
+        # Сбрасывает индекс и загружает его заново в фоне. Повторный вызов во время загрузки начинает её сначала:
+        # снимок, взятый до нового назначения партиций, мог не увидеть записи их прошлых владельцев
+        with self._lock:
+            self._generation += 1
+            self._hashes = {}
+            self._unknown = {}
+            self._loading = {}
+            if self._loader is None:
+                self._loader = threading.Thread(target=self._reload_loop, name='hashdiff-index', daemon=True)
+                self._loader.start()
+
+    def wait(self, timeout: Optional[float] = None) -> None:
+        loader = self._loader
+        if loader is not None:
+            loader.join(timeout)
+
+    def _reload_loop(self) -> None:
+        while True:
+            with self._lock:
+                generation = self._generation
+            try:
+                loaded = all(self._warm_up(sat, generation) for sat in self._tables)
+            except Exception as e:
+                # Без индекса загрузка остаётся корректной: hashdiff читаются из БД и кэшируются в LRU
+                self._logger.error(f"Hashdiff index reload failed: {e}")
+                loaded = True
+            with self._lock:
+                if generation == self._generation:
+                    self._loading = {}
+                if loaded and generation == self._generation:
+                    self._loader = None
+                    return
+
+    def _warm_up(self, sat: SatelliteTable, generation: int) -> bool:
+        with self._lock:
+            if generation != self._generation:
+                return False
+            self._loading[sat.table] = ({}, set())
+        started = time.monotonic()
+        hashes = self._load(sat)
+        with self._lock:
+            if generation != self._generation:
+                return False
+            published, unknown = self._loading.pop(sat.table)
+            hashes.update(published)
+            self._hashes[sat.table] = hashes
+            self._unknown[sat.table] = unknown
+        self.warmup_seconds[sat.table] = time.monotonic() - started
+        self._logger.info(
+            f"Hashdiff index for {sat.table}: {len(hashes)} keys, "
+            f"~{self._size_of(hashes) // 1024} KiB, loaded in {self.warmup_seconds[sat.table]:.2f}s"
+        )
+        return True
+
+    def _load(self, sat: SatelliteTable) -> Dict[bytes, bytes]:
+        pk = HUBS[sat.hub].pk
+        hashes = {}
+        with self._db.connection() as conn:
+            # Серверный курсор: история сателлита не материализуется в памяти клиента целиком
+            with conn.cursor(name=f'warm_up_{sat.table.replace(".", "_")}') as cur:
+                cur.itersize = 50000
+                cur.execute(f"""
+                    SELECT DISTINCT ON ({pk}) {pk}, {sat.hashdiff}
+                    FROM {sat.table}
+                    ORDER BY {pk}, load_dt DESC
+                """)
+                for hub_pk, hashdiff in cur:
+                    hashes[_key(hub_pk)] = _digest(hashdiff)
+        return hashes
+
+    def covers(self, table: str) -> bool:
+        return table in self._hashes
+
+    def lookup(self, table: str, hub_pk: str) -> Tuple[bool, Optional[str]]:
+        # (известно ли состояние ключа, текущий hashdiff или None, если строк нет)
+        key = _key(hub_pk)
+        with self._lock:
+            hashes = self._hashes.get(table)
+            if hashes is None or key in self._unknown[table]:
+                return False, None
+            hashdiff = hashes.get(key)
+        return True, None if hashdiff is None else hashdiff.hex()
+
+    def publish(self, table: str, values: Dict[str, str]) -> bool:
+        # True, если таблица покрыта индексом; во время загрузки значения запоминаются поверх снимка
+        with self._lock:
+            hashes = self._hashes.get(table)
+            if hashes is not None:
+                unknown = self._unknown[table]
+            elif table in self._loading:
+                hashes, unknown = self._loading[table]
+            else:
+                return False
+            for hub_pk, hashdiff in values.items():
+                key = _key(hub_pk)
+                hashes[key] = _digest(hashdiff)
+                unknown.discard(key)
+            return table in self._hashes
+
+    def forget(self, table: str, hub_pks: Iterable[str]) -> bool:
+        with self._lock:
+            if table in self._hashes:
+                self._unknown[table].update(_key(hub_pk) for hub_pk in hub_pks)
+                return True
+            if table in self._loading:
+                published, unknown = self._loading[table]
+                for hub_pk in hub_pks:
+                    published.pop(_key(hub_pk), None)
+                    unknown.add(_key(hub_pk))
+            return False
+
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        with self._lock:
+            loaded = list(self._hashes.items())
+        return {
+            table: {
+                'keys': len(hashes),
+                'bytes': self._size_of(hashes),
+                'warmup_seconds': round(self.warmup_seconds.get(table, 0.0), 3),
+            }
+            for table, hashes in loaded
+        }
+
+    @staticmethod
+    def _size_of(hashes: Dict[bytes, bytes]) -> int:
+        # Ключи и значения одного размера, поэтому достаточно оценить одну пару
+        entry = sys.getsizeof(bytes(16)) * 2
+        return sys.getsizeof(hashes) + entry * len(hashes)
+
+
+def _key(hub_pk) -> bytes:
+    return hub_pk.bytes if isinstance(hub_pk, uuid.UUID) else uuid.UUID(str(hub_pk)).bytes
+
+
+def _digest(hashdiff) -> bytes:
+    try:
+        return bytes.fromhex(str(hashdiff))
+    except ValueError:
+        # Нестандартный hashdiff никогда не совпадёт с md5 — следующая версия будет записана
+        return b''
@@ -0,0 +1,90 @@
+import logging
+from logging import Logger
+
+from lib.pg import PgConnect
+from dds_loader.repository.dds_tables import HUBS, LINKS
+
+# Внешние ключи на хабы переводим в ON UPDATE CASCADE, чтобы смена h_*_pk дошла до линков и сателлитов
+_CASCADE_FOREIGN_KEYS_SQL = """
+    DO $$
+    DECLARE
+        fk record;
+    BEGIN
+        FOR fk IN
+            SELECT c.conname,
+                   c.conrelid::regclass AS tbl,
+                   regexp_replace(pg_get_constraintdef(c.oid),
+                                  ' ON UPDATE (RESTRICT|CASCADE|SET NULL|SET DEFAULT|NO ACTION)', '') AS def
+            FROM pg_constraint c
+            WHERE c.contype = 'f'
+              AND c.confupdtype <> 'c'
+              AND c.confrelid = ANY(ARRAY[{hubs}]::regclass[])
+        LOOP
+            EXECUTE format('ALTER TABLE %s DROP CONSTRAINT %I, ADD CONSTRAINT %I %s ON UPDATE CASCADE',
+                           fk.tbl, fk.conname, fk.conname, fk.def);
+        END LOOP;
+    END $$;
+""".format(hubs=', '.join(f"'{hub.table}'" for hub in HUBS.values()))
+
+
+# Колонки витрин CDM, в которых лежат ключи хабов DDS: их переводим вместе с хабами
+_CDM_KEY_COLUMNS = (
+    ('cdm.user_product_counters', 'user_id', 'user'),
+    ('cdm.user_product_counters', 'product_id', 'product'),
+    ('cdm.user_category_counters', 'user_id', 'user'),
+)
+
+
+# Переводит случайные uuid4-ключи хабов и линков на ключи DdsKeys в режиме hash, а с ними — ключи в витринах CDM.
+# Запускается один раз перед включением DDS_KEY_MODE=hash, когда DDS остановлен, а CDM дочитал его топик:
+#     python -m dds_loader.repository.dds_key_migration
+class DdsKeyMigration:
+    def __init__(self, db: PgConnect, logger: Logger) -> None:
+        self._db = db
+        self._logger = logger
+
+    def run(self) -> None:
+        with self._db.connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(_CASCADE_FOREIGN_KEYS_SQL)
+
+                for name, hub in HUBS.items():
+                    new_pk = f"md5({hub.bk}::text)::uuid"
+                    # Старые ключи нужны CDM, после UPDATE их уже не восстановить
+                    cur.execute(f"""
+                        CREATE TEMP TABLE key_map_{name} ON COMMIT DROP AS
+                        SELECT {hub.pk} AS old_pk, {new_pk} AS new_pk FROM {hub.table} WHERE {hub.pk} <> {new_pk}
+                    """)
+                    cur.execute(f"UPDATE {hub.table} SET {hub.pk} = {new_pk} WHERE {hub.pk} <> {new_pk}")
+                    self._logger.info(f"{hub.table}: rekeyed {cur.rowcount} rows")
+
+                for link in LINKS.values():
+                    left, right = HUBS[link.left].pk, HUBS[link.right].pk
+                    # В режиме random параллельные вставки могли записать пару дважды, а в hash у дублей
+                    # совпал бы первичный ключ — оставляем первую запись пары
+                    cur.execute(f"""
+                        DELETE FROM {link.table} t
+                        USING {link.table} d
+                        WHERE d.{left} = t.{left} AND d.{right} = t.{right}
+                          AND (d.load_dt, d.{link.pk}) < (t.load_dt, t.{link.pk})
+                    """)
+                    if cur.rowcount:
+                        self._logger.info(f"{link.table}: removed {cur.rowcount} duplicate pairs")
+                    new_pk = f"md5({left}::text || '|' || {right}::text)::uuid"
+                    cur.execute(f"UPDATE {link.table} SET {link.pk} = {new_pk} WHERE {link.pk} <> {new_pk}")
+                    self._logger.info(f"{link.table}: rekeyed {cur.rowcount} rows")
+
+                for table, column, hub in _CDM_KEY_COLUMNS:
+                    cur.execute("SELECT to_regclass(%s) IS NOT NULL", (table,))
+                    if not cur.fetchone()[0]:
+                        continue
+                    cur.execute(f"UPDATE {table} t SET {column} = m.new_pk FROM key_map_{hub} m "
+                                f"WHERE t.{column} = m.old_pk")
+                    self._logger.info(f"{table}.{column}: rekeyed {cur.rowcount} rows")
+
+
+if __name__ == '__main__':
+    from app_config import AppConfig
+
+    logging.basicConfig(level=logging.INFO)
+    DdsKeyMigration(AppConfig().pg_warehouse_db(), logging.getLogger(__name__)).run()
@@ -0,0 +1,31 @@
+import uuid
+
+from lib.keys import md5_uuid
+
+
+class DdsKeys:
+    # random — uuid4, ключ существующего хаба приходится читать из БД перед вставкой;
+    # hash — ключ считается из бизнес-ключа (Data Vault 2.0), вставки идут без чтения.
+    RANDOM = 'random'
+    HASH = 'hash'
+
+    def __init__(self, mode: str = RANDOM) -> None:
+        if mode not in (self.RANDOM, self.HASH):
+            raise ValueError(f"Unknown keying mode: {mode}")
+        self.mode = mode
+
+    @property
+    def deterministic(self) -> bool:
+        return self.mode == self.HASH
+
+    def hub_key(self, business_key) -> str:
+        # Совпадает с md5(business_key::text)::uuid в SQL, см. DdsKeyMigration
+        if not self.deterministic:
+            return str(uuid.uuid4())
+        return md5_uuid(str(business_key))
+
+    def link_key(self, *hub_keys) -> str:
+        # Совпадает с md5(left_pk::text || '|' || right_pk::text)::uuid в SQL
+        if not self.deterministic:
+            return str(uuid.uuid4())
+        return md5_uuid('|'.join(str(key) for key in hub_keys))
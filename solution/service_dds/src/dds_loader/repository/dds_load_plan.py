@@ -0,0 +1,302 @@
+import threading
+from datetime import datetime, timedelta
+from functools import lru_cache
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from lib.keys import hashdiffs
+from lib.metrics import Metrics, NullMetrics
+from lib.pg import Plan, Statement
+from dds_loader.order_messages import OrderMessage
+from dds_loader.repository.dds_cache import DdsCacheTransaction
+from dds_loader.repository.dds_keys import DdsKeys
+from dds_loader.repository.dds_tables import HUBS, LINKS, SATELLITES, HubTable, LinkTable, SatelliteTable
+from dds_loader.repository.order_batch import OrderBatch
+
+
+class OrderKeys(NamedTuple):
+    order_pk: str
+    user_pk: str
+    restaurant_pk: str
+    product_pks: List[str]
+
+
+@lru_cache(maxsize=None)
+def _hub_bulk_sql(hub: HubTable, blind: bool) -> str:
+    columns = ', '.join([hub.pk, hub.bk] + [column for column, _ in hub.extra])
+    arrays = ', '.join(['%(pk)s::uuid[]', '%(bk)s::varchar[]'] + [f'%({c})s::{t}[]' for c, t in hub.extra])
+    if blind:
+        # Детерминированные ключи уже известны, читать их из БД не нужно
+        return f"""
+            INSERT INTO {hub.table} ({columns}, load_dt, load_src)
+            SELECT v.*, %(load_dt)s, %(load_src)s FROM unnest({arrays}) AS v
+            ON CONFLICT DO NOTHING
+        """
+    # Снимок основного запроса не видит строк из ins, поэтому UNION ALL не даёт дублей
+    return f"""
+        WITH v ({columns}) AS (
+            SELECT * FROM unnest({arrays})
+        ), ins AS (
+            INSERT INTO {hub.table} ({columns}, load_dt, load_src)
+            SELECT v.*, %(load_dt)s, %(load_src)s FROM v
+            WHERE NOT EXISTS (SELECT 1 FROM {hub.table} h WHERE h.{hub.bk} = v.{hub.bk})
+            ON CONFLICT DO NOTHING
+            RETURNING {hub.pk}, {hub.bk}
+        )
+        SELECT {hub.pk}, {hub.bk} FROM ins
+        UNION ALL
+        SELECT h.{hub.pk}, h.{hub.bk} FROM {hub.table} h JOIN v ON h.{hub.bk} = v.{hub.bk}
+    """
+
+
+@lru_cache(maxsize=None)
+def _sat_latest_sql(sat: SatelliteTable) -> str:
+    pk = HUBS[sat.hub].pk
+    return f"""
+        SELECT DISTINCT ON ({pk}) {pk}, {sat.hashdiff}
+        FROM {sat.table}
+        WHERE {pk} = ANY(%s::uuid[])
+        ORDER BY {pk}, load_dt DESC
+    """
+
+
+@lru_cache(maxsize=None)
+def _sat_bulk_sql(sat: SatelliteTable) -> str:
+    pk = HUBS[sat.hub].pk
+    columns = [column for column, _ in sat.columns]
+    arrays = ', '.join(['%(pk)s::uuid[]'] + [f'%({c})s::{t}[]' for c, t in sat.columns]
+                       + ['%(load_dt)s::timestamp[]', '%(hashdiff)s::varchar[]'])
+    return f"""
+        INSERT INTO {sat.table} ({pk}, {', '.join(columns)}, load_dt, load_src, {sat.hashdiff})
+        SELECT v.pk, {', '.join('v.' + c for c in columns)}, v.load_dt, %(load_src)s, v.hashdiff
+        FROM unnest({arrays}) AS v (pk, {', '.join(columns)}, load_dt, hashdiff)
+    """
+
+
+@lru_cache(maxsize=None)
+def _link_bulk_sql(link: LinkTable, blind: bool) -> str:
+    left, right = HUBS[link.left].pk, HUBS[link.right].pk
+    columns = ''.join(f', {column}' for column, _ in link.extra)
+    values = ''.join(f', v.{column}' for column, _ in link.extra)
+    arrays = ''.join(f', %({column})s::{type_}[]' for column, type_ in link.extra)
+    return f"""
+        INSERT INTO {link.table} AS t ({link.pk}, {left}, {right}{columns}, load_dt, load_src)
+        SELECT v.pk, v.l, v.r{values}, %(load_dt)s, %(load_src)s
+        FROM unnest(%(pk)s::uuid[], %(left)s::uuid[], %(right)s::uuid[]{arrays}) AS v (pk, l, r{columns})
+        {_link_conflict(link, blind)}
+    """
+
+
+def _link_conflict(link: LinkTable, blind: bool) -> str:
+    # Пару держит уникальный индекс. В режиме hash ключ линка считается из пары, и повтор пары
+    # первым встречает первичный ключ — конфликт ищем по нему, иначе параллельная вставка упадёт
+    target = link.pk if blind else f'{HUBS[link.left].pk}, {HUBS[link.right].pk}'
+    if not link.extra:
+        return f"ON CONFLICT ({target}) DO NOTHING"
+    # Линкам, записанным до появления колонок, значения дописывает повторная загрузка их заказа
+    updates = ', '.join(f'{column} = coalesce(t.{column}, EXCLUDED.{column})' for column, _ in link.extra)
+    missing = ' OR '.join(f't.{column} IS NULL' for column, _ in link.extra)
+    return f"ON CONFLICT ({target}) DO UPDATE SET {updates} WHERE {missing}"
+
+
+class LoadClock:
+    # load_dt строго возрастает во всём процессе: сателлиты товаров и ресторанов пишут все воркеры,
+    # и одинаковый load_dt у одного ключа нарушил бы первичный ключ (hub_pk, load_dt)
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._last = datetime.min
+
+    def next(self, count: int) -> List[datetime]:
+        with self._lock:
+            start = max(datetime.utcnow(), self._last + timedelta(microseconds=1))
+            load_dts = [start + timedelta(microseconds=i) for i in range(count)]
+            if load_dts:
+                self._last = load_dts[-1]
+        return load_dts
+
+
+LOAD_CLOCK = LoadClock()
+
+
+def _as_text(value) -> Optional[str]:
+    # Значения передаём текстом и приводим типы в SQL: массивы psycopg должны быть однородными
+    return None if value is None else str(value)
+
+
+class DdsLoadPlan:
+    # Загрузка батча без ввода-вывода: план отдаёт раунды запросов и получает их результаты,
+    # исполняют его синхронный DdsRepository и асинхронный AsyncDdsRepository
+    LOAD_SRC = 'kafka'
+
+    def __init__(self, keys: DdsKeys, metrics: Optional[Metrics] = None, clock: Optional[LoadClock] = None) -> None:
+        self._keys = keys
+        self._metrics = metrics or NullMetrics()
+        self._clock = clock or LOAD_CLOCK
+
+    def load_orders(self, tx: DdsCacheTransaction, orders: List[OrderMessage]) -> Plan[List[OrderKeys]]:
+        batch = OrderBatch(orders)
+        self._metrics.inc('dds_satellite_rows_coalesced_total', batch.coalesced)
+        pks: Dict[str, Dict[str, str]] = {}
+
+        # Раунды: все хабы, затем чтение хэшей всех сателлитов, затем вставки сателлитов и линков —
+        # в режиме pipeline это три синхронизации на батч
+        with self._metrics.timer('dds_repository_seconds', call='load_orders.hubs'):
+            pending = {}
+            for name, keys in batch.hubs.items():
+                pks[name], pending[name] = self._hub_statement(tx, HUBS[name], keys)
+            pending = {name: statement for name, statement in pending.items() if statement is not None}
+
+            results = yield list(pending.values())
+            missing = {}
+            for (name, statement), rows in zip(pending.items(), results):
+                missing[name] = self._hub_resolve(tx, HUBS[name], statement, rows, pks[name])
+            missing = {name: statement for name, statement in missing.items() if statement is not None}
+
+            if missing:
+                # Ключи вставила параллельная транзакция уже после снимка запроса — дочитываем их
+                results = yield list(missing.values())
+                for name, rows in zip(missing, results):
+                    self._hub_remember(tx, HUBS[name], {bk: str(pk) for pk, bk in rows}, pks[name])
+
+        with self._metrics.timer('dds_repository_seconds', call='load_orders.satellites'):
+            rows = {}
+            last_hash = {}
+            pending = {}
+            for name, sat_rows in batch.satellites.items():
+                sat = SATELLITES[name]
+                rows[name] = [(pks[sat.hub][bk], values) for bk, values in sat_rows]
+                last_hash[name], statement = self._sat_latest_statement(tx, sat, rows[name])
+                if statement is not None:
+                    pending[name] = statement
+
+            results = yield list(pending.values())
+            for name, fetched in zip(pending, results):
+                last_hash[name].update((str(pk), str(hashdiff)) for pk, hashdiff in fetched)
+
+            inserts = [
+                self._sat_insert_statement(tx, SATELLITES[name], rows[name],
+                                           hashdiffs(values for _, values in rows[name]), last_hash[name])
+                for name in rows
+            ]
+            yield [statement for statement in inserts if statement is not None]
+
+        with self._metrics.timer('dds_repository_seconds', call='load_orders.links'):
+            pending = {}
+            for name, pairs in batch.links.items():
+                link = LINKS[name]
+                pairs = dict(sorted(
+                    ((pks[link.left][left], pks[link.right][right]), extra)
+                    for (left, right), extra in pairs.items()
+                    if not tx.has_link(link.table, pks[link.left][left], pks[link.right][right])
+                ))
+                if pairs:
+                    pending[name] = pairs
+
+            yield [self._link_statement(LINKS[name], pairs) for name, pairs in pending.items()]
+            for name, pairs in pending.items():
+                for left, right in pairs:
+                    tx.put_link(LINKS[name].table, left, right)
+
+        return [
+            OrderKeys(
+                pks['order'][order.order_id],
+                pks['user'][order.user_id],
+                pks['restaurant'][order.restaurant_id],
+                [pks['product'][product_id] for product_id in order.product_ids]
+            )
+            for order in batch.orders
+        ]
+
+    def _hub_statement(self, tx: DdsCacheTransaction, hub: HubTable,
+                       keys: Dict[str, tuple]) -> Tuple[Dict[str, str], Optional[Statement]]:
+        pks = {}
+        for bk in keys:
+            cached = tx.hub_key(hub.table, bk)
+            if cached is not None:
+                pks[bk] = cached
+        # Ключи по порядку: параллельные транзакции берут блокировки одних и тех же строк в одной очерёдности
+        bks = sorted(bk for bk in keys if bk not in pks)
+        if not bks:
+            return pks, None
+
+        params = {
+            'pk': [self._keys.hub_key(bk) for bk in bks],
+            'bk': bks,
+            'load_dt': datetime.utcnow(),
+            'load_src': self.LOAD_SRC,
+        }
+        for i, (column, _) in enumerate(hub.extra):
+            params[column] = [keys[bk][i] for bk in bks]
+        return pks, Statement(_hub_bulk_sql(hub, self._keys.deterministic), params, not self._keys.deterministic)
+
+    def _hub_resolve(self, tx: DdsCacheTransaction, hub: HubTable, statement: Statement,
+                     rows: Optional[list], pks: Dict[str, str]) -> Optional[Statement]:
+        bks = statement.params['bk']
+        if self._keys.deterministic:
+            self._hub_remember(tx, hub, dict(zip(bks, statement.params['pk'])), pks)
+            return None
+
+        self._hub_remember(tx, hub, {bk: str(pk) for pk, bk in rows}, pks)
+        missing = [bk for bk in bks if bk not in pks]
+        if not missing:
+            return None
+        return Statement(f"SELECT {hub.pk}, {hub.bk} FROM {hub.table} WHERE {hub.bk} = ANY(%s)", (missing,), True)
+
+    def _hub_remember(self, tx: DdsCacheTransaction, hub: HubTable,
+                      loaded: Dict[str, str], pks: Dict[str, str]) -> None:
+        for bk, pk in loaded.items():
+            tx.put_hub_key(hub.table, bk, pk)
+        pks.update(loaded)
+
+    def _sat_latest_statement(self, tx: DdsCacheTransaction, sat: SatelliteTable,
+                              rows: List[Tuple[str, tuple]]) -> Tuple[Dict[str, str], Optional[Statement]]:
+        last_hash = {}
+        unknown = []
+        for pk in dict.fromkeys(pk for pk, _ in rows):
+            known, cached = tx.hashdiff_state(sat.table, pk)
+            if not known:
+                unknown.append(pk)
+            elif cached is not None:
+                last_hash[pk] = cached
+        if not unknown:
+            return last_hash, None
+        return last_hash, Statement(_sat_latest_sql(sat), (unknown,), True)
+
+    def _sat_insert_statement(self, tx: DdsCacheTransaction, sat: SatelliteTable, rows: List[Tuple[str, tuple]],
+                              hashes: List[str], last_hash: Dict[str, str]) -> Optional[Statement]:
+        # Сравниваем с предыдущей версией в порядке поступления, чтобы сохранить историю изменений внутри батча
+        changed = []
+        for (pk, values), current_hash in zip(rows, hashes):
+            if last_hash.get(pk) != current_hash:
+                changed.append((pk, values, current_hash))
+                last_hash[pk] = current_hash
+
+        for pk, hashdiff in last_hash.items():
+            tx.put_hashdiff(sat.table, pk, hashdiff)
+        if not changed:
+            return None
+
+        params = {
+            'pk': [pk for pk, _, _ in changed],
+            'load_dt': self.load_dts(len(changed)),
+            'load_src': self.LOAD_SRC,
+            'hashdiff': [current_hash for _, _, current_hash in changed],
+        }
+        for i, (column, _) in enumerate(sat.columns):
+            params[column] = [_as_text(values[i]) for _, values, _ in changed]
+        return Statement(_sat_bulk_sql(sat), params)
+
+    def _link_statement(self, link: LinkTable, pairs: Dict[Tuple[str, str], tuple]) -> Statement:
+        params = {
+            'pk': [self._keys.link_key(left, right) for left, right in pairs],
+            'left': [left for left, _ in pairs],
+            'right': [right for _, right in pairs],
+            'load_dt': datetime.utcnow(),
+            'load_src': self.LOAD_SRC,
+        }
+        for i, (column, _) in enumerate(link.extra):
+            params[column] = [extra[i] for extra in pairs.values()]
+        return Statement(_link_bulk_sql(link, self._keys.deterministic), params)
+
+    def load_dts(self, count: int) -> List[datetime]:
+        # load_dt строго возрастает, иначе "последняя" версия сателлита становится неоднозначной
+        return self._clock.next(count)
@@ -0,0 +1,192 @@
+import logging
+from datetime import datetime
+
+from psycopg import Cursor
+
+from lib.migrations import Migration, Migrator, index_exists
+from lib.pg import PgConnect
+from dds_loader.repository.dds_partitions import month_start
+from dds_loader.repository.dds_tables import HUBS, LINKS, SATELLITES
+
+
+def _short(table: str) -> str:
+    return table.split('.')[-1]
+
+
+def _baseline(cur: Cursor) -> None:
+    # Таблицы уже могут существовать — их создавали до появления миграций
+    cur.execute("CREATE SCHEMA IF NOT EXISTS dds")
+    for hub in HUBS.values():
+        extra = ''.join(f', {column} {type_}' for column, type_ in hub.extra)
+        cur.execute(f"""
+            CREATE TABLE IF NOT EXISTS {hub.table} (
+                {hub.pk} uuid PRIMARY KEY,
+                {hub.bk} varchar NOT NULL UNIQUE{extra},
+                load_dt timestamp NOT NULL,
+                load_src varchar
+            )
+        """)
+    for sat in SATELLITES.values():
+        hub = HUBS[sat.hub]
+        columns = ''.join(f'{column} {type_}, ' for column, type_ in sat.columns)
+        cur.execute(f"""
+            CREATE TABLE IF NOT EXISTS {sat.table} (
+                {hub.pk} uuid NOT NULL REFERENCES {hub.table} ON UPDATE CASCADE,
+                {columns}load_dt timestamp NOT NULL,
+                load_src varchar,
+                {sat.hashdiff} varchar,
+                PRIMARY KEY ({hub.pk}, load_dt)
+            )
+        """)
+    for link in LINKS.values():
+        left, right = HUBS[link.left], HUBS[link.right]
+        cur.execute(f"""
+            CREATE TABLE IF NOT EXISTS {link.table} (
+                {link.pk} uuid PRIMARY KEY,
+                {left.pk} uuid NOT NULL REFERENCES {left.table} ON UPDATE CASCADE,
+                {right.pk} uuid NOT NULL REFERENCES {right.table} ON UPDATE CASCADE,
+                load_dt timestamp NOT NULL,
+                load_src varchar
+            )
+        """)
+
+
+def _lookup_indexes(cur: Cursor) -> None:
+    # Хабы ищутся по бизнес-ключу, линки — по паре ключей хабов (уникальными их делает миграция unique_keys)
+    for hub in HUBS.values():
+        if not index_exists(cur, hub.table, [hub.bk]):
+            cur.execute(f"CREATE INDEX {_short(hub.table)}_{hub.bk}_idx ON {hub.table} ({hub.bk})")
+    for link in LINKS.values():
+        left, right = HUBS[link.left].pk, HUBS[link.right].pk
+        if not index_exists(cur, link.table, [left, right]):
+            cur.execute(f"CREATE INDEX {_short(link.table)}_pair_idx ON {link.table} ({left}, {right})")
+    # Последний hashdiff ключа читается из индекса без обращения к таблице
+    for sat in SATELLITES.values():
+        pk = HUBS[sat.hub].pk
+        cur.execute(f"CREATE INDEX IF NOT EXISTS {_short(sat.table)}_latest_idx "
+                    f"ON {sat.table} ({pk}, load_dt DESC) INCLUDE ({sat.hashdiff})")
+
+
+def _partition_satellites(cur: Cursor) -> None:
+    # Существующая таблица целиком становится секцией с прошлой историей — строки не копируются.
+    # Следующие месяцы создаёт DdsPartitions, строки вне секций попадают в DEFAULT.
+    for sat in SATELLITES.values():
+        schema, name = sat.table.split('.')
+        cur.execute("SELECT relkind = 'p' FROM pg_class WHERE oid = %s::regclass", (sat.table,))
+        if cur.fetchone()[0]:
+            continue
+
+        hub = HUBS[sat.hub]
+        history = f'{name}_p_history'
+        cur.execute(f"LOCK TABLE {sat.table} IN ACCESS EXCLUSIVE MODE")
+        cur.execute(f"SELECT max(load_dt) FROM {sat.table}")
+        bound = month_start(max(cur.fetchone()[0] or datetime.min, datetime.utcnow()), 1)
+
+        cur.execute(f"ALTER TABLE {sat.table} RENAME TO {history}")
+        # Имена индексов уникальны в схеме: старые переходят к секции, у родителя будут свои
+        cur.execute(
+            """
+            SELECT c.relname
+            FROM pg_index i
+            JOIN pg_class c ON c.oid = i.indexrelid
+            WHERE i.indrelid = %s::regclass
+            """,
+            (f'{schema}.{history}',)
+        )
+        for index, in cur.fetchall():
+            if index.startswith(name) and not index.startswith(history):
+                cur.execute(f"ALTER INDEX {schema}.{index} RENAME TO {history}{index[len(name):]}")
+
+        cur.execute(f"CREATE TABLE {sat.table} (LIKE {schema}.{history} INCLUDING DEFAULTS) "
+                    f"PARTITION BY RANGE (load_dt)")
+        cur.execute(f"ALTER TABLE {sat.table} ADD PRIMARY KEY ({hub.pk}, load_dt), "
+                    f"ADD FOREIGN KEY ({hub.pk}) REFERENCES {hub.table} ON UPDATE CASCADE")
+        cur.execute(f"CREATE INDEX {name}_latest_idx ON {sat.table} ({hub.pk}, load_dt DESC) INCLUDE ({sat.hashdiff})")
+        cur.execute(f"ALTER TABLE {sat.table} ATTACH PARTITION {schema}.{history} "
+                    f"FOR VALUES FROM (MINVALUE) TO ('{bound.isoformat()}')")
+        cur.execute(f"CREATE TABLE {schema}.{name}_p_default PARTITION OF {sat.table} DEFAULT")
+
+
+def _link_attributes(cur: Cursor) -> None:
+    # У старых строк значений нет (NULL): их линки были записаны до появления колонок
+    for link in LINKS.values():
+        for column, type_ in link.extra:
+            cur.execute(f"ALTER TABLE {link.table} ADD COLUMN IF NOT EXISTS {column} {type_}")
+
+
+def _unique_keys(cur: Cursor) -> None:
+    # В режиме random бизнес-ключ хаба и пару линка держал уникальными только NOT EXISTS, а он не видит
+    # параллельных транзакций. Дубли сливаются в самую раннюю строку, уникальность закрепляет индекс
+    for name, hub in HUBS.items():
+        if index_exists(cur, hub.table, [hub.bk], unique=True):
+            continue
+        _merge_duplicate_hubs(cur, name)
+        cur.execute(f"CREATE UNIQUE INDEX {_short(hub.table)}_{hub.bk}_key ON {hub.table} ({hub.bk})")
+        cur.execute(f"DROP INDEX IF EXISTS dds.{_short(hub.table)}_{hub.bk}_idx")
+    for link in LINKS.values():
+        left, right = HUBS[link.left].pk, HUBS[link.right].pk
+        if index_exists(cur, link.table, [left, right], unique=True):
+            continue
+        cur.execute(f"""
+            DELETE FROM {link.table} t
+            USING (
+                SELECT {link.pk} AS pk,
+                       row_number() OVER (PARTITION BY {left}, {right} ORDER BY load_dt, {link.pk}) AS n
+                FROM {link.table}
+            ) d
+            WHERE t.{link.pk} = d.pk AND d.n > 1
+        """)
+        cur.execute(f"CREATE UNIQUE INDEX {_short(link.table)}_pair_key ON {link.table} ({left}, {right})")
+        cur.execute(f"DROP INDEX IF EXISTS dds.{_short(link.table)}_pair_idx")
+
+
+def _merge_duplicate_hubs(cur: Cursor, name: str) -> None:
+    # Сателлиты и линки дублей переезжают на оставшийся ключ; версии с тем же load_dt у него уже есть
+    hub = HUBS[name]
+    cur.execute(f"""
+        CREATE TEMP TABLE hub_duplicates AS
+        SELECT pk, keep
+        FROM (
+            SELECT {hub.pk} AS pk,
+                   first_value({hub.pk}) OVER (PARTITION BY {hub.bk} ORDER BY load_dt, {hub.pk}) AS keep
+            FROM {hub.table}
+        ) h
+        WHERE pk <> keep
+    """)
+    for sat in SATELLITES.values():
+        if sat.hub != name:
+            continue
+        cur.execute(f"""
+            DELETE FROM {sat.table} s
+            USING hub_duplicates d
+            WHERE s.{hub.pk} = d.pk
+              AND EXISTS (SELECT 1 FROM {sat.table} k WHERE k.{hub.pk} = d.keep AND k.load_dt = s.load_dt)
+        """)
+        cur.execute(f"UPDATE {sat.table} s SET {hub.pk} = d.keep FROM hub_duplicates d WHERE s.{hub.pk} = d.pk")
+    for link in LINKS.values():
+        if name in (link.left, link.right):
+            cur.execute(f"UPDATE {link.table} t SET {hub.pk} = d.keep FROM hub_duplicates d WHERE t.{hub.pk} = d.pk")
+    cur.execute(f"DELETE FROM {hub.table} h USING hub_duplicates d WHERE h.{hub.pk} = d.pk")
+    cur.execute("DROP TABLE hub_duplicates")
+
+
+MIGRATIONS = [
+    Migration(1, 'baseline', _baseline),
+    Migration(2, 'lookup_indexes', _lookup_indexes),
+    Migration(3, 'partition_satellites', _partition_satellites),
+    Migration(4, 'link_attributes', _link_attributes),
+    Migration(5, 'unique_keys', _unique_keys),
+]
+
+
+def dds_migrator(db: PgConnect, logger=None) -> Migrator:
+    return Migrator(db, 'dds', MIGRATIONS, logger)
+
+
+# Применить миграции вручную, не запуская сервис:
+#     python -m dds_loader.repository.dds_migrations
+if __name__ == '__main__':
+    from app_config import AppConfig
+
+    logging.basicConfig(level=logging.INFO)
+    dds_migrator(AppConfig().pg_warehouse_db(pooled=False), logging.getLogger(__name__)).run()
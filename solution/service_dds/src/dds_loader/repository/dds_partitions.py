@@ -0,0 +1,103 @@
+import re
+from datetime import datetime
+from logging import Logger
+from typing import Dict, Optional
+
+from psycopg import Cursor
+
+from lib.pg import PgConnect
+from dds_loader.repository.dds_tables import SATELLITES, SatelliteTable
+
+_UPPER_BOUND = re.compile(r"TO \('([^']+)'\)")
+
+
+def month_start(value: datetime, shift: int = 0) -> datetime:
+    index = value.year * 12 + value.month - 1 + shift
+    return datetime(index // 12, index % 12 + 1, 1)
+
+
+def partition_bounds(cur: Cursor, table: str) -> Optional[Dict[str, Optional[datetime]]]:
+    # Секция -> верхняя граница диапазона (None у секции DEFAULT); None, если таблица не секционирована
+    cur.execute("SELECT relkind = 'p' FROM pg_class WHERE oid = %s::regclass", (table,))
+    if not cur.fetchone()[0]:
+        return None
+    cur.execute(
+        """
+        SELECT c.relname, pg_get_expr(c.relpartbound, c.oid)
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = %s::regclass
+        """,
+        (table,)
+    )
+    bounds = {}
+    for name, bound in cur.fetchall():
+        upper = _UPPER_BOUND.search(bound)
+        bounds[name] = datetime.fromisoformat(upper.group(1)) if upper else None
+    return bounds
+
+
+class DdsPartitions:
+    # Сателлиты секционированы по load_dt помесячно (миграция 0003). Обслуживание создаёт секции наперёд
+    # и отсоединяет секции старше срока хранения в схему dds_archive: поиск последней версии идёт по индексу
+    # каждой подключённой секции, и его стоимость не растёт вместе со всей историей.
+    ARCHIVE_SCHEMA = 'dds_archive'
+
+    def __init__(self, db: PgConnect, logger: Logger, months_ahead: int = 2, retain_months: int = 0) -> None:
+        self._db = db
+        self._logger = logger
+        self._months_ahead = months_ahead
+        # 0 — старые секции не архивируются
+        self._retain_months = retain_months
+
+    def maintain(self) -> None:
+        for sat in SATELLITES.values():
+            try:
+                with self._db.connection() as conn:
+                    with conn.cursor() as cur:
+                        bounds = partition_bounds(cur, sat.table)
+                        if bounds is None:
+                            self._logger.warning(f"{sat.table} is not partitioned, skipping maintenance")
+                            continue
+                        self._create_ahead(cur, sat, bounds)
+                        if self._retain_months > 0:
+                            self._archive(cur, sat, bounds)
+            except Exception as e:
+                # Следующий запуск обслуживания повторит попытку, загрузку это не останавливает
+                self._logger.error(f"Partition maintenance of {sat.table} failed: {e}")
+
+    def _create_ahead(self, cur: Cursor, sat: SatelliteTable, bounds: Dict[str, Optional[datetime]]) -> None:
+        schema, name = sat.table.split('.')
+        covered = max((upper for upper in bounds.values() if upper is not None), default=datetime.min)
+        default = f'{schema}.{name}_p_default'
+        now = datetime.utcnow()
+        for shift in range(self._months_ahead + 1):
+            start, end = month_start(now, shift), month_start(now, shift + 1)
+            if start < covered:
+                continue
+
+            # Строки, попавшие в DEFAULT, переносим в новую секцию, иначе ATTACH не пройдёт проверку
+            partition = f'{schema}.{name}_p{start:%Y%m}'
+            where = f"load_dt >= '{start.isoformat()}' AND load_dt < '{end.isoformat()}'"
+            cur.execute(f"CREATE TABLE {partition} (LIKE {sat.table} INCLUDING DEFAULTS)")
+            cur.execute(f"LOCK TABLE {default} IN ACCESS EXCLUSIVE MODE")
+            cur.execute(f"INSERT INTO {partition} SELECT * FROM {default} WHERE {where}")
+            cur.execute(f"DELETE FROM {default} WHERE {where}")
+            moved = cur.rowcount
+            cur.execute(f"ALTER TABLE {sat.table} ATTACH PARTITION {partition} "
+                        f"FOR VALUES FROM ('{start.isoformat()}') TO ('{end.isoformat()}')")
+            self._logger.info(f"Created partition {partition}, moved {moved} rows from default")
+            covered = end
+
+    def _archive(self, cur: Cursor, sat: SatelliteTable, bounds: Dict[str, Optional[datetime]]) -> None:
+        # Последняя версия ключа из архивной секции больше не видна: при следующем изменении
+        # или повторе сообщения в сателлит запишется новая версия
+        schema = sat.table.split('.')[0]
+        cutoff = month_start(datetime.utcnow(), -self._retain_months)
+        cur.execute(f"CREATE SCHEMA IF NOT EXISTS {self.ARCHIVE_SCHEMA}")
+        for partition, upper in sorted(bounds.items()):
+            if upper is None or upper > cutoff:
+                continue
+            cur.execute(f"ALTER TABLE {sat.table} DETACH PARTITION {schema}.{partition}")
+            cur.execute(f"ALTER TABLE {schema}.{partition} SET SCHEMA {self.ARCHIVE_SCHEMA}")
+            self._logger.info(f"Archived partition {schema}.{partition} to {self.ARCHIVE_SCHEMA}")
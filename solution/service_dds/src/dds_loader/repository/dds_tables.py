@@ -0,0 +1,59 @@
+from typing import FrozenSet, NamedTuple, Optional, Tuple
+
+
+class HubTable(NamedTuple):
+    table: str
+    pk: str
+    bk: str
+    extra: Tuple[Tuple[str, str], ...] = ()
+
+
+class SatelliteTable(NamedTuple):
+    table: str
+    hub: str
+    columns: Tuple[Tuple[str, str], ...]
+    hashdiff: str
+
+
+class LinkTable(NamedTuple):
+    table: str
+    pk: str
+    left: str
+    right: str
+    extra: Tuple[Tuple[str, str], ...] = ()
+
+
+# Описание таблиц DDS: имя колонки и тип для приведения массивов в unnest
+HUBS = {
+    'order': HubTable('dds.h_order', 'h_order_pk', 'order_id', (('order_dt', 'timestamp'),)),
+    'user': HubTable('dds.h_user', 'h_user_pk', 'user_id'),
+    'restaurant': HubTable('dds.h_restaurant', 'h_restaurant_pk', 'restaurant_id'),
+    'product': HubTable('dds.h_product', 'h_product_pk', 'product_id'),
+    'category': HubTable('dds.h_category', 'h_category_pk', 'category_name'),
+}
+
+SATELLITES = {
+    'order_cost': SatelliteTable(
+        'dds.s_order_cost', 'order', (('cost', 'numeric'), ('payment', 'numeric')), 'hk_order_cost_hashdiff'),
+    'order_status': SatelliteTable(
+        'dds.s_order_status', 'order', (('status', 'varchar'),), 'hk_order_status_hashdiff'),
+    'user_names': SatelliteTable(
+        'dds.s_user_names', 'user', (('username', 'varchar'), ('userlogin', 'varchar')), 'hk_user_names_hashdiff'),
+    'restaurant_names': SatelliteTable(
+        'dds.s_restaurant_names', 'restaurant', (('name', 'varchar'),), 'hk_restaurant_names_hashdiff'),
+    'product_names': SatelliteTable(
+        'dds.s_product_names', 'product', (('name', 'varchar'),), 'hk_product_names_hashdiff'),
+}
+
+LINKS = {
+    'order_user': LinkTable('dds.l_order_user', 'hk_order_user_pk', 'order', 'user'),
+    # Количество товара в заказе нужно, чтобы пересобрать счётчики CDM из DDS так же, как их считает поток
+    'order_product': LinkTable(
+        'dds.l_order_product', 'hk_order_product_pk', 'order', 'product', (('quantity', 'integer'),)),
+    'product_category': LinkTable('dds.l_product_category', 'hk_product_category_pk', 'product', 'category'),
+    'product_restaurant': LinkTable('dds.l_product_restaurant', 'hk_product_restaurant_pk', 'product', 'restaurant'),
+}
+
+
+def hub_satellites(hub: Optional[str]) -> FrozenSet[str]:
+    return frozenset(sat.table for sat in SATELLITES.values() if sat.hub == hub)
@@ -0,0 +1,67 @@
+from contextlib import AsyncExitStack, ExitStack
+from typing import List, Optional
+
+from psycopg import AsyncConnection, Connection, Cursor
+
+from lib.pg import AsyncPgConnect, PgConnect, Statement, execute_round, execute_round_async
+from lib.pg.statements import Results
+from dds_loader.repository.dds_cache import DdsCache, DdsCacheTransaction
+
+
+class DdsUnitOfWork:
+    # Одно соединение и одна транзакция на всю единицу работы. В режиме pipeline запросы без чтения
+    # результата уходят в БД не дожидаясь ответа, синхронизация происходит на fetch* и на commit.
+    def __init__(self, db: PgConnect, cache: DdsCache, pipeline: bool = True) -> None:
+        self._db = db
+        self._cache = cache
+        self._pipeline = pipeline
+        self._stack = ExitStack()
+        self._conn: Optional[Connection] = None
+        self.tx: Optional[DdsCacheTransaction] = None
+
+    def __enter__(self) -> 'DdsUnitOfWork':
+        # Кэш публикуется только после commit: его контекст закрывается последним
+        self.tx = self._stack.enter_context(self._cache.transaction())
+        return self
+
+    def __exit__(self, *exc_info) -> bool:
+        return self._stack.__exit__(*exc_info)
+
+    def connection(self) -> Connection:
+        # Соединение берётся лениво: если всё нашлось в кэше, в БД не ходим вовсе
+        if self._conn is None:
+            self._conn = self._stack.enter_context(self._db.connection())
+            if self._pipeline:
+                self._stack.enter_context(self._conn.pipeline())
+        return self._conn
+
+    def cursor(self) -> Cursor:
+        return self.connection().cursor()
+
+    def execute(self, statements: List[Statement]) -> Results:
+        return execute_round(self.cursor, statements)
+
+
+class AsyncDdsUnitOfWork:
+    # То же для asyncio: транзакция на соединении из асинхронного пула, кэш — общий с синхронной версией
+    def __init__(self, db: AsyncPgConnect, cache: DdsCache, pipeline: bool = True) -> None:
+        self._db = db
+        self._cache = cache
+        self._pipeline = pipeline
+        self._stack = AsyncExitStack()
+        self._conn: Optional[AsyncConnection] = None
+        self.tx: Optional[DdsCacheTransaction] = None
+
+    async def __aenter__(self) -> 'AsyncDdsUnitOfWork':
+        self.tx = self._stack.enter_context(self._cache.transaction())
+        return self
+
+    async def __aexit__(self, *exc_info) -> bool:
+        return await self._stack.__aexit__(*exc_info)
+
+    async def execute(self, statements: List[Statement]) -> Results:
+        if self._conn is None:
+            self._conn = await self._stack.enter_async_context(self._db.connection())
+            if self._pipeline:
+                await self._stack.enter_async_context(self._conn.pipeline())
+        return await execute_round_async(self._conn.cursor, statements)
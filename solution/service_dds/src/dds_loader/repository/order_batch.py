@@ -0,0 +1,72 @@
+from typing import Dict, List, NamedTuple, Tuple
+
+from lib.keys import canonical
+from dds_loader.order_messages import OrderMessage
+from dds_loader.repository.dds_tables import HUBS, LINKS, SATELLITES
+
+
+class ParsedOrder(NamedTuple):
+    order_id: str
+    user_id: str
+    restaurant_id: str
+    product_ids: List[str]
+
+
+class OrderBatch:
+    def __init__(self, messages: List[OrderMessage]) -> None:
+        self.orders: List[ParsedOrder] = []
+        # хаб -> бизнес-ключ -> значения дополнительных колонок
+        self.hubs: Dict[str, Dict[str, tuple]] = {name: {} for name in HUBS}
+        # сателлит -> [(бизнес-ключ хаба, значения)] в порядке поступления сообщений
+        self.satellites: Dict[str, List[Tuple[str, tuple]]] = {name: [] for name in SATELLITES}
+        # линк -> уникальные пары бизнес-ключей (dict сохраняет порядок) -> значения дополнительных колонок
+        self.links: Dict[str, Dict[Tuple[str, str], tuple]] = {name: {} for name in LINKS}
+        # Сколько строк сателлитов отброшено как повтор предыдущего значения того же ключа в батче
+        self.coalesced = 0
+        self._last_values: Dict[Tuple[str, str], bytes] = {}
+
+        for msg in messages:
+            self._add(msg)
+
+    def _add(self, msg: OrderMessage) -> None:
+        # Схема сообщения уже проверена при разборе, дата приходит как datetime
+        payload = msg.payload
+        order_id = str(msg.object_id)
+        user = payload.user
+        restaurant = payload.restaurant
+
+        self.hubs['order'].setdefault(order_id, (payload.date,))
+        self.hubs['user'].setdefault(user.id, ())
+        self.hubs['restaurant'].setdefault(restaurant.id, ())
+
+        self._add_satellite('order_cost', order_id, (payload.cost, payload.payment))
+        self._add_satellite('order_status', order_id, (payload.status,))
+        self._add_satellite('user_names', user.id, (user.name, user.login))
+        self._add_satellite('restaurant_names', restaurant.id, (restaurant.name,))
+        self.links['order_user'][(order_id, user.id)] = ()
+
+        quantities: Dict[str, int] = {}
+        for product in payload.products:
+            self.hubs['product'].setdefault(product.id, ())
+            self.hubs['category'].setdefault(product.category, ())
+            self._add_satellite('product_names', product.id, (product.name,))
+            # Товар может встретиться в заказе несколькими строками — CDM складывает их количество
+            quantities[product.id] = quantities.get(product.id, 0) + product.quantity
+            self.links['product_category'][(product.id, product.category)] = ()
+            self.links['product_restaurant'][(product.id, restaurant.id)] = ()
+        for product_id, quantity in quantities.items():
+            # Линк пишется один раз, как и заказ учитывается в CDM один раз: остаётся первая копия
+            self.links['order_product'].setdefault((order_id, product_id), (quantity,))
+
+        self.orders.append(ParsedOrder(order_id, user.id, restaurant.id, [p.id for p in payload.products]))
+
+    def _add_satellite(self, name: str, bk: str, values: tuple) -> None:
+        # Заказ приходит несколько раз по мере смены статуса: из повторов остаются только переходы.
+        # Сравниваем каноническую форму — ту же, из которой считается hashdiff, так что отбрасываются
+        # ровно те строки, которые не дали бы новой версии сателлита
+        form = canonical(*values)
+        if self._last_values.get((name, bk)) == form:
+            self.coalesced += 1
+            return
+        self._last_values[(name, bk)] = form
+        self.satellites[name].append((bk, values))
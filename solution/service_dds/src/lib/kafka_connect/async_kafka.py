@@ -0,0 +1,72 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, TypeVar
+
+from lib.kafka_connect.dead_letter import DeadLetterQueue
+from lib.kafka_connect.kafka_connectors import KafkaConsumer, KafkaMessage, KafkaProducer, OutgoingMessage
+
+T = TypeVar('T')
+
+
+class _ThreadBound:
+    # Вызовы librdkafka блокируют поток, поэтому выполняются в отдельном потоке, а event loop
+    # в это время обслуживает запросы к БД. Поток один на клиента — вызовы к нему идут строго по очереди.
+    def __init__(self, name: str) -> None:
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=name)
+
+    async def _call(self, fn: Callable[..., T], *args) -> T:
+        return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+
+    def _shutdown(self) -> None:
+        self._executor.shutdown(wait=False)
+
+
+class AsyncKafkaConsumer(_ThreadBound):
+    def __init__(self, consumer: KafkaConsumer) -> None:
+        super().__init__('kafka-consumer')
+        self.consumer = consumer
+
+    def add_rebalance_listener(self, listener: Callable[[str, List[int]], None]) -> None:
+        self.consumer.add_rebalance_listener(listener)
+
+    async def consume_batch(self, max_messages: int, timeout: float = 3.0) -> List[KafkaMessage]:
+        return await self._call(self.consumer.consume_batch, max_messages, timeout)
+
+    async def commit(self) -> None:
+        await self._call(self.consumer.commit)
+
+    async def rewind(self) -> None:
+        await self._call(self.consumer.rewind)
+
+    async def lag(self) -> Dict[int, int]:
+        return await self._call(self.consumer.lag)
+
+    async def close(self) -> None:
+        await self._call(self.consumer.close)
+        self._shutdown()
+
+
+class AsyncKafkaProducer(_ThreadBound):
+    def __init__(self, producer: KafkaProducer) -> None:
+        super().__init__('kafka-producer')
+        self.producer = producer
+
+    async def produce_batch(self, messages: List[OutgoingMessage]) -> None:
+        # Один переход в поток Kafka на батч, а не на сообщение
+        await self._call(lambda: [
+            self.producer.produce(message.value, key=message.key, headers=message.headers) for message in messages])
+
+    async def flush(self) -> None:
+        await self._call(self.producer.flush)
+
+
+class AsyncDeadLetterQueue(_ThreadBound):
+    def __init__(self, dead_letters: DeadLetterQueue) -> None:
+        super().__init__('kafka-dlq')
+        self.dead_letters = dead_letters
+
+    async def send(self, message: KafkaMessage, error: Any, stage: str) -> None:
+        await self._call(self.dead_letters.send, message, error, stage)
+
+    async def flush(self) -> None:
+        await self._call(self.dead_letters.flush)
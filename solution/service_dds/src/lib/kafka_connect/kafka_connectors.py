@@ -1,15 +1,51 @@
-import json
-from typing import Dict, Optional
+import logging
+from logging import Logger
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Set, Tuple
 
-from confluent_kafka import Consumer, Producer
+from confluent_kafka import Consumer, KafkaError, Producer, TopicPartition
+
+from lib.kafka_connect.serializers import JsonSerializer, json_serializer
+from lib.metrics import SIZE_BUCKETS, Metrics, NullMetrics
 
 
 def error_callback(err):
     print('Something went wrong: {}'.format(err))
 
 
+class KafkaMessage(NamedTuple):
+    topic: str
+    partition: int
+    offset: int
+    key: Optional[bytes]
+    # None, если тело сообщения не удалось разобрать или оно не прошло проверку схемы
+    value: Optional[Any]
+    error: Optional[str] = None
+    # Исходные байты сообщения — для пересылки в dead-letter топик как есть
+    raw: Optional[bytes] = None
+    headers: Optional[Dict[str, bytes]] = None
+
+
+class OutgoingMessage(NamedTuple):
+    value: Any
+    key: Optional[bytes] = None
+    headers: Optional[List[Tuple[str, str]]] = None
+
+
 class KafkaProducer:
-    def __init__(self, host: str, port: int, user: str, password: str, topic: str, cert_path: str) -> None:
+    def __init__(self,
+                 host: str,
+                 port: int,
+                 user: str,
+                 password: str,
+                 topic: str,
+                 cert_path: str,
+                 batched: bool = False,
+                 linger_ms: int = 20,
+                 batch_size: int = 131072,
+                 compression: str = 'lz4',
+                 serializer: Optional[JsonSerializer] = None,
+                 metrics: Optional[Metrics] = None
+                 ) -> None:
         params = {
             'bootstrap.servers': f'{host}:{port}',
             'security.protocol': 'SASL_SSL',
@@ -19,13 +55,60 @@ class KafkaProducer:
             'sasl.password': password,
             'error_cb': error_callback,
         }
+        if batched:
+            # Сообщения копятся в буфере librdkafka и уходят пачками, flush — один раз на батч
+            params.update({
+                'linger.ms': linger_ms,
+                'batch.size': batch_size,
+                'compression.type': compression,
+            })
 
         self.topic = topic
+        self.batched = batched
+        self.serializer = serializer or json_serializer()
+        self.metrics = metrics or NullMetrics()
         self.p = Producer(params)
+        self._delivery_errors: List[KafkaError] = []
+
+    def produce(self,
+                payload: Any,
+                on_delivery: Optional[Callable] = None,
+                key: Optional[bytes] = None,
+                headers: Optional[List[Tuple[str, str]]] = None
+                ) -> None:
+        # bytes отправляются как есть, остальное — через сериализатор
+        value = payload if isinstance(payload, bytes) else self.serializer.dumps(payload)
+        self.metrics.inc('kafka_producer_messages_total', topic=self.topic)
+        if not self.batched:
+            self.p.produce(self.topic, value, key=key, headers=headers, on_delivery=on_delivery)
+            self.p.flush(10)
+            return
+
+        def delivery_callback(err, msg):
+            if err is not None:
+                self._delivery_errors.append(err)
+                self.metrics.inc('kafka_producer_delivery_errors_total', topic=self.topic)
+            if on_delivery is not None:
+                on_delivery(err, msg)
 
-    def produce(self, payload: Dict) -> None:
-        self.p.produce(self.topic, json.dumps(payload))
-        self.p.flush(10)
+        while True:
+            try:
+                self.p.produce(self.topic, value, key=key, headers=headers, on_delivery=delivery_callback)
+                break
+            except BufferError:
+                # Локальная очередь заполнена — ждём, пока брокер подтвердит часть сообщений
+                self.metrics.inc('kafka_producer_queue_full_total', topic=self.topic)
+                self.p.poll(1)
+        self.p.poll(0)
+
+    def flush(self, timeout: float = 10) -> None:
+        with self.metrics.timer('kafka_producer_flush_seconds', topic=self.topic):
+            remaining = self.p.flush(timeout)
+        errors, self._delivery_errors = self._delivery_errors, []
+        if remaining:
+            raise Exception(f'{remaining} messages were not delivered in {timeout}s')
+        if errors:
+            raise Exception(f'{len(errors)} messages failed delivery, first error: {errors[0]}')
 
 
 class KafkaConsumer:
@@ -36,7 +119,13 @@ class KafkaConsumer:
                  password: str,
                  topic: str,
                  group: str,
-                 cert_path: str
+                 cert_path: str,
+                 client_id: str = 'someclientkey',
+                 serializer: Optional[JsonSerializer] = None,
+                 metrics: Optional[Metrics] = None,
+                 group_instance_id: str = '',
+                 session_timeout_ms: int = 45000,
+                 logger: Optional[Logger] = None
                  ) -> None:
         params = {
             'bootstrap.servers': f'{host}:{port}',
@@ -50,18 +139,146 @@ class KafkaConsumer:
             'enable.auto.commit': False,
             'error_cb': error_callback,
             'debug': 'all',
-            'client.id': 'someclientkey'
+            'client.id': client_id,
+            # Инкрементальная ребалансировка: при масштабировании переезжают только нужные партиции,
+            # остальные consumer'ы продолжают читать свои без остановки
+            'partition.assignment.strategy': 'cooperative-sticky',
+            'session.timeout.ms': session_timeout_ms,
         }
+        if group_instance_id:
+            # Статическое членство: перезапуск в пределах session.timeout.ms не вызывает ребалансировку
+            params['group.instance.id'] = group_instance_id
 
         self.topic = topic
+        self.serializer = serializer or json_serializer()
+        self.metrics = metrics or NullMetrics()
+        self.logger = logger or logging.getLogger(__name__)
         self.c = Consumer(params)
-        self.c.subscribe([topic])
+        # (topic, partition) -> (первый прочитанный offset, следующий offset) ещё не закоммиченного диапазона
+        self._pending_offsets: Dict[Tuple[str, int], Tuple[int, int]] = {}
+        self._assigned: Set[Tuple[str, int]] = set()
+        self._listeners: List[Callable[[str, List[int]], None]] = []
+        self.c.subscribe([topic], on_assign=self._on_assign, on_revoke=self._on_revoke, on_lost=self._on_lost)
+
+    def add_rebalance_listener(self, listener: Callable[[str, List[int]], None]) -> None:
+        # listener(event, partitions), event — assign, revoke или lost; вызывается в потоке consumer'а
+        self._listeners.append(listener)
 
-    def consume(self, timeout: float = 3.0) -> Optional[Dict]:
+    def consume(self, timeout: float = 3.0) -> Optional[Any]:
         msg = self.c.poll(timeout=timeout)
         if not msg:
             return None
         if msg.error():
             raise Exception(msg.error())
-        val = msg.value().decode()
-        return json.loads(val)
+        self._track(msg)
+        return self.serializer.loads(msg.value())
+
+    def consume_batch(self, max_messages: int, timeout: float = 3.0) -> List[KafkaMessage]:
+        with self.metrics.timer('kafka_consumer_poll_seconds', topic=self.topic):
+            msgs = self.c.consume(num_messages=max_messages, timeout=timeout)
+        batch = []
+        errors = 0
+        with self.metrics.timer('kafka_consumer_decode_seconds', topic=self.topic):
+            for msg in msgs:
+                if msg.error():
+                    # Батч не дойдёт до обработчика: offset'ы уже разобранных сообщений не должны попасть
+                    # в следующий commit, поэтому возвращаемся к ним перед ошибкой
+                    self.rewind()
+                    raise Exception(msg.error())
+                if (msg.topic(), msg.partition()) not in self._assigned:
+                    # Партицию отозвали в этом же вызове consume — сообщение прочитает новый владелец
+                    continue
+                # Разбираем прямо из bytes сообщения, без промежуточного decode() в str
+                headers = dict(msg.headers() or ())
+                try:
+                    value, error = self.serializer.loads_message(msg.value(), headers), None
+                except (TypeError, ValueError) as e:
+                    value, error = None, str(e)
+                    errors += 1
+                batch.append(KafkaMessage(
+                    msg.topic(), msg.partition(), msg.offset(), msg.key(), value, error, msg.value(), headers))
+                self._track(msg)
+        self.metrics.observe('kafka_consumer_batch_size', len(batch), SIZE_BUCKETS, topic=self.topic)
+        self.metrics.inc('kafka_consumer_messages_total', len(batch), topic=self.topic)
+        if errors:
+            self.metrics.inc('kafka_consumer_decode_errors_total', errors, topic=self.topic)
+        return batch
+
+    def commit(self) -> None:
+        # Вызывается только после того, как результаты батча надёжно сохранены
+        if not self._pending_offsets:
+            return
+        offsets = [
+            TopicPartition(topic, partition, next_offset)
+            for (topic, partition), (_, next_offset) in self._pending_offsets.items()
+        ]
+        with self.metrics.timer('kafka_consumer_commit_seconds', topic=self.topic):
+            self.c.commit(offsets=offsets, asynchronous=False)
+        self._pending_offsets.clear()
+
+    def rewind(self) -> None:
+        # Возвращаемся к первому незакоммиченному сообщению, чтобы батч был прочитан повторно
+        for (topic, partition), (first_offset, _) in self._pending_offsets.items():
+            self.c.seek(TopicPartition(topic, partition, first_offset))
+        self._pending_offsets.clear()
+        self.metrics.inc('kafka_consumer_rewinds_total', topic=self.topic)
+
+    def _on_assign(self, consumer, partitions: List[TopicPartition]) -> None:
+        self._assigned.update((tp.topic, tp.partition) for tp in partitions)
+        self._notify('assign', partitions)
+
+    def _on_revoke(self, consumer, partitions: List[TopicPartition]) -> None:
+        # Вызывается внутри consume(), когда прошлый батч уже обработан: незакоммиченные offset'ы здесь —
+        # только от батча, у которого не прошёл commit. Коммитим их, пока партиции ещё наши
+        revoked = {(tp.topic, tp.partition) for tp in partitions}
+        offsets = [
+            TopicPartition(topic, partition, next_offset)
+            for (topic, partition), (_, next_offset) in self._pending_offsets.items()
+            if (topic, partition) in revoked
+        ]
+        if offsets:
+            try:
+                self.c.commit(offsets=offsets, asynchronous=False)
+            except Exception as e:
+                # Новый владелец перечитает эти сообщения; записи в DDS идемпотентны, CDM отсекает повторы
+                self.metrics.inc('kafka_consumer_commit_errors_total', topic=self.topic, stage='revoke')
+                self.logger.warning(f'Commit of revoked partitions {sorted(revoked)} failed: {e}')
+        self._release(revoked)
+        self._notify('revoke', partitions)
+
+    def _on_lost(self, consumer, partitions: List[TopicPartition]) -> None:
+        # Партиции уже у другого consumer'а (истёк session timeout) — коммитить нельзя
+        self._release({(tp.topic, tp.partition) for tp in partitions})
+        self._notify('lost', partitions)
+
+    def _release(self, partitions: Set[Tuple[str, int]]) -> None:
+        self._assigned -= partitions
+        for key in partitions:
+            self._pending_offsets.pop(key, None)
+
+    def _notify(self, event: str, partitions: List[TopicPartition]) -> None:
+        self.metrics.inc('kafka_consumer_rebalances_total', topic=self.topic, event=event)
+        for listener in self._listeners:
+            listener(event, sorted(tp.partition for tp in partitions))
+
+    def _track(self, msg) -> None:
+        key = (msg.topic(), msg.partition())
+        first_offset, _ = self._pending_offsets.get(key, (msg.offset(), None))
+        self._pending_offsets[key] = (first_offset, msg.offset() + 1)
+
+    def lag(self) -> Dict[int, int]:
+        partitions = self.c.assignment()
+        if not partitions:
+            return {}
+
+        lag = {}
+        for tp in self.c.position(partitions):
+            low, high = self.c.get_watermark_offsets(TopicPartition(tp.topic, tp.partition), timeout=1.0)
+            # До первого чтения позиция не определена — считаем от начала партиции
+            offset = tp.offset if tp.offset >= 0 else low
+            lag[tp.partition] = max(high - offset, 0)
+            self.metrics.set('kafka_consumer_lag', lag[tp.partition], topic=tp.topic, partition=tp.partition)
+        return lag
+
+    def close(self) -> None:
+        self.c.close()
@@ -0,0 +1,44 @@
+import hashlib
+import uuid
+from functools import lru_cache
+from typing import Dict, Iterable, List
+
+# Каноническая форма набора полей: str() каждого поля (None -> 'None', числа — как их печатает Python:
+# 100 -> '100', 100.5 -> '100.5'), поля через '_', результат в UTF-8. В этой форме уже посчитаны
+# hashdiff сателлитов и md5-ключи хабов в DDS: при её изменении DDS нужно пересчитывать целиком.
+SEPARATOR = '_'
+# Сколько ключей запоминается между батчами: справочники товаров и категорий невелики
+KEY_CACHE_SIZE = 65536
+
+
+def canonical(*fields) -> bytes:
+    return SEPARATOR.join(map(str, fields)).encode()
+
+
+def hashdiff(*fields) -> str:
+    return hashlib.md5(canonical(*fields)).hexdigest()
+
+
+def hashdiffs(rows: Iterable[tuple]) -> List[str]:
+    # Один проход по батчу: одинаковые строки (названия товаров, статусы) хэшируются один раз
+    known: Dict[str, str] = {}
+    result = []
+    for fields in rows:
+        combined = SEPARATOR.join(map(str, fields))
+        digest = known.get(combined)
+        if digest is None:
+            digest = known[combined] = hashlib.md5(combined.encode()).hexdigest()
+        result.append(digest)
+    return result
+
+
+@lru_cache(maxsize=KEY_CACHE_SIZE)
+def md5_uuid(value: str) -> str:
+    # Совпадает с md5(value)::uuid в SQL
+    return str(uuid.UUID(hashlib.md5(value.encode()).hexdigest()))
+
+
+@lru_cache(maxsize=KEY_CACHE_SIZE)
+def category_id(category_name: str) -> str:
+    return str(uuid.uuid5(uuid.NAMESPACE_DNS, f"category_{category_name}"))
+
@@ -0,0 +1 @@
+from .registry import DEFAULT_BUCKETS, SIZE_BUCKETS, Metrics, NullMetrics  # noqa
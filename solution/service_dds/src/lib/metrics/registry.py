@@ -0,0 +1,135 @@
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager, nullcontext
+from typing import Callable, ContextManager, Dict, List, Sequence, Tuple
+
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+class _Histogram:
+    def __init__(self, buckets: Sequence[float]) -> None:
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Metrics:
+    # Счётчики, gauge и гистограммы в памяти процесса, отдаются в текстовом формате Prometheus
+    enabled = True
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._counters: Dict[Tuple[str, Labels], float] = {}
+        self._gauges: Dict[Tuple[str, Labels], float] = {}
+        self._histograms: Dict[Tuple[str, Labels], _Histogram] = {}
+        self._collectors: List[Callable[['Metrics'], None]] = []
+
+    def inc(self, name: str, value: float = 1.0, **labels) -> None:
+        key = (name, _labels(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0.0) + value
+
+    def set(self, name: str, value: float, **labels) -> None:
+        with self._lock:
+            self._gauges[(name, _labels(labels))] = value
+
+    def observe(self, name: str, value: float, buckets: Sequence[float] = DEFAULT_BUCKETS, **labels) -> None:
+        key = (name, _labels(labels))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = _Histogram(buckets)
+            histogram.observe(value)
+
+    @contextmanager
+    def timer(self, name: str, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started, **labels)
+
+    def collector(self, collect: Callable[['Metrics'], None]) -> None:
+        # Вызывается перед каждой выдачей /metrics — для значений, которые дешевле прочитать, чем отслеживать
+        self._collectors.append(collect)
+
+    def render(self) -> str:
+        for collect in self._collectors:
+            collect(self)
+
+        lines = []
+        with self._lock:
+            for kind, values in (('counter', self._counters), ('gauge', self._gauges)):
+                for name in sorted({name for name, _ in values}):
+                    lines.append(f'# TYPE {name} {kind}')
+                    for (metric, labels), value in sorted(values.items()):
+                        if metric == name:
+                            lines.append(f'{name}{_format(labels)} {_number(value)}')
+
+            for name in sorted({name for name, _ in self._histograms}):
+                lines.append(f'# TYPE {name} histogram')
+                for (metric, labels), histogram in sorted(self._histograms.items(), key=lambda item: item[0]):
+                    if metric != name:
+                        continue
+                    cumulative = 0
+                    for bound, count in zip(histogram.buckets + (float('inf'),), histogram.counts):
+                        cumulative += count
+                        le = '+Inf' if bound == float('inf') else _number(bound)
+                        lines.append(f'{name}_bucket{_format(labels + (("le", le),))} {cumulative}')
+                    lines.append(f'{name}_sum{_format(labels)} {_number(histogram.sum)}')
+                    lines.append(f'{name}_count{_format(labels)} {histogram.count}')
+        return '\n'.join(lines) + '\n'
+
+
+class NullMetrics(Metrics):
+    # Выключенные метрики: все вызовы — пустые, таймер не читает часы
+    enabled = False
+
+    def __init__(self) -> None:
+        self._timer = nullcontext()
+
+    def inc(self, name: str, value: float = 1.0, **labels) -> None:
+        pass
+
+    def set(self, name: str, value: float, **labels) -> None:
+        pass
+
+    def observe(self, name: str, value: float, buckets: Sequence[float] = DEFAULT_BUCKETS, **labels) -> None:
+        pass
+
+    def timer(self, name: str, **labels) -> ContextManager:
+        return self._timer
+
+    def collector(self, collect: Callable[[Metrics], None]) -> None:
+        pass
+
+    def render(self) -> str:
+        return ''
+
+
+def _labels(labels: Dict[str, object]) -> Labels:
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def _format(labels: Labels) -> str:
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{key}="{_escape(value)}"' for key, value in labels) + '}'
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _number(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
@@ -0,0 +1,106 @@
+import logging
+from datetime import datetime
+from logging import Logger
+from typing import Callable, List, NamedTuple, Optional, Sequence, Set
+
+from psycopg import Cursor
+
+from lib.pg import PgConnect
+
+
+class Migration(NamedTuple):
+    version: int
+    name: str
+    # Получает курсор открытой транзакции; запись о версии делается в той же транзакции
+    apply: Callable[[Cursor], None]
+
+
+class MigrationError(Exception):
+    pass
+
+
+def index_exists(cur: Cursor, table: str, columns: Sequence[str], unique: bool = False) -> bool:
+    # Есть ли индекс, который начинается с этих колонок в этом порядке, — тогда новый не нужен.
+    # unique — нужен уникальный индекс ровно по этим колонкам: более длинный ключ их уникальность не держит
+    cur.execute(
+        """
+        SELECT 1
+        FROM pg_index i
+        WHERE i.indrelid = %s::regclass
+          AND (NOT %s OR i.indisunique AND i.indnkeyatts = %s AND i.indpred IS NULL)
+          AND (SELECT array_agg(a.attname::text ORDER BY k.ord)
+               FROM unnest(i.indkey[0:%s - 1]) WITH ORDINALITY AS k (attnum, ord)
+               JOIN pg_attribute a ON a.attrelid = i.indrelid AND a.attnum = k.attnum) = %s::text[]
+        """,
+        (table, unique, len(columns), len(columns), list(columns))
+    )
+    return cur.fetchone() is not None
+
+
+class Migrator:
+    # Версионные миграции одной схемы. Применённые версии хранятся в <schema>.schema_migrations,
+    # каждая миграция выполняется в своей транзакции вместе с записью о ней.
+    def __init__(self, db: PgConnect, schema: str, migrations: List[Migration],
+                 logger: Optional[Logger] = None) -> None:
+        versions = [migration.version for migration in migrations]
+        if versions != sorted(set(versions)):
+            raise ValueError(f"Migration versions must be unique and ascending: {versions}")
+        self._db = db
+        self._schema = schema
+        self._migrations = migrations
+        self._logger = logger or logging.getLogger(__name__)
+        self._table = f'{schema}.schema_migrations'
+
+    def pending(self) -> List[Migration]:
+        with self._db.connection() as conn:
+            with conn.cursor() as cur:
+                applied = self._applied(cur)
+        return [migration for migration in self._migrations if migration.version not in applied]
+
+    def check(self) -> None:
+        pending = self.pending()
+        if pending:
+            names = ', '.join(f'{migration.version:04d}_{migration.name}' for migration in pending)
+            raise MigrationError(f"Schema {self._schema} has pending migrations: {names}")
+
+    def run(self) -> int:
+        applied_count = 0
+        for migration in self._migrations:
+            with self._db.connection() as conn:
+                with conn.cursor() as cur:
+                    # Реплики сервиса стартуют одновременно: миграцию применяет одна, остальные ждут и пропускают
+                    cur.execute("SELECT pg_advisory_xact_lock(hashtext(%s))", (self._table,))
+                    self._ensure_table(cur)
+                    if migration.version in self._applied(cur):
+                        continue
+
+                    started = datetime.utcnow()
+                    self._logger.info(f"Applying migration {self._schema} {migration.version:04d}_{migration.name}")
+                    migration.apply(cur)
+                    cur.execute(
+                        f"INSERT INTO {self._table} (version, name, applied_at) VALUES (%s, %s, %s)",
+                        (migration.version, migration.name, datetime.utcnow())
+                    )
+            self._logger.info(f"Migration {self._schema} {migration.version:04d}_{migration.name} applied "
+                              f"in {(datetime.utcnow() - started).total_seconds():.1f}s")
+            applied_count += 1
+        return applied_count
+
+    def _ensure_table(self, cur: Cursor) -> None:
+        cur.execute(f"CREATE SCHEMA IF NOT EXISTS {self._schema}")
+        cur.execute(
+            f"""
+            CREATE TABLE IF NOT EXISTS {self._table} (
+                version int NOT NULL PRIMARY KEY,
+                name varchar NOT NULL,
+                applied_at timestamp NOT NULL
+            )
+            """
+        )
+
+    def _applied(self, cur: Cursor) -> Set[int]:
+        cur.execute("SELECT to_regclass(%s) IS NOT NULL", (self._table,))
+        if not cur.fetchone()[0]:
+            return set()
+        cur.execute(f"SELECT version FROM {self._table}")
+        return {row[0] for row in cur.fetchall()}
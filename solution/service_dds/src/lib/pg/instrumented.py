@@ -0,0 +1,98 @@
+from contextlib import asynccontextmanager, contextmanager
+
+import psycopg
+
+from lib.metrics import Metrics, NullMetrics
+
+
+class _RoundTripCounter:
+    # Считает запросы и round trip'ы: вне pipeline каждый запрос — round trip,
+    # в pipeline — только синхронизации (первое чтение результата после отправки и выход из pipeline)
+    metrics: Metrics = NullMetrics()
+    _pending = False
+
+    def in_pipeline(self) -> bool:
+        return bool(self.pgconn.pipeline_status)
+
+    def statement_sent(self) -> None:
+        self.metrics.inc('db_statements_total')
+        if self.in_pipeline():
+            self._pending = True
+        else:
+            self.metrics.inc('db_round_trips_total')
+
+    def result_read(self) -> None:
+        if self._pending and self.in_pipeline():
+            self.metrics.inc('db_round_trips_total')
+            self._pending = False
+
+    def _pipeline_closed(self) -> None:
+        if self._pending:
+            self.metrics.inc('db_round_trips_total')
+        self._pending = False
+
+
+class InstrumentedConnection(_RoundTripCounter, psycopg.Connection):
+    @contextmanager
+    def pipeline(self):
+        self._pending = False
+        try:
+            with super().pipeline() as pipeline:
+                yield pipeline
+        finally:
+            self._pipeline_closed()
+
+
+class InstrumentedAsyncConnection(_RoundTripCounter, psycopg.AsyncConnection):
+    @asynccontextmanager
+    async def pipeline(self):
+        self._pending = False
+        try:
+            async with super().pipeline() as pipeline:
+                yield pipeline
+        finally:
+            self._pipeline_closed()
+
+
+class InstrumentedCursor(psycopg.Cursor):
+    def execute(self, query, params=None, **kwargs):
+        self.connection.statement_sent()
+        return super().execute(query, params, **kwargs)
+
+    def executemany(self, query, params_seq, **kwargs):
+        self.connection.statement_sent()
+        return super().executemany(query, params_seq, **kwargs)
+
+    def fetchone(self):
+        self.connection.result_read()
+        return super().fetchone()
+
+    def fetchmany(self, size: int = 0):
+        self.connection.result_read()
+        return super().fetchmany(size)
+
+    def fetchall(self):
+        self.connection.result_read()
+        return super().fetchall()
+
+
+class InstrumentedAsyncCursor(psycopg.AsyncCursor):
+    async def execute(self, query, params=None, **kwargs):
+        self.connection.statement_sent()
+        return await super().execute(query, params, **kwargs)
+
+    async def executemany(self, query, params_seq, **kwargs):
+        self.connection.statement_sent()
+        return await super().executemany(query, params_seq, **kwargs)
+
+    async def fetchone(self):
+        self.connection.result_read()
+        return await super().fetchone()
+
+    async def fetchmany(self, size: int = 0):
+        self.connection.result_read()
+        return await super().fetchmany(size)
+
+    async def fetchall(self):
+        self.connection.result_read()
+        return await super().fetchall()
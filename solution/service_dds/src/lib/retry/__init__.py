@@ -0,0 +1 @@
+from .retry_policy import RetryPolicy, is_transient  # noqa
@@ -0,0 +1,67 @@
+import asyncio
+import random
+import time
+from typing import Awaitable, Callable, Optional, TypeVar
+
+import psycopg
+from confluent_kafka import KafkaException
+
+from lib.metrics import Metrics, NullMetrics
+
+T = TypeVar('T')
+
+
+def is_transient(error: BaseException) -> bool:
+    # Временные ошибки проходят при повторе: обрыв соединения, таймаут пула,
+    # serialization failure и deadlock (все они в psycopg — OperationalError)
+    if isinstance(error, psycopg.OperationalError):
+        return True
+    if isinstance(error, KafkaException):
+        return error.args[0].retriable() if error.args else False
+    return isinstance(error, (ConnectionError, TimeoutError))
+
+
+class RetryPolicy:
+    def __init__(self,
+                 max_attempts: int = 4,
+                 base_delay: float = 0.5,
+                 max_delay: float = 10.0,
+                 classify: Callable[[BaseException], bool] = is_transient,
+                 metrics: Optional[Metrics] = None
+                 ) -> None:
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.is_transient = classify
+        self._metrics = metrics or NullMetrics()
+
+    def call(self, fn: Callable[..., T], *args, **kwargs) -> T:
+        # Постоянные ошибки пробрасываются сразу, временные — после исчерпания попыток
+        attempt = 1
+        while True:
+            try:
+                return fn(*args, **kwargs)
+            except Exception as e:
+                if not self.is_transient(e) or attempt >= self.max_attempts:
+                    raise
+                self._metrics.inc('retries_total', type=type(e).__name__)
+                time.sleep(self.delay(attempt))
+                attempt += 1
+
+    async def call_async(self, fn: Callable[..., Awaitable[T]], *args, **kwargs) -> T:
+        # То же для корутин: пауза между попытками не блокирует event loop
+        attempt = 1
+        while True:
+            try:
+                return await fn(*args, **kwargs)
+            except Exception as e:
+                if not self.is_transient(e) or attempt >= self.max_attempts:
+                    raise
+                self._metrics.inc('retries_total', type=type(e).__name__)
+                await asyncio.sleep(self.delay(attempt))
+                attempt += 1
+
+    def delay(self, attempt: int) -> float:
+        # Экспоненциальная задержка с jitter, чтобы воркеры не повторяли синхронно
+        delay = min(self.max_delay, self.base_delay * 2 ** (attempt - 1))
+        return delay * random.uniform(0.5, 1.0)
@@ -0,0 +1,56 @@
+import os
+import sys
+from typing import List, Optional
+
+import pytest
+from psycopg.conninfo import conninfo_to_dict
+
+# Тесты запускаются из service_dds: python -m pytest tests
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from lib.pg import PgConnect  # noqa: E402
+from dds_loader.order_messages import OrderMessage  # noqa: E402
+from dds_loader.repository import DdsRepository  # noqa: E402
+
+
+def order_message(order_id: int, user: str = 'u1', restaurant: str = 'r1', status: str = 'OPEN',
+                  products: Optional[List[tuple]] = None, cost: float = 100.5) -> OrderMessage:
+    # products — [(id, name, category, quantity)]
+    products = [('p1', 'Борщ', 'Супы', 1)] if products is None else products
+    return OrderMessage.model_validate({
+        'object_id': order_id,
+        'object_type': 'order',
+        'payload': {
+            'id': order_id,
+            'date': '2024-01-01 10:00:00',
+            'cost': cost,
+            'payment': cost,
+            'status': status,
+            'user': {'id': user, 'name': f'name-{user}', 'login': f'login-{user}'},
+            'restaurant': {'id': restaurant, 'name': f'name-{restaurant}'},
+            'products': [
+                {'id': product_id, 'name': name, 'category': category, 'price': 10, 'quantity': quantity}
+                for product_id, name, category, quantity in products
+            ],
+        },
+    })
+
+
+@pytest.fixture
+def make_order():
+    return order_message
+
+
+@pytest.fixture(scope='session')
+def warehouse_db():
+    # Тесты с Postgres пишут в схему dds и очищают её — только для отдельной базы
+    uri = os.getenv('DDS_TEST_PG_URI')
+    if not uri:
+        pytest.skip('DDS_TEST_PG_URI is not set')
+    params = conninfo_to_dict(uri)
+    db = PgConnect(params.get('host', 'localhost'), int(params.get('port', 5432)), params.get('dbname', ''),
+                   params.get('user', ''), params.get('password', ''), params.get('sslmode', 'prefer'))
+    DdsRepository(db).ensure_schema()
+    yield db
+    db.close()
+
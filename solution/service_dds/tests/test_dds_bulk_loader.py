@@ -0,0 +1,129 @@
+from typing import Dict, List, Set
+
+import pytest
+
+from dds_loader.repository import DdsCache, DdsKeys, DdsRepository
+from dds_loader.repository.dds_bulk_loader import DdsBulkLoader
+from dds_loader.repository.dds_load_plan import DdsLoadPlan
+from dds_loader.repository.dds_tables import HUBS, LINKS, SATELLITES
+
+# Батчи с повторами заказа внутри батча и между батчами, сменой статуса, имени товара и количества;
+# заказ 3 внутри батча уходит от сохранённого статуса и возвращается к нему
+BATCHES = [
+    [(1, 'OPEN', 'Борщ'), (2, 'OPEN', 'Борщ'), (1, 'OPEN', 'Борщ')],
+    [(1, 'CLOSED', 'Борщ'), (3, 'OPEN', 'Борщ'), (4, 'OPEN', 'Борщ с пампушками')],
+    [(5, 'OPEN', 'Борщ'), (1, 'CANCELLED', 'Борщ'), (5, 'CLOSED', 'Борщ'), (3, 'CLOSED', 'Борщ'), (6, 'OPEN', 'Борщ'),
+     (3, 'OPEN', 'Борщ')],
+    [(2, 'OPEN', 'Борщ'), (7, 'CLOSED', 'Борщ')],
+]
+
+
+def batch_orders(make_order, batch) -> list:
+    return [
+        make_order(order_id, user=f'u{order_id % 3}', restaurant=f'r{order_id % 2}', status=status,
+                   products=[('p1', name, 'Супы', order_id), ('p2', 'Плов', 'Горячее', 1), ('p1', name, 'Супы', 1)])
+        for order_id, status, name in batch
+    ]
+
+
+def snapshot(db) -> Dict[str, List[tuple]]:
+    # Содержимое DDS по бизнес-ключам: суррогатные ключи в режиме random у прогонов разные
+    tables = {}
+    with db.connection() as conn:
+        for hub in HUBS.values():
+            extra = ''.join(f', {column}' for column, _ in hub.extra)
+            tables[hub.table] = conn.execute(f"SELECT {hub.bk}{extra} FROM {hub.table} ORDER BY 1").fetchall()
+        for sat in SATELLITES.values():
+            hub = HUBS[sat.hub]
+            columns = ''.join(f', s.{column}' for column, _ in sat.columns)
+            tables[sat.table] = conn.execute(f"""
+                SELECT h.{hub.bk}{columns}, s.{sat.hashdiff}
+                FROM {sat.table} s JOIN {hub.table} h USING ({hub.pk})
+                ORDER BY h.{hub.bk}, s.load_dt
+            """).fetchall()
+        for link in LINKS.values():
+            left, right = HUBS[link.left], HUBS[link.right]
+            extra = ''.join(f', t.{column}' for column, _ in link.extra)
+            tables[link.table] = conn.execute(f"""
+                SELECT l.{left.bk}, r.{right.bk}{extra}
+                FROM {link.table} t JOIN {left.table} l USING ({left.pk}) JOIN {right.table} r USING ({right.pk})
+                ORDER BY 1, 2
+            """).fetchall()
+    return tables
+
+
+def load(db, make_order, mode: str, bulk_batches: Set[int]):
+    with db.connection() as conn:
+        conn.execute(f"TRUNCATE {', '.join(t.table for ts in (HUBS, SATELLITES, LINKS) for t in ts.values())}")
+    repository = DdsRepository(db, DdsKeys(mode), DdsCache(1000))
+    keys = []
+    for i, batch in enumerate(BATCHES):
+        orders = batch_orders(make_order, batch)
+        if i in bulk_batches:
+            with repository.unit_of_work(pipeline=False):
+                keys.append(repository.bulk_load_orders(orders))
+        else:
+            with repository.unit_of_work():
+                keys.append(repository.load_orders(orders))
+    return snapshot(db), keys
+
+
+@pytest.mark.parametrize('mode', [DdsKeys.RANDOM, DdsKeys.HASH])
+@pytest.mark.parametrize('bulk_batches', [{0, 1, 2, 3}, {1, 3}, {0, 2}])
+def test_bulk_load_matches_streaming_plan(warehouse_db, make_order, mode, bulk_batches):
+    expected, expected_keys = load(warehouse_db, make_order, mode, set())
+    assert expected['dds.s_order_status']
+    actual, keys = load(warehouse_db, make_order, mode, bulk_batches)
+
+    assert actual == expected
+    if mode == DdsKeys.HASH:
+        assert keys == expected_keys
+
+
+def test_bulk_load_returns_stored_keys(warehouse_db, make_order):
+    _, keys = load(warehouse_db, make_order, DdsKeys.RANDOM, {0, 1, 2, 3})
+
+    with warehouse_db.connection() as conn:
+        for batch, batch_keys in zip(BATCHES, keys):
+            for msg, order_keys in zip(batch_orders(make_order, batch), batch_keys):
+                stored = conn.execute(
+                    "SELECT h_order_pk::text FROM dds.h_order WHERE order_id = %s", (str(msg.object_id),)).fetchone()
+                assert stored == (order_keys.order_pk,)
+                stored = conn.execute(
+                    "SELECT h_user_pk::text FROM dds.h_user WHERE user_id = %s", (msg.payload.user.id,)).fetchone()
+                assert stored == (order_keys.user_pk,)
+
+
+
+@pytest.mark.parametrize('mode', [DdsKeys.RANDOM, DdsKeys.HASH])
+@pytest.mark.parametrize('bulk', [False, True])
+def test_reload_fills_missing_link_quantity(warehouse_db, make_order, mode, bulk):
+    expected, _ = load(warehouse_db, make_order, mode, set())
+    # Линки, записанные до появления колонки quantity
+    with warehouse_db.connection() as conn:
+        conn.execute("UPDATE dds.l_order_product SET quantity = NULL")
+
+    repository = DdsRepository(warehouse_db, DdsKeys(mode), DdsCache(1000))
+    for batch in BATCHES:
+        with repository.unit_of_work(pipeline=False if bulk else None):
+            load_batch = repository.bulk_load_orders if bulk else repository.load_orders
+            load_batch(batch_orders(make_order, batch))
+
+    assert snapshot(warehouse_db)['dds.l_order_product'] == expected['dds.l_order_product']
+
+
+def test_stale_stage_tables_are_recreated(warehouse_db, make_order):
+    expected, _ = load(warehouse_db, make_order, DdsKeys.HASH, set())
+    keys = DdsKeys(DdsKeys.HASH)
+    loader = DdsBulkLoader(keys, DdsLoadPlan(keys))
+    with warehouse_db.connection() as conn:
+        conn.execute("UPDATE dds.l_order_product SET quantity = NULL")
+        # Стадия линка, созданная на этом соединении кодом до появления quantity
+        conn.execute("CREATE TEMP TABLE stage_l_order_product (pk uuid, left_bk varchar, right_bk varchar) "
+                     "ON COMMIT DELETE ROWS")
+        for batch in BATCHES:
+            with DdsCache().transaction() as tx:
+                loader.load_orders(conn, tx, batch_orders(make_order, batch))
+            conn.commit()
+
+    assert snapshot(warehouse_db)['dds.l_order_product'] == expected['dds.l_order_product']
@@ -0,0 +1,55 @@
+import logging
+
+from dds_loader.repository import DdsCache, DdsHashdiffIndex, DdsKeys, DdsRepository
+from dds_loader.repository.dds_tables import HUBS, LINKS, SATELLITES
+
+LOGGER = logging.getLogger(__name__)
+TABLE = 'dds.s_order_status'
+
+
+def truncate(db) -> None:
+    with db.connection() as conn:
+        conn.execute(f"TRUNCATE {', '.join(t.table for ts in (HUBS, SATELLITES, LINKS) for t in ts.values())}")
+
+
+def order_pk(make_order, order_id: int) -> str:
+    return DdsKeys(DdsKeys.HASH).hub_key(make_order(order_id).object_id)
+
+
+def test_index_covers_tables_only_after_reload(warehouse_db, make_order):
+    truncate(warehouse_db)
+    repository = DdsRepository(warehouse_db, DdsKeys(DdsKeys.HASH), DdsCache(1000))
+    with repository.unit_of_work():
+        repository.load_orders([make_order(1, status='CLOSED')])
+    index = DdsHashdiffIndex(warehouse_db, LOGGER, [TABLE])
+
+    assert not index.covers(TABLE)
+    assert index.lookup(TABLE, order_pk(make_order, 1)) == (False, None)
+    index.reload()
+    index.wait()
+    known, hashdiff = index.lookup(TABLE, order_pk(make_order, 1))
+    assert known and hashdiff
+    assert index.lookup(TABLE, order_pk(make_order, 2)) == (True, None)
+
+
+def test_values_published_while_loading_survive_the_snapshot(warehouse_db, make_order):
+    truncate(warehouse_db)
+    index = DdsHashdiffIndex(warehouse_db, LOGGER, [TABLE])
+    load = index._load
+    published = {order_pk(make_order, 1): 'ab' * 16}
+    forgotten = order_pk(make_order, 2)
+
+    def load_with_concurrent_commits(sat):
+        # Коммиты воркеров приходят, пока снимок читается из БД: индекс ещё не отвечает за таблицу
+        hashes = load(sat)
+        assert not index.publish(TABLE, published)
+        assert not index.forget(TABLE, [forgotten])
+        return hashes
+
+    index._load = load_with_concurrent_commits
+    index.reload()
+    index.wait()
+
+    assert index.lookup(TABLE, order_pk(make_order, 1)) == (True, 'ab' * 16)
+    assert index.lookup(TABLE, forgotten) == (False, None)
+    assert index.lookup(TABLE, order_pk(make_order, 3)) == (True, None)
@@ -0,0 +1,169 @@
+import asyncio
+from typing import Dict, List, Set
+
+import pytest
+
+from lib.keys import md5_uuid
+from lib.pg import Statement, run_plan, run_plan_async
+from dds_loader.repository import DdsCache, DdsKeys
+from dds_loader.repository.dds_load_plan import (DdsLoadPlan, LoadClock, _hub_bulk_sql, _link_bulk_sql,
+                                                 _sat_bulk_sql, _sat_latest_sql)
+from dds_loader.repository.dds_tables import HUBS, LINKS, SATELLITES
+
+
+class FakeWarehouse:
+    # Исполняет раунды плана в памяти: хабы возвращают ключи, сателлиты помнят последнюю версию.
+    # hidden — бизнес-ключи, которые вставка хаба не вернёт, как если бы их вставила параллельная транзакция
+    def __init__(self, hidden: Set[str] = frozenset()) -> None:
+        self.rounds: List[List[Statement]] = []
+        self.hidden = set(hidden)
+        self.hub_pks: Dict[str, Dict[str, str]] = {hub.table: {} for hub in HUBS.values()}
+        self.sat_rows: Dict[str, List[tuple]] = {sat.table: [] for sat in SATELLITES.values()}
+        self.links: Dict[str, List[tuple]] = {link.table: [] for link in LINKS.values()}
+
+    def __call__(self, statements: List[Statement]) -> List[list]:
+        self.rounds.append(statements)
+        return [self._execute(statement) for statement in statements]
+
+    async def execute_async(self, statements: List[Statement]) -> List[list]:
+        return self(statements)
+
+    def latest(self, table: str) -> Dict[str, str]:
+        latest = {}
+        for pk, _, load_dt, hashdiff in sorted(self.sat_rows[table], key=lambda row: row[2]):
+            latest[pk] = hashdiff
+        return latest
+
+    def _execute(self, statement: Statement):
+        for hub in HUBS.values():
+            if statement.sql in (_hub_bulk_sql(hub, False), _hub_bulk_sql(hub, True)):
+                known = self.hub_pks[hub.table]
+                for pk, bk in zip(statement.params['pk'], statement.params['bk']):
+                    known.setdefault(bk, pk)
+                if not statement.fetch:
+                    return None
+                return [(known[bk], bk) for bk in statement.params['bk'] if bk not in self.hidden]
+            if statement.sql.startswith(f"SELECT {hub.pk}, {hub.bk} FROM {hub.table} "):
+                known = self.hub_pks[hub.table]
+                return [(known[bk], bk) for bk in statement.params[0]]
+        for sat in SATELLITES.values():
+            if statement.sql == _sat_latest_sql(sat):
+                latest = self.latest(sat.table)
+                return [(pk, latest[pk]) for pk in statement.params[0] if pk in latest]
+            if statement.sql == _sat_bulk_sql(sat):
+                params = statement.params
+                values = list(zip(*(params[column] for column, _ in sat.columns)))
+                self.sat_rows[sat.table].extend(zip(params['pk'], values, params['load_dt'], params['hashdiff']))
+                return None
+        for link in LINKS.values():
+            if statement.sql in (_link_bulk_sql(link, False), _link_bulk_sql(link, True)):
+                self.links[link.table].extend(zip(statement.params['left'], statement.params['right']))
+                return None
+        raise AssertionError(f'Unexpected statement: {statement.sql}')
+
+
+def load(plan: DdsLoadPlan, cache: DdsCache, warehouse: FakeWarehouse, orders):
+    with cache.transaction() as tx:
+        return run_plan(plan.load_orders(tx, orders), warehouse)
+
+
+def test_random_keys_are_read_back_from_hubs(make_order):
+    warehouse = FakeWarehouse()
+    keys = load(DdsLoadPlan(DdsKeys(DdsKeys.RANDOM)), DdsCache(), warehouse, [make_order(1), make_order(2)])
+
+    hubs, latest, satellites, links = warehouse.rounds
+    assert all(statement.fetch for statement in hubs + latest)
+    assert not any(statement.fetch for statement in satellites + links)
+    assert keys[0].order_pk == warehouse.hub_pks['dds.h_order']['1']
+    assert keys[1].user_pk == keys[0].user_pk == warehouse.hub_pks['dds.h_user']['u1']
+    assert keys[0].product_pks == [warehouse.hub_pks['dds.h_product']['p1']]
+
+
+def test_hash_keys_are_not_read_back(make_order):
+    warehouse = FakeWarehouse()
+    keys = load(DdsLoadPlan(DdsKeys(DdsKeys.HASH)), DdsCache(), warehouse, [make_order(1)])
+
+    assert not any(statement.fetch for statement in warehouse.rounds[0])
+    assert keys[0].order_pk == md5_uuid('1')
+    assert keys[0].restaurant_pk == md5_uuid('r1')
+
+
+def test_hub_keys_missing_from_returning_are_reread(make_order):
+    warehouse = FakeWarehouse(hidden={'u2'})
+    keys = load(DdsLoadPlan(DdsKeys(DdsKeys.RANDOM)), DdsCache(), warehouse,
+                [make_order(1, user='u1'), make_order(2, user='u2')])
+
+    reread = warehouse.rounds[1]
+    assert len(reread) == 1
+    assert reread[0].params == (['u2'],)
+    assert keys[1].user_pk == warehouse.hub_pks['dds.h_user']['u2']
+
+
+def test_satellite_history_within_batch_is_kept(make_order):
+    warehouse = FakeWarehouse()
+    load(DdsLoadPlan(DdsKeys(DdsKeys.HASH), clock=LoadClock()), DdsCache(), warehouse, [
+        make_order(1, status='OPEN'), make_order(1, status='CLOSED'), make_order(1, status='OPEN')])
+
+    rows = warehouse.sat_rows['dds.s_order_status']
+    assert [values for _, values, _, _ in rows] == [('OPEN',), ('CLOSED',), ('OPEN',)]
+    load_dts = [load_dt for _, _, load_dt, _ in rows]
+    assert load_dts == sorted(set(load_dts))
+
+
+def test_repeated_batch_writes_nothing(make_order):
+    warehouse = FakeWarehouse()
+    plan = DdsLoadPlan(DdsKeys(DdsKeys.RANDOM))
+    cache = DdsCache()
+    orders = [make_order(1), make_order(2, user='u2', restaurant='r2')]
+    first = load(plan, cache, warehouse, orders)
+    warehouse.rounds.clear()
+    second = load(plan, cache, warehouse, orders)
+
+    assert second == first
+    # Хабы, линки и сателлиты заказа известны кэшу; последние версии остальных сателлитов читаются из БД
+    statements = [statement for statements in warehouse.rounds for statement in statements]
+    assert {statement.sql for statement in statements} == {
+        _sat_latest_sql(sat) for sat in SATELLITES.values() if sat.hub != 'order'}
+
+
+def test_only_changed_satellites_are_written(make_order):
+    warehouse = FakeWarehouse()
+    plan = DdsLoadPlan(DdsKeys(DdsKeys.HASH))
+    load(plan, DdsCache(), warehouse, [make_order(1)])
+    # Новый кэш — как после перезапуска: последние версии читаются из БД
+    load(plan, DdsCache(), warehouse, [make_order(2, products=[('p1', 'Борщ с пампушками', 'Супы', 1)])])
+
+    assert [values for _, values, _, _ in warehouse.sat_rows['dds.s_product_names']] == [
+        ('Борщ',), ('Борщ с пампушками',)]
+    assert len(warehouse.sat_rows['dds.s_user_names']) == 1
+    assert len(warehouse.sat_rows['dds.s_restaurant_names']) == 1
+
+
+def test_failed_transaction_is_not_cached(make_order):
+    warehouse = FakeWarehouse()
+    plan = DdsLoadPlan(DdsKeys(DdsKeys.HASH))
+    cache = DdsCache()
+    with pytest.raises(RuntimeError):
+        with cache.transaction() as tx:
+            run_plan(plan.load_orders(tx, [make_order(1)]), warehouse)
+            raise RuntimeError('commit failed')
+    warehouse.rounds.clear()
+    load(plan, cache, warehouse, [make_order(1)])
+
+    # Ключи хабов из отменённой транзакции вставляются заново
+    assert _hub_bulk_sql(HUBS['order'], True) in {statement.sql for statement in warehouse.rounds[0]}
+
+
+def test_async_execution_sends_the_same_statements(make_order):
+    orders = [make_order(1), make_order(2, user='u2')]
+    sync_warehouse = FakeWarehouse()
+    load(DdsLoadPlan(DdsKeys(DdsKeys.HASH)), DdsCache(), sync_warehouse, orders)
+
+    async_warehouse = FakeWarehouse()
+    with DdsCache().transaction() as tx:
+        asyncio.run(run_plan_async(DdsLoadPlan(DdsKeys(DdsKeys.HASH)).load_orders(tx, orders),
+                                   async_warehouse.execute_async))
+
+    assert [[s.sql for s in statements] for statements in async_warehouse.rounds] == [
+        [s.sql for s in statements] for statements in sync_warehouse.rounds]
+    assert async_warehouse.hub_pks == sync_warehouse.hub_pks
@@ -0,0 +1,207 @@
+import logging
+from contextlib import contextmanager
+from typing import List
+
+import psycopg
+import pytest
+
+from lib.kafka_connect import DeadLetterQueue, KafkaMessage
+from lib.metrics import Metrics
+from lib.retry import RetryPolicy
+from dds_loader.async_dds_message_processor_job import AsyncDdsMessageProcessor
+from dds_loader.dds_message_processor_job import DdsMessageProcessor
+from dds_loader.repository import DdsCache, DdsHashdiffIndex, DdsKeys, DdsRepository, OrderKeys
+from dds_loader.repository.dds_tables import HUBS, LINKS, SATELLITES, hub_satellites
+
+LOGGER = logging.getLogger(__name__)
+
+
+class FakeConsumer:
+    def __init__(self, messages: List[KafkaMessage]) -> None:
+        self.messages = messages
+        self.commits = 0
+        self.rewinds = 0
+        self.listeners = []
+
+    def consume_batch(self, max_messages: int, timeout: float = 3.0) -> List[KafkaMessage]:
+        return self.messages
+
+    def add_rebalance_listener(self, listener) -> None:
+        self.listeners.append(listener)
+
+    def commit(self) -> None:
+        self.commits += 1
+
+    def rewind(self) -> None:
+        self.rewinds += 1
+
+
+class FakeProducer:
+    topic = 'dlq'
+
+    def __init__(self) -> None:
+        self.messages: List[tuple] = []
+
+    def produce(self, value, key=None, headers=None) -> None:
+        self.messages.append((value, key, dict(headers or ())))
+
+    def flush(self) -> None:
+        pass
+
+
+class FakeRepository:
+    # Падает на любом батче с заказом из poison; error — исключение для этих заказов
+    def __init__(self, poison=(), error: Exception = KeyError('poison')) -> None:
+        self.poison = set(poison)
+        self.error = error
+        self._keys = DdsKeys(DdsKeys.HASH)
+
+    @contextmanager
+    def unit_of_work(self, pipeline=None):
+        yield self
+
+    def load_orders(self, orders) -> List[OrderKeys]:
+        ids = [msg.object_id for msg in orders]
+        if self.poison.intersection(ids):
+            raise self.error
+        return [
+            OrderKeys(self._keys.hub_key(msg.object_id), self._keys.hub_key(msg.payload.user.id),
+                      self._keys.hub_key(msg.payload.restaurant.id),
+                      [self._keys.hub_key(product.id) for product in msg.payload.products])
+            for msg in orders
+        ]
+
+    def drop_satellite_state(self) -> None:
+        pass
+
+
+def kafka_message(offset: int, value) -> KafkaMessage:
+    return KafkaMessage('orders', 0, offset, None, value, None if value is not None else 'bad json', b'raw')
+
+
+def processor(consumer, repository, dead_letters_producer=None, metrics=None):
+    metrics = metrics or Metrics()
+    return DdsMessageProcessor(
+        consumer, FakeProducer(), repository, LOGGER, metrics,
+        dead_letters=DeadLetterQueue(dead_letters_producer, 'dds', LOGGER, metrics),
+        retry=RetryPolicy(max_attempts=2, base_delay=0, metrics=metrics))
+
+
+def produced_ids(proc: DdsMessageProcessor) -> List[int]:
+    return [value.object_id for value, _, _ in proc._producer.messages]
+
+
+def test_poison_message_goes_to_dead_letters(make_order):
+    consumer = FakeConsumer([kafka_message(i, make_order(i)) for i in range(8)])
+    dead_letters = FakeProducer()
+    metrics = Metrics()
+    proc = processor(consumer, FakeRepository(poison={5}), dead_letters, metrics)
+
+    assert proc.run() == 8
+    assert produced_ids(proc) == [0, 1, 2, 3, 4, 6, 7]
+    [(raw, _, headers)] = dead_letters.messages
+    assert raw == b'raw'
+    assert headers['dlq.stage'] == 'process'
+    assert headers['dlq.source.offset'] == '5'
+    assert consumer.commits == 1
+    # 8 -> 4 -> 2 -> 1: битое сообщение находится за три деления
+    assert 'processor_bisections_total 3' in metrics.render()
+
+
+def test_undecodable_message_goes_to_dead_letters(make_order):
+    consumer = FakeConsumer([kafka_message(0, make_order(0)), kafka_message(1, None)])
+    dead_letters = FakeProducer()
+    proc = processor(consumer, FakeRepository(), dead_letters)
+
+    proc.run()
+    assert produced_ids(proc) == [0]
+    assert dead_letters.messages[0][2]['dlq.stage'] == 'decode'
+    assert consumer.commits == 1
+
+
+def test_transient_error_rewinds_without_commit(make_order):
+    consumer = FakeConsumer([kafka_message(i, make_order(i)) for i in range(4)])
+    dead_letters = FakeProducer()
+    repository = FakeRepository(poison={2}, error=psycopg.OperationalError('connection lost'))
+    proc = processor(consumer, repository, dead_letters)
+
+    with pytest.raises(psycopg.OperationalError):
+        proc.run()
+    assert consumer.rewinds == 1
+    assert consumer.commits == 0
+    assert dead_letters.messages == []
+    assert produced_ids(proc) == []
+
+
+def test_only_latest_copy_of_order_is_produced(make_order):
+    consumer = FakeConsumer([
+        kafka_message(0, make_order(1, status='OPEN')),
+        kafka_message(1, make_order(2)),
+        kafka_message(2, make_order(1, status='CLOSED')),
+    ])
+    proc = processor(consumer, FakeRepository())
+
+    proc.run()
+    assert [(value.object_id, value.payload.status) for value, _, _ in proc._producer.messages] == [
+        (2, 'OPEN'), (1, 'CLOSED')]
+
+
+def order_statuses(db, order_id: int) -> List[str]:
+    with db.connection() as conn:
+        return [status for status, in conn.execute("""
+            SELECT s.status FROM dds.s_order_status s JOIN dds.h_order h USING (h_order_pk)
+            WHERE h.order_id = %s ORDER BY s.load_dt
+        """, (str(order_id),)).fetchall()]
+
+
+@pytest.mark.parametrize('indexed', [False, True])
+def test_assign_drops_satellite_versions_written_by_others(warehouse_db, make_order, indexed):
+    with warehouse_db.connection() as conn:
+        conn.execute(f"TRUNCATE {', '.join(t.table for ts in (HUBS, SATELLITES, LINKS) for t in ts.values())}")
+    index = DdsHashdiffIndex(warehouse_db, LOGGER, hub_satellites('order')) if indexed else None
+    consumer = FakeConsumer([kafka_message(0, make_order(1, status='OPEN'))])
+    proc = processor(consumer, DdsRepository(warehouse_db, DdsKeys(DdsKeys.HASH), DdsCache(1000, index)))
+
+    def assign():
+        for listener in consumer.listeners:
+            listener('assign', [0])
+        if index is not None:
+            index.wait()
+            assert index.covers('dds.s_order_status')
+
+    assign()
+    proc.run()
+
+    # Пока партиция была у другого consumer'а, он закрыл заказ
+    other = DdsRepository(warehouse_db, DdsKeys(DdsKeys.HASH), DdsCache(1000))
+    with other.unit_of_work():
+        other.load_orders([make_order(1, status='CLOSED')])
+    assign()
+
+    # Заказ снова открыт: кэш не должен принять OPEN за текущую версию
+    consumer.messages = [kafka_message(1, make_order(1, status='OPEN'))]
+    proc.run()
+    assert order_statuses(warehouse_db, 1) == ['OPEN', 'CLOSED', 'OPEN']
+
+
+def partition(messages: List[KafkaMessage], concurrency: int) -> List[List[int]]:
+    proc = AsyncDdsMessageProcessor.__new__(AsyncDdsMessageProcessor)
+    proc._concurrency = concurrency
+    return [[message.value.object_id for message in part] for part in proc._partition(messages)]
+
+
+def test_async_partition_keeps_shared_hubs_together(make_order):
+    def product(product_id: str) -> List[tuple]:
+        return [(product_id, 'name', 'category', 1)]
+
+    messages = [kafka_message(i, value) for i, value in enumerate([
+        make_order(0, user='u0', restaurant='r0', products=product('p0')),
+        make_order(1, user='u1', restaurant='r1', products=product('p1')),
+        make_order(2, user='u2', restaurant='r2', products=product('p0')),
+        make_order(3, user='u3', restaurant='r3', products=product('p3')),
+        make_order(4, user='u1', restaurant='r4', products=[]),
+        make_order(5, user='u5', restaurant='r3', products=product('p5')),
+    ])]
+
+    assert sorted(partition(messages, 3)) == [[0, 2], [1, 4], [3, 5]]
+    assert partition(messages, 1) == [[0, 1, 2, 3, 4, 5]]
@@ -0,0 +1,47 @@
+from dds_loader.repository.order_batch import OrderBatch
+
+
+def test_repeated_values_are_coalesced(make_order):
+    batch = OrderBatch([
+        make_order(1, status='OPEN'),
+        make_order(1, status='OPEN'),
+        make_order(1, status='CLOSED'),
+        make_order(1, status='OPEN'),
+    ])
+
+    assert batch.satellites['order_status'] == [('1', ('OPEN',)), ('1', ('CLOSED',)), ('1', ('OPEN',))]
+    assert batch.satellites['order_cost'] == [('1', (100.5, 100.5))]
+    # Из четырёх копий для пяти сателлитов остаются только переходы
+    assert batch.coalesced == 4 * 5 - 3 - 4
+    assert len(batch.orders) == 4
+
+
+def test_coalescing_compares_canonical_form(make_order):
+    batch = OrderBatch([make_order(1, cost=100), make_order(1, cost=100.0)])
+
+    # 100 и 100.0 дают разный hashdiff, поэтому вторая строка остаётся
+    assert batch.satellites['order_cost'] == [('1', (100, 100)), ('1', (100.0, 100.0))]
+
+
+def test_keys_are_shared_across_orders(make_order):
+    batch = OrderBatch([
+        make_order(1, user='u1', products=[('p1', 'Борщ', 'Супы', 1), ('p2', 'Плов', 'Горячее', 1)]),
+        make_order(2, user='u1', products=[('p2', 'Плов', 'Горячее', 1)]),
+    ])
+
+    assert list(batch.hubs['order']) == ['1', '2']
+    assert list(batch.hubs['user']) == ['u1']
+    assert list(batch.hubs['product']) == ['p1', 'p2']
+    assert list(batch.hubs['category']) == ['Супы', 'Горячее']
+    assert batch.satellites['product_names'] == [('p1', ('Борщ',)), ('p2', ('Плов',))]
+    assert list(batch.links['product_restaurant']) == [('p1', 'r1'), ('p2', 'r1')]
+    assert batch.orders[0].product_ids == ['p1', 'p2']
+
+
+def test_order_product_quantity_is_summed_and_first_copy_wins(make_order):
+    batch = OrderBatch([
+        make_order(1, products=[('p1', 'Борщ', 'Супы', 2), ('p1', 'Борщ', 'Супы', 3)]),
+        make_order(1, status='CLOSED', products=[('p1', 'Борщ', 'Супы', 7)]),
+    ])
+
+    assert batch.links['order_product'] == {('1', 'p1'): (5,)}
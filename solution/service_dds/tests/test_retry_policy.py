@@ -0,0 +1,84 @@
+import asyncio
+
+import psycopg
+import pytest
+from confluent_kafka import KafkaError, KafkaException
+
+from lib.retry import RetryPolicy, is_transient
+
+
+@pytest.mark.parametrize('error', [
+    psycopg.OperationalError('connection lost'),
+    psycopg.errors.SerializationFailure('could not serialize access'),
+    psycopg.errors.DeadlockDetected('deadlock detected'),
+    KafkaException(KafkaError(KafkaError._TRANSPORT, retriable=True)),
+    ConnectionResetError(),
+    TimeoutError(),
+])
+def test_transient_errors(error):
+    assert is_transient(error)
+
+
+@pytest.mark.parametrize('error', [
+    psycopg.errors.UniqueViolation('duplicate key'),
+    psycopg.ProgrammingError('syntax error'),
+    KafkaException(KafkaError(KafkaError.TOPIC_AUTHORIZATION_FAILED)),
+    KafkaException(),
+    KeyError('product_id'),
+    ValueError('bad message'),
+])
+def test_permanent_errors(error):
+    assert not is_transient(error)
+
+
+class Flaky:
+    def __init__(self, failures: int, error: Exception) -> None:
+        self.failures = failures
+        self.error = error
+        self.calls = 0
+
+    def __call__(self) -> str:
+        self.calls += 1
+        if self.calls <= self.failures:
+            raise self.error
+        return 'ok'
+
+
+def test_transient_error_is_retried():
+    fn = Flaky(2, psycopg.OperationalError('connection lost'))
+
+    assert RetryPolicy(max_attempts=3, base_delay=0).call(fn) == 'ok'
+    assert fn.calls == 3
+
+
+def test_retries_are_limited():
+    fn = Flaky(3, psycopg.OperationalError('connection lost'))
+
+    with pytest.raises(psycopg.OperationalError):
+        RetryPolicy(max_attempts=3, base_delay=0).call(fn)
+    assert fn.calls == 3
+
+
+def test_permanent_error_is_not_retried():
+    fn = Flaky(1, KeyError('product_id'))
+
+    with pytest.raises(KeyError):
+        RetryPolicy(max_attempts=3, base_delay=0).call(fn)
+    assert fn.calls == 1
+
+
+def test_async_call_retries():
+    fn = Flaky(1, TimeoutError())
+
+    async def call():
+        return fn()
+
+    assert asyncio.run(RetryPolicy(max_attempts=2, base_delay=0).call_async(call)) == 'ok'
+    assert fn.calls == 2
+
+
+def test_delay_is_capped():
+    policy = RetryPolicy(base_delay=1, max_delay=4)
+
+    assert 0.5 <= policy.delay(1) <= 1
+    assert 2 <= policy.delay(10) <= 4
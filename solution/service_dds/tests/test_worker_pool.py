@@ -0,0 +1,30 @@
+import logging
+import threading
+
+from lib.streaming import StreamLoop, WorkerPool
+
+LOGGER = logging.getLogger(__name__)
+
+
+def test_stop_reports_workers_still_inside_a_batch():
+    release = threading.Event()
+    started = threading.Event()
+
+    def stuck_batch(batch_size: int, timeout: float) -> int:
+        started.set()
+        release.wait()
+        return 0
+
+    def idle_batch(batch_size: int, timeout: float) -> int:
+        return 0
+
+    pool = WorkerPool([
+        StreamLoop(idle_batch, lambda: 0, LOGGER, poll_timeout=0.01),
+        StreamLoop(stuck_batch, lambda: 0, LOGGER, poll_timeout=0.01),
+    ])
+    pool.start()
+    assert started.wait(5)
+
+    assert pool.stop(timeout=0.1) == [1]
+    release.set()
+    assert pool.stop(timeout=5) == []